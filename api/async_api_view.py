@@ -0,0 +1,107 @@
+import inspect
+import time
+
+from rest_framework import generics
+
+from api.metrics import registry
+from api.paystack.retries import deadline_scope
+from api.tracing import TRACEPARENT_HEADER, tracer
+
+REQUESTS = registry.counter(
+    "http_requests_total", "Requests handled, by view, method and status code.", ["view", "method", "status"])
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "Time spent handling requests, by view and method.", ["view", "method"])
+
+
+class AsyncGenericAPIView(generics.GenericAPIView):
+    """
+    A `GenericAPIView` whose handlers are coroutines.
+
+    Django only runs a class-based view natively on the event loop when all of its
+    handlers are `async def`, but DRF's `dispatch` is synchronous. This overrides
+    `dispatch` so that the handler is awaited, letting views await I/O
+    (e.g. calls to Paystack) instead of blocking a thread from the sync_to_async pool.
+
+    Everything `initial()` does (content negotiation, authentication, permissions)
+    runs inline on the event loop, so it must not block.
+    Authentication is therefore disabled by default, which matches the API
+    being unauthenticated by design. Throttles are checked after `initial()`, and
+    those with an `aallow_request` coroutine (see `api.throttling`) are awaited.
+
+    If `request_deadline` is set, calls to Paystack made by the handler (see
+    `api.paystack.retries`) must be done within that many seconds.
+    """
+    authentication_classes = ()
+    permission_classes = ()
+    request_deadline: float | None = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        started_at = time.perf_counter()
+        view = type(self).__name__
+        with tracer.start_request_span(
+                f"{request.method} {view}", request.headers.get(TRACEPARENT_HEADER),
+                {"http.request.method": request.method, "url.path": request.path}) as span:
+            response = await self._dispatch(request, *args, **kwargs)
+            if span is not None:
+                span.set_attribute("http.response.status_code", response.status_code)
+                response["X-Trace-Id"] = span.trace_id
+                # Otherwise the response is rendered after the span ends
+                if hasattr(response, "render"):
+                    with tracer.start_span("render"):
+                        response.render()
+
+        REQUEST_DURATION.labels(view, request.method).observe(time.perf_counter() - started_at)
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        return response
+
+    def check_throttles(self, request):
+        # Throttles are checked by `acheck_throttles` instead, as they may await a shared cache
+        pass
+
+    async def acheck_throttles(self, request):
+        """Like `check_throttles`, but awaiting `aallow_request` for throttles that have it."""
+        throttle_durations = []
+        for throttle in self.get_throttles():
+            aallow_request = getattr(throttle, "aallow_request", None)
+            if aallow_request is not None:
+                allowed = await aallow_request(request, self)
+            else:
+                allowed = throttle.allow_request(request, self)
+            if not allowed:
+                throttle_durations.append(throttle.wait())
+
+        if throttle_durations:
+            durations = [duration for duration in throttle_durations if duration is not None]
+            self.throttled(request, max(durations, default=None))
+
+    async def _dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            self.initial(request, *args, **kwargs)
+            await self.acheck_throttles(request)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(),
+                                  self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            # `options` and `http_method_not_allowed` are inherited synchronous handlers
+            if inspect.isawaitable(response):
+                if self.request_deadline is None:
+                    response = await response
+                else:
+                    with deadline_scope(self.request_deadline):
+                        response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
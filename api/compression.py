@@ -0,0 +1,174 @@
+"""
+Negotiated response compression.
+
+Responses with a textual body (JSON, NDJSON, CSV, YAML, ...) of at least
+`RESPONSE_COMPRESSION_MIN_SIZE` bytes, such as bulk status lookups and exports, are compressed
+with brotli (if the `brotli` package is installed) or gzip, whichever the client prefers by the
+q-values of its `Accept-Encoding` header, and brotli if it has no preference. Smaller bodies
+are not worth the CPU time, and responses that already have a `Content-Encoding` (e.g. the
+precompressed schema) are left alone.
+
+Unlike Django's `GZipMiddleware`, this middleware runs on the event loop for async views
+rather than in a thread, and compresses streamed responses (e.g. exports) as one stream,
+flushed after every chunk, rather than each chunk on its own.
+"""
+import gzip
+import logging
+import re
+import zlib
+from functools import lru_cache
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+from api.metrics import registry
+from restful_payment_gateway_api.settings import \
+    (RESPONSE_COMPRESSION_ENABLED, RESPONSE_COMPRESSION_MIN_SIZE, RESPONSE_COMPRESSION_GZIP_LEVEL,
+     RESPONSE_COMPRESSION_BROTLI_QUALITY)
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+    if RESPONSE_COMPRESSION_ENABLED:
+        logger.warning("brotli is not installed, so responses are only compressed with gzip")
+
+COMPRESSED_RESPONSES = registry.counter(
+    "http_responses_compressed_total", "Responses compressed, by encoding.", ["encoding"])
+
+# The encodings responses can be compressed with, preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+_compressible_content_type = re.compile(
+    r"^(text/|application/(json|x-ndjson|yaml|vnd\.oai\.openapi)|application/[^;]*\+json)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
+def negotiate_encoding(accept_encoding: str, encodings: tuple[str, ...] = ENCODINGS) -> str | None:
+    """
+    The one of `encodings` that the client prefers by its `Accept-Encoding` header,
+    the first one if it has no preference, or `None` if it accepts none of them.
+    """
+    q_values = {}
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q_value = 1.0
+        parameter = parameters.strip().lower()
+        if parameter.startswith("q="):
+            try:
+                q_value = float(parameter[2:])
+            except ValueError:
+                q_value = 0.0
+        q_values[name] = q_value
+
+    best, best_q_value = None, 0.0
+    for encoding in encodings:
+        q_value = q_values.get(encoding, q_values.get("*", 0.0))
+        if q_value > best_q_value:
+            best, best_q_value = encoding, q_value
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=RESPONSE_COMPRESSION_BROTLI_QUALITY)
+    # The same mtime every time, so the compressed body is deterministic
+    return gzip.compress(data, compresslevel=RESPONSE_COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    """Compresses a stream of chunks, flushing after every chunk so that it is sent right away."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=RESPONSE_COMPRESSION_BROTLI_QUALITY)
+        else:
+            # A gzip header and trailer around the deflate stream
+            self._compressor = zlib.compressobj(RESPONSE_COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+    def compress_sequence(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            if chunk:
+                yield self.compress(chunk)
+        yield self.finish()
+
+    async def acompress_sequence(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            if chunk:
+                yield self.compress(chunk)
+        yield self.finish()
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not RESPONSE_COMPRESSION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    @staticmethod
+    def process_response(request, response):
+        if response.has_header("Content-Encoding") or not _compressible_content_type.match(
+                response.get("Content-Type", "")):
+            return response
+        if not response.streaming and len(response.content) < RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = negotiate_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            compressor = StreamCompressor(encoding)
+            if response.is_async:
+                response.streaming_content = compressor.acompress_sequence(response.streaming_content)
+            else:
+                response.streaming_content = compressor.compress_sequence(response.streaming_content)
+            # The compressed length is not known until it has been streamed
+            del response.headers["Content-Length"]
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        # The compressed body is a different representation, so a strong ETag must not match it
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        COMPRESSED_RESPONSES.labels(encoding).inc()
+        return response
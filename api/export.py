@@ -0,0 +1,113 @@
+import csv
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Callable, Iterator
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+
+from api.models import Payment
+from restful_payment_gateway_api.settings import PAYMENTS_EXPORT_CHUNK_SIZE
+
+EXPORT_FIELDS = (
+    "reference", "customer_name", "customer_email", "amount", "status", "paid_at", "initiated_at")
+
+
+def get_export_queryset(
+        status: str | None = None,
+        initiated_after: datetime | None = None,
+        initiated_before: datetime | None = None) -> QuerySet:
+    """Payments to export, as dictionaries ordered by `(initiated_at, id)`."""
+    queryset = Payment.objects.all()
+    if status is not None:
+        queryset = queryset.filter(status=status)
+    if initiated_after is not None:
+        queryset = queryset.filter(initiated_at__gte=initiated_after)
+    if initiated_before is not None:
+        queryset = queryset.filter(initiated_at__lt=initiated_before)
+    return queryset.order_by("initiated_at", "id").values("id", *EXPORT_FIELDS)
+
+
+def fetch_chunk(queryset: QuerySet, after: dict | None, chunk_size: int) -> list[dict]:
+    """
+    Fetches the `chunk_size` payments that follow the row `after` (keyset pagination).
+    Unlike `OFFSET` pagination, every chunk is an index range scan,
+    so the cost of a chunk does not grow with how far into the export it is.
+    """
+    if after is not None:
+        queryset = queryset.filter(
+            Q(initiated_at__gt=after["initiated_at"]) |
+            Q(initiated_at=after["initiated_at"], id__gt=after["id"]))
+    return list(queryset[:chunk_size].iterator(chunk_size=chunk_size))
+
+
+def iter_chunks(queryset: QuerySet, chunk_size: int = PAYMENTS_EXPORT_CHUNK_SIZE) -> Iterator[list[dict]]:
+    after = None
+    while chunk := fetch_chunk(queryset, after, chunk_size):
+        yield chunk
+        after = chunk[-1]
+
+
+async def aiter_chunks(queryset: QuerySet, chunk_size: int = PAYMENTS_EXPORT_CHUNK_SIZE) -> AsyncIterator[list[dict]]:
+    after = None
+    while chunk := await sync_to_async(fetch_chunk)(queryset, after, chunk_size):
+        yield chunk
+        after = chunk[-1]
+
+
+def format_ndjson(rows: list[dict]) -> str:
+    return "".join(
+        json.dumps({field: row[field] for field in EXPORT_FIELDS}, cls=DjangoJSONEncoder) + "\n"
+        for row in rows)
+
+
+class _Echo:
+    """A file-like object that returns what is written, for `csv.writer`"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+_csv_writer = csv.writer(_Echo())
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def format_csv(rows: list[dict]) -> str:
+    return "".join(
+        _csv_writer.writerow([_csv_value(row[field]) for field in EXPORT_FIELDS])
+        for row in rows)
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    content_type: str
+    extension: str
+    header: str
+    format_rows: Callable[[list[dict]], str]
+
+
+EXPORT_FORMATS = {
+    "ndjson": ExportFormat("application/x-ndjson", "ndjson", "", format_ndjson),
+    "csv": ExportFormat("text/csv", "csv", _csv_writer.writerow(EXPORT_FIELDS), format_csv),
+}
+
+
+def iter_export(queryset: QuerySet, export_format: ExportFormat, chunk_size: int = PAYMENTS_EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """Yields the export one chunk of payments at a time, so memory use does not depend on its size."""
+    if export_format.header:
+        yield export_format.header
+    for chunk in iter_chunks(queryset, chunk_size):
+        yield export_format.format_rows(chunk)
+
+
+async def aiter_export(queryset: QuerySet, export_format: ExportFormat, chunk_size: int = PAYMENTS_EXPORT_CHUNK_SIZE) -> AsyncIterator[str]:
+    """The async counterpart of `iter_export`, for streaming responses served over ASGI."""
+    if export_format.header:
+        yield export_format.header
+    async for chunk in aiter_chunks(queryset, chunk_size):
+        yield export_format.format_rows(chunk)
@@ -0,0 +1,18 @@
+import asyncio
+from typing import Awaitable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+async def gather_with_concurrency(limit: int, aws: Iterable[Awaitable[T]]) -> list[T]:
+    """
+    Like `asyncio.gather`, but with at most `limit` of the awaitables running at a time.
+    Results are returned in the order of `aws`.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws))
@@ -0,0 +1,93 @@
+"""
+Fast JSON rendering and parsing for DRF.
+
+DRF's `JSONRenderer` and `JSONParser` use the standard library's `json` module, which
+calls back into Python for every `Decimal` and `datetime` and escapes the output a second
+time. When `orjson` is installed, these renderer and parser classes use it instead, which
+serializes and parses the nested Paystack payloads several times faster
+(see `python -m benchmarks.json_rendering`).
+
+The output is the same as DRF's: compact, UTF-8, with `\\u2028` and `\\u2029` escaped,
+with datetimes (e.g. of a `PaystackTransactionStatusDataSerializer`'s validated data) in
+ISO 8601 with UTC as "Z", and with `Decimal` values converted by DRF's own encoder.
+Anything orjson does not handle the same way (e.g. indented output for the browsable API,
+integers that do not fit in 64 bits, input that is not UTF-8 or invalid input) falls back to
+DRF's classes, so the results and error messages are the same. The differences are that
+floats in exponent notation are written without a `+` or leading zeros (`1e16` rather
+than `1e+16`, the same number), that UTC offsets are written to the minute (only historical
+local mean times have seconds), and that `NaN` and infinite floats are rendered as `null`,
+where DRF raises an error.
+"""
+import io
+import logging
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from restful_payment_gateway_api.settings import FAST_JSON_ENABLED
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    if FAST_JSON_ENABLED:
+        logger.warning("orjson is not installed, so JSON is rendered and parsed with DRF's slower classes")
+
+if orjson is not None:
+    # Datetimes in UTC end in "Z", as DRF's encoder writes them
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+    _default = JSONEncoder().default
+
+_UTF8 = frozenset({"utf-8", "utf8"})
+# orjson parses integers that do not fit in 64 bits as floats, so input that may contain one (19 digits
+# in a row, found by mapping every digit to "0" and everything else to " ") is left to DRF
+_DIGITS = bytes(ord("0") if chr(byte).isdigit() and byte < 128 else ord(" ") for byte in range(256))
+_LONG_NUMBER = b"0" * 19
+_LINE_SEPARATOR = "\u2028".encode()
+_PARAGRAPH_SEPARATOR = "\u2029".encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """A `JSONRenderer` that renders with orjson, if it is installed."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or not self.compact or self.ensure_ascii
+                or (accepted_media_type and "indent" in accepted_media_type)
+                or (renderer_context and renderer_context.get("indent") is not None)):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            rendered = orjson.dumps(data, default=_default, option=_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Like DRF, so that the output is valid JavaScript
+        if _LINE_SEPARATOR in rendered:
+            rendered = rendered.replace(_LINE_SEPARATOR, b"\\u2028")
+        if _PARAGRAPH_SEPARATOR in rendered:
+            rendered = rendered.replace(_PARAGRAPH_SEPARATOR, b"\\u2029")
+        return rendered
+
+
+class FastJSONParser(JSONParser):
+    """A `JSONParser` that parses with orjson, if it is installed."""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or encoding.lower() not in _UTF8:
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        if _LONG_NUMBER in body.translate(_DIGITS):
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # Either invalid, which the standard library reports with the usual message,
+            # or valid input that orjson does not handle
+            return super().parse(io.BytesIO(body), media_type, parser_context)
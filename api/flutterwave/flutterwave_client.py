@@ -0,0 +1,273 @@
+"""
+The Flutterwave `PaymentProvider`.
+
+Payments are initialized with Flutterwave Standard (a hosted checkout page), with a reference
+generated here, and looked up with the verify-by-reference endpoint. Responses are converted
+to the shapes of Paystack's, which is what the API returns; amounts are converted to the
+currency's subunit (e.g. kobo), as Paystack reports them.
+"""
+import asyncio
+import atexit
+import logging
+import time
+import uuid
+from decimal import Decimal
+from json import JSONDecodeError
+from typing import Callable
+
+import httpx
+from rest_framework import status
+
+from api.metrics import registry
+from api.paystack.paystack_client import close_replaced_client
+from api.paystack.paystack_parsers import transaction_init_response_parser, transaction_status_response_parser
+from api.paystack.resilience import UpstreamGuard, UpstreamUnavailable
+from api.paystack.retries import get_deadline
+from api.paystack.status_cache import PaymentStatusCache
+from api.providers import PaymentProvider, PaymentProviderException
+from api.tracing import CLIENT, TRACEPARENT_HEADER, tracer
+from restful_payment_gateway_api.settings import \
+    (FLUTTERWAVE_SECRET_KEY, FLUTTERWAVE_API_BASE_URL, FLUTTERWAVE_CURRENCY, FLUTTERWAVE_REDIRECT_URL,
+     FLUTTERWAVE_HTTP_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+FLUTTERWAVE_REQUESTS = registry.counter(
+    "flutterwave_requests_total",
+    "Attempted Flutterwave calls, by endpoint and outcome (status code, timeout, connection_error or rejected).",
+    ["endpoint", "outcome"])
+FLUTTERWAVE_REQUEST_DURATION = registry.histogram(
+    "flutterwave_request_duration_seconds", "Duration of Flutterwave calls, by endpoint.", ["endpoint"])
+
+REFERENCE_PREFIX = "flw_"
+
+INIT_PAYMENT_ENDPOINT = "flutterwave_init_payment"
+PAYMENT_STATUS_ENDPOINT = "flutterwave_payment_status"
+
+# Flutterwave transaction statuses, and the Paystack statuses they correspond to
+STATUSES = {
+    "successful": "success",
+    "failed": "failed",
+    "pending": "pending",
+    "cancelled": "abandoned",
+}
+
+
+def get_async_flutterwave_client(base_url: str, secret_key: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers={"Authorization": f"Bearer {secret_key}", "Content-Type": "application/json"},
+        timeout=httpx.Timeout(FLUTTERWAVE_HTTP_TIMEOUT))
+
+
+class AsyncFlutterwaveClient(PaymentProvider):
+    """
+    A Flutterwave client. Calls to each endpoint go through a circuit breaker and adaptive
+    concurrency limit, like Paystack's, but are not retried: the router fails over to
+    another provider instead.
+    """
+    name = "flutterwave"
+    reference_prefix = REFERENCE_PREFIX
+
+    def __init__(
+            self,
+            http_client_fun: Callable[[str, str], httpx.AsyncClient] = get_async_flutterwave_client,
+            secret_key: str = FLUTTERWAVE_SECRET_KEY,
+            base_url: str = FLUTTERWAVE_API_BASE_URL,
+            currency: str = FLUTTERWAVE_CURRENCY,
+            redirect_url: str | None = FLUTTERWAVE_REDIRECT_URL,
+            status_cache: PaymentStatusCache | None = None,
+            guards: dict[str, UpstreamGuard] | None = None,
+            timeout: float = FLUTTERWAVE_HTTP_TIMEOUT
+    ):
+        """
+        Parameters:
+            http_client_fun: A function that returns an `httpx.AsyncClient` with the provided
+                base URL and secret key, e.g. one with a mock transport for testing.
+            secret_key: The secret key used to authenticate requests to the Flutterwave API.
+            base_url: The base URL of the Flutterwave API.
+            currency: The currency of payments.
+            redirect_url: Where customers are sent after paying.
+            status_cache: An optional cache for payment status lookups.
+            guards: The guards of calls to each endpoint.
+            timeout: The number of seconds after which a call times out.
+        """
+        self._http_client_fun = http_client_fun
+        self._secret_key = secret_key
+        self._base_url = base_url
+        self.currency = currency
+        self.redirect_url = redirect_url
+        self.status_cache = status_cache
+        self.guards = guards if guards is not None else {
+            endpoint: UpstreamGuard(endpoint) for endpoint in (INIT_PAYMENT_ENDPOINT, PAYMENT_STATUS_ENDPOINT)}
+        self.timeout = timeout
+        self._client: httpx.AsyncClient | None = None
+        self._client_loop: asyncio.AbstractEventLoop | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            if self._client is None:
+                atexit.register(self._close_at_exit)
+            else:
+                close_replaced_client(self._client, self._client_loop)
+            self._client = self._http_client_fun(self._base_url, self._secret_key)
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        client, self._client, self._client_loop = self._client, None, None
+        if client is not None:
+            atexit.unregister(self._close_at_exit)
+            await client.aclose()
+
+    def _close_at_exit(self):
+        try:
+            asyncio.run(self.aclose())
+        except Exception:
+            pass
+
+    async def _send(self, endpoint: str, method: str, path: str, **kwargs) -> httpx.Response:
+        deadline = get_deadline(self.timeout)
+        timeout = deadline.remaining()
+        if timeout <= 0:
+            raise self._failed_call_exception(None)
+        response, error = None, None
+        started_at = time.perf_counter()
+        with tracer.start_span(endpoint.replace("_", " ", 1), CLIENT, {
+            "http.request.method": method, "url.path": path}) as span:
+            try:
+                async with self.guards[endpoint].call(timeout) as call:
+                    # Within what is left of the deadline after waiting for a slot
+                    timeout = deadline.remaining()
+                    headers = {TRACEPARENT_HEADER: span.traceparent} if span is not None else None
+                    response = await asyncio.wait_for(
+                        self._get_client().request(method, path, timeout=timeout, headers=headers, **kwargs),
+                        timeout)
+                    call.record_status(response.status_code)
+            except UpstreamUnavailable as e:
+                FLUTTERWAVE_REQUESTS.labels(endpoint, "rejected").inc()
+                raise PaymentProviderException(
+                    data={
+                        "status": False,
+                        "message": "Flutterwave is temporarily unavailable, please try again later",
+                        "data": {"endpoint": e.endpoint, "reason": e.reason, "retry_after": round(e.retry_after, 3)}
+                    },
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE) from e
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                error = e
+
+            FLUTTERWAVE_REQUEST_DURATION.labels(endpoint).observe(time.perf_counter() - started_at)
+            if response is not None:
+                outcome = response.status_code
+                if span is not None:
+                    span.set_attribute("http.response.status_code", response.status_code)
+            else:
+                outcome = "connection_error" if isinstance(error, httpx.ConnectError) else "timeout"
+                if span is not None:
+                    span.error = outcome
+            FLUTTERWAVE_REQUESTS.labels(endpoint, outcome).inc()
+
+        if error is not None:
+            raise self._failed_call_exception(error) from error
+        return response
+
+    @staticmethod
+    def _failed_call_exception(error: Exception | None) -> PaymentProviderException:
+        """The exception for a call that failed without a response (`error` is `None` if it ran out of time)."""
+        if error is None or isinstance(error, (httpx.TimeoutException, TimeoutError)):
+            return PaymentProviderException(
+                data={"status": False, "message": "Flutterwave did not respond in time", "data": {}},
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+        return PaymentProviderException(
+            data={"status": False, "message": "Could not connect to Flutterwave", "data": {}},
+            status_code=status.HTTP_502_BAD_GATEWAY)
+
+    @staticmethod
+    def _json(response: httpx.Response) -> dict:
+        try:
+            return response.json()
+        except JSONDecodeError:
+            logger.warning("Flutterwave call failed with status %s and no JSON body", response.status_code)
+            raise PaymentProviderException(
+                data={"status": False, "message": "Server error", "data": {}},
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                upstream_status_code=response.status_code)
+
+    async def init_payment(self, email: str, amount: float) -> dict:
+        reference = f"{REFERENCE_PREFIX}{uuid.uuid4().hex}"
+        payload = {
+            "tx_ref": reference,
+            "amount": str(amount),
+            "currency": self.currency,
+            "customer": {"email": email},
+        }
+        if self.redirect_url:
+            payload["redirect_url"] = self.redirect_url
+        response = await self._send(INIT_PAYMENT_ENDPOINT, "POST", "/payments", json=payload)
+        data = self._json(response)
+        if not response.is_success or data.get("status") != "success":
+            raise PaymentProviderException(
+                data={"status": False, "message": data.get("message") or "Payment initialization failed"},
+                upstream_status_code=response.status_code)
+
+        validated_data, errors = transaction_init_response_parser.validate({
+            "status": True,
+            "message": "Authorization URL created",
+            "data": {"authorization_url": data["data"]["link"], "reference": reference},
+        })
+        if errors is not None:
+            raise PaymentProviderException(data=errors)
+        return validated_data
+
+    async def get_payment_status(self, payment_id: str) -> dict:
+        if self.status_cache is not None:
+            data = await self.status_cache.aget(payment_id)
+            if data is not None:
+                return data
+
+        response = await self._send(
+            PAYMENT_STATUS_ENDPOINT, "GET", "/transactions/verify_by_reference", params={"tx_ref": payment_id})
+        data = self._json(response)
+        if not response.is_success or data.get("status") != "success":
+            if response.status_code in (status.HTTP_400_BAD_REQUEST, status.HTTP_404_NOT_FOUND):
+                raise PaymentProviderException(
+                    data={
+                        "payment_id": payment_id,
+                        "status": "failed",
+                        "message": "Payment with the given payment id not found"
+                    },
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    upstream_status_code=response.status_code)
+            logger.warning("Flutterwave verification of %s failed with status %s: %s",
+                           payment_id, response.status_code, data)
+            raise PaymentProviderException(
+                data={"payment_id": payment_id, "status": "failed"}, upstream_status_code=response.status_code)
+
+        validated_data, errors = transaction_status_response_parser.validate(
+            self._paystack_status_response(data["data"]))
+        if errors is not None:
+            raise PaymentProviderException(data=errors)
+
+        if self.status_cache is not None:
+            await self.status_cache.aset(payment_id, validated_data)
+        return validated_data
+
+    def _paystack_status_response(self, transaction: dict) -> dict:
+        """A Paystack verify response for a Flutterwave transaction."""
+        transaction_status = STATUSES.get(transaction.get("status"), transaction.get("status"))
+        return {
+            "status": True,
+            "message": "Verification successful",
+            "data": {
+                "domain": "test" if "TEST" in (self._secret_key or "") else "live",
+                "status": transaction_status,
+                "reference": transaction["tx_ref"],
+                # Flutterwave does not report when a payment was made
+                "paid_at": transaction.get("created_at") if transaction_status == "success" else None,
+                "created_at": transaction["created_at"],
+                "channel": transaction.get("payment_type") or "unknown",
+                "currency": transaction["currency"],
+                "amount": str(Decimal(str(transaction["amount"])) * 100),
+            },
+        }
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import random
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Callable
+
+import httpx
+
+
+class MockFlutterwaveServer:
+    """
+    An in-memory stand-in for the Flutterwave API (the payment and verify-by-reference endpoints).
+
+    Initialized transactions are kept in a table, so that an initialize -> verify flow sees
+    consistent data, and `settle()` simulates the customer completing (or failing) a payment.
+    Unknown references are not found. Latency and failures can be injected to simulate a
+    slow or unreliable API.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int | None = None):
+        """
+        Parameters:
+            latency: The number of seconds every request takes.
+            error_rate: The probability of a request failing with a 500 response.
+            seed: The seed of the random number generator used for failures.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._transactions: dict[str, dict] = {}
+        self.requests = 0
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+    def settle(self, reference: str, status: str = "successful"):
+        with self._lock:
+            self._transactions[reference]["status"] = status
+
+    def respond(self, method: str, path: str, params: httpx.QueryParams, body: bytes) -> tuple[int, dict]:
+        """Returns the status code and JSON body of the response to a request."""
+        if self._should_fail():
+            return 500, {"status": "error", "message": "Mock server error", "data": None}
+
+        if method == "POST" and path.endswith("/payments"):
+            return self._initialize(json.loads(body or b"{}"))
+
+        if method == "GET" and path.endswith("/transactions/verify_by_reference"):
+            return self._verify(params.get("tx_ref", ""))
+
+        return 404, {"status": "error", "message": "Endpoint not found", "data": None}
+
+    def _initialize(self, request_data: dict) -> tuple[int, dict]:
+        reference = request_data.get("tx_ref")
+        if not reference or "amount" not in request_data:
+            return 400, {"status": "error", "message": "tx_ref and amount are required", "data": None}
+        with self._lock:
+            self._transactions[reference] = {
+                "id": len(self._transactions) + 1,
+                "tx_ref": reference,
+                "amount": float(request_data["amount"]),
+                "currency": request_data.get("currency", "NGN"),
+                "status": "pending",
+                "payment_type": "card",
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+        return 200, {
+            "status": "success",
+            "message": "Hosted Link",
+            "data": {"link": f"https://checkout.flutterwave.com/v3/hosted/pay/{uuid.uuid4().hex[:20]}"},
+        }
+
+    def _verify(self, reference: str) -> tuple[int, dict]:
+        with self._lock:
+            transaction = self._transactions.get(reference)
+            transaction = dict(transaction) if transaction is not None else None
+        if transaction is None:
+            return 400, {"status": "error", "message": "No transaction was found for this id", "data": None}
+        return 200, {"status": "success", "message": "Transaction fetched successfully", "data": transaction}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        status_code, data = self.respond(request.method, request.url.path, request.url.params, request.content)
+        return httpx.Response(status_code, json=data)
+
+    def transport(self) -> "MockFlutterwaveTransport":
+        return MockFlutterwaveTransport(self)
+
+    def async_client_fun(self) -> Callable[[str, str], httpx.AsyncClient]:
+        """Returns a factory function for `AsyncFlutterwaveClient` that sends requests to this server"""
+        def get_client(base_url: str, secret_key: str) -> httpx.AsyncClient:
+            return httpx.AsyncClient(
+                base_url=base_url, headers={"Authorization": f"Bearer {secret_key}"}, transport=self.transport())
+
+        return get_client
+
+
+class MockFlutterwaveTransport(httpx.AsyncBaseTransport):
+    """An httpx transport that sends requests to a `MockFlutterwaveServer`"""
+
+    def __init__(self, server: MockFlutterwaveServer):
+        self.server = server
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        return await self.server.handle_async_request(request)
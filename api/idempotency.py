@@ -0,0 +1,177 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from django.core.cache import caches
+
+from api.paystack.single_flight import AsyncSingleFlight
+from restful_payment_gateway_api.settings import \
+    (PAYMENTS_IDEMPOTENCY_MAX_ENTRIES, PAYMENTS_IDEMPOTENCY_TTL, PAYMENTS_IDEMPOTENCY_CACHE_ALIAS,
+     PAYMENTS_IDEMPOTENCY_LOCK_TIMEOUT)
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """Raised when a request cannot be handled with the idempotency key it was sent with."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def fingerprint(data: dict) -> str:
+    """A digest of (validated) request data, used to detect a key being reused for another request."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Stores the results of requests sent with an idempotency key, so that retries of a
+    request get the original result instead of repeating it.
+
+    Results are kept in an in-process LRU bounded by `max_entries`. Optionally, a Django
+    cache (e.g. Redis, or the database cache) is used as a second level, so that a retry
+    handled by another worker is answered as well. The shared cache also holds a lock
+    per key while a request is in flight, so that workers do not repeat it concurrently.
+    Within a process, concurrent requests with the same key wait for the first one.
+
+    Only successful results are stored, so a request that failed (e.g. because Paystack
+    was unavailable) can be retried with the same key.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = PAYMENTS_IDEMPOTENCY_MAX_ENTRIES,
+            ttl: float = PAYMENTS_IDEMPOTENCY_TTL,
+            cache_alias: str | None = PAYMENTS_IDEMPOTENCY_CACHE_ALIAS,
+            lock_timeout: float = PAYMENTS_IDEMPOTENCY_LOCK_TIMEOUT,
+            key_prefix: str = "payments:idempotency",
+            clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Parameters:
+            max_entries: The maximum number of results kept in process memory.
+            ttl: The number of seconds a result is kept for.
+            cache_alias: The alias (in `CACHES`) of a Django cache shared by all workers,
+                or `None` to only store results in process memory.
+            lock_timeout: The number of seconds after which the lock of a request that
+                never finished (e.g. because its worker died) expires.
+            key_prefix: The prefix of keys in the shared cache.
+            clock: The monotonic clock used for expiry (mostly for testing).
+        """
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._cache_alias = cache_alias
+        self._lock_timeout = lock_timeout
+        self._key_prefix = key_prefix
+        self._clock = clock
+        self._lock = threading.Lock()
+        # idempotency key -> (expiry time, result)
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._flights = AsyncSingleFlight()
+
+    @property
+    def shared_cache(self):
+        return caches[self._cache_alias] if self._cache_alias is not None else None
+
+    def _shared_key(self, key: str) -> str:
+        # Keys are chosen by clients, so they are hashed to be safe for any cache backend
+        return f"{self._key_prefix}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    def _get_local(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def _set_local(self, key: str, result: dict):
+        with self._lock:
+            self._entries[key] = (self._clock() + self._ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    async def aget(self, key: str) -> dict | None:
+        result = self._get_local(key)
+        if result is None and self.shared_cache is not None:
+            result = await self.shared_cache.aget(self._shared_key(key))
+            if result is not None:
+                self._set_local(key, result)
+        return result
+
+    async def aset(self, key: str, result: dict):
+        self._set_local(key, result)
+        if self.shared_cache is not None:
+            await self.shared_cache.aset(self._shared_key(key), result, self._ttl)
+
+    async def _acquire(self, key: str) -> bool:
+        if self.shared_cache is None:
+            return True
+        return await self.shared_cache.aadd(f"{self._shared_key(key)}:lock", True, self._lock_timeout)
+
+    async def _release(self, key: str):
+        if self.shared_cache is not None:
+            await self.shared_cache.adelete(f"{self._shared_key(key)}:lock")
+
+    async def run(
+            self,
+            key: str,
+            request_fingerprint: str,
+            fun: Callable[[], Awaitable[tuple[dict | str, int]]]
+    ) -> tuple[dict | str, int, bool]:
+        """
+        Returns the result of the request with idempotency key `key`, calling `fun` only if
+        there is none yet. `fun` returns the response data and status code.
+        Returns the response data, status code, and whether it is a replayed result.
+
+        Raises `IdempotencyConflict` if the key was used for a request with another
+        fingerprint, or if a request with the key is in flight on another worker.
+        """
+        result = await self.aget(key)
+        replayed = True
+        if result is None:
+            owner = object()
+            result, executed_by = await self._flights.do(
+                key, lambda: self._execute(key, request_fingerprint, fun, owner))
+            replayed = executed_by is not owner
+
+        if result["fingerprint"] != request_fingerprint:
+            raise IdempotencyConflict(
+                "The idempotency key was already used for a different request", 422)
+        return result["data"], result["status_code"], replayed
+
+    async def _execute(self, key, request_fingerprint, fun, owner) -> tuple[dict, object]:
+        # Another worker may have finished the request since it was looked up
+        result = await self.aget(key)
+        if result is not None:
+            return result, None
+        if not await self._acquire(key):
+            raise IdempotencyConflict("A request with this idempotency key is in progress", 409)
+        try:
+            data, status_code = await fun()
+            result = {"fingerprint": request_fingerprint, "status_code": status_code, "data": data}
+            if 200 <= status_code < 300:
+                await self.aset(key, result)
+            return result, owner
+        finally:
+            await self._release(key)
+
+    def clear(self):
+        """Clears the in-process entries. The shared cache is left as is."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
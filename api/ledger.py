@@ -0,0 +1,181 @@
+import atexit
+import logging
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import close_old_connections
+
+from api.models import Payment
+from api.paystack.status_cache import TERMINAL_STATUSES
+from restful_payment_gateway_api.settings import \
+    (PAYMENT_LEDGER_FLUSH_INTERVAL, PAYMENT_LEDGER_BATCH_SIZE)
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentLedger:
+    """
+    A write-behind buffer for `Payment` records.
+
+    Views record payments and status changes here, which only takes a lock and a
+    dictionary write. A background thread then persists the buffered changes
+    with `bulk_create`/`bulk_update`, so database writes are batched and kept off
+    the request's critical path.
+
+    Changes to the same reference are coalesced: only the latest status recorded
+    before a flush is written. A terminal status (see `TERMINAL_STATUSES`) is never
+    replaced by a non-terminal one, e.g. a webhook's `success` by a `pending` lookup
+    that started before the webhook arrived.
+    """
+
+    def __init__(
+            self,
+            flush_interval: float = PAYMENT_LEDGER_FLUSH_INTERVAL,
+            batch_size: int = PAYMENT_LEDGER_BATCH_SIZE,
+            autostart: bool = True
+    ):
+        """
+        Parameters:
+            flush_interval: The maximum number of seconds a change waits in the buffer.
+            batch_size: The number of pending changes that triggers an early flush.
+                It is also the batch size used for the bulk queries.
+            autostart: Whether to start the background flushing thread on the first
+                recorded change. When `False`, `flush()` has to be called explicitly.
+        """
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._autostart = autostart
+        self._lock = threading.Lock()
+        self._pending_creates: dict[str, Payment] = {}
+        self._pending_updates: dict[str, tuple[str, datetime | None, dict | None]] = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending_creates) + len(self._pending_updates)
+
+    def record_initialized(
+            self,
+            reference: str,
+            customer_name: str,
+            customer_email: str,
+            amount: Decimal,
+            merchant: str = ""):
+        """Buffers a newly initialized payment (of `merchant`, or of the default merchant)."""
+        payment = Payment(
+            reference=reference,
+            customer_name=customer_name,
+            customer_email=customer_email,
+            amount=amount,
+            merchant=merchant)
+        with self._lock:
+            self._pending_creates[reference] = payment
+        self._after_record()
+
+    def record_status(
+            self,
+            reference: str,
+            status: str,
+            paid_at: datetime | None,
+            transaction_data: dict | None = None):
+        """Buffers a status change of a payment, with the transaction data its provider reported."""
+        with self._lock:
+            pending = self._pending_updates.get(reference)
+            if pending is not None and pending[0] in TERMINAL_STATUSES and status not in TERMINAL_STATUSES:
+                return
+            self._pending_updates[reference] = (status, paid_at, transaction_data)
+        self._after_record()
+
+    def _after_record(self):
+        if self._autostart and self._thread is None:
+            self.start()
+        if self.pending >= self._batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Writes all buffered changes to the database.
+        Returns the number of changes that were written.
+        """
+        with self._lock:
+            creates, self._pending_creates = self._pending_creates, {}
+            updates, self._pending_updates = self._pending_updates, {}
+
+        count = len(creates) + len(updates)
+        if not count:
+            return 0
+
+        try:
+            self._write(creates, updates)
+        except Exception:
+            logger.exception("Failed to write %d payment changes", count)
+            # Put the changes back without overwriting anything recorded since
+            with self._lock:
+                for reference, payment in creates.items():
+                    self._pending_creates.setdefault(reference, payment)
+                for reference, change in updates.items():
+                    self._pending_updates.setdefault(reference, change)
+            return 0
+
+        return count
+
+    def _write(self, creates: dict[str, Payment], updates: dict[str, tuple[str, datetime | None, dict | None]]):
+        # Status changes of payments that are created in the same batch are
+        # applied to the new rows directly
+        updates = dict(updates)
+        for reference in list(updates):
+            if reference in creates:
+                payment = creates[reference]
+                payment.status, payment.paid_at, payment.transaction_data = updates.pop(reference)
+
+        if creates:
+            Payment.objects.bulk_create(
+                creates.values(), batch_size=self._batch_size, ignore_conflicts=True)
+
+        if updates:
+            payments = Payment.objects.in_bulk(updates.keys(), field_name="reference")
+            updated = []
+            for reference, payment in payments.items():
+                status, paid_at, transaction_data = updates[reference]
+                if payment.status in TERMINAL_STATUSES and status not in TERMINAL_STATUSES:
+                    continue
+                payment.status, payment.paid_at, payment.transaction_data = status, paid_at, transaction_data
+                updated.append(payment)
+            # Payments initialized elsewhere (e.g. directly on Paystack) are not tracked
+            Payment.objects.bulk_update(
+                updated, ["status", "paid_at", "transaction_data"], batch_size=self._batch_size)
+
+    def start(self):
+        """Starts the background flushing thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="payment-ledger", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stops the background flushing thread after writing any buffered changes."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        thread.join()
+        atexit.unregister(self.stop)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+        # Write whatever was recorded while stopping
+        self.flush()
+        close_old_connections()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.schema import generate_schema, write_schema_artifact
+from restful_payment_gateway_api.settings import APP_VERSION, SCHEMA_ARTIFACT_PATH
+
+
+class Command(BaseCommand):
+    help = ("Generates the OpenAPI schema into a versioned artifact, which the schema endpoint serves "
+            "instead of generating the schema (as long as APP_VERSION does not change).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", "-o", default=SCHEMA_ARTIFACT_PATH, help="The file to write to")
+        parser.add_argument("--app-version", default=APP_VERSION,
+                            help="The application version the schema is for")
+
+    def handle(self, *args, **options):
+        try:
+            write_schema_artifact(options["output"], generate_schema(), options["app_version"])
+        except OSError as e:
+            raise CommandError(e)
+        self.stderr.write(f"Wrote the schema of version {options['app_version']} to {options['output']}")
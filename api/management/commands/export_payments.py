@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from api.export import EXPORT_FORMATS, get_export_queryset, iter_export
+from api.models import Payment
+from restful_payment_gateway_api.settings import PAYMENTS_EXPORT_CHUNK_SIZE
+
+
+def datetime_argument(value: str):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid datetime: {value}")
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Exports recorded payments as NDJSON or CSV, e.g. for end-of-day reconciliation."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="ndjson")
+        parser.add_argument("--status", choices=[choice for choice, _ in Payment.PAYMENT_STATUS])
+        parser.add_argument(
+            "--initiated-after", type=datetime_argument,
+            help="Only export payments initiated at or after this (ISO 8601) time")
+        parser.add_argument(
+            "--initiated-before", type=datetime_argument,
+            help="Only export payments initiated before this (ISO 8601) time")
+        parser.add_argument("--chunk-size", type=int, default=PAYMENTS_EXPORT_CHUNK_SIZE)
+        parser.add_argument("--output", "-o", help="The file to write to (standard output by default)")
+
+    def handle(self, *args, **options):
+        queryset = get_export_queryset(
+            status=options["status"],
+            initiated_after=options["initiated_after"],
+            initiated_before=options["initiated_before"])
+        export_format = EXPORT_FORMATS[options["format"]]
+
+        parts = iter_export(queryset, export_format, options["chunk_size"])
+        if not options["output"]:
+            for part in parts:
+                self.stdout.write(part, ending="")
+            return
+
+        try:
+            with open(options["output"], "w", newline="") as output:
+                for part in parts:
+                    output.write(part)
+        except OSError as e:
+            raise CommandError(e)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.views import payment_reconciler
+from restful_payment_gateway_api.settings import PAYMENT_RECONCILIATION_INTERVAL
+
+
+class Command(BaseCommand):
+    help = ("Looks up payments that are not settled yet on their provider and records their statuses, "
+            "e.g. from a cron job.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep sweeping every PAYMENT_RECONCILIATION_INTERVAL seconds until interrupted")
+
+    def handle(self, *args, **options):
+        # Skipped (checking no payments) while another sweep runs, e.g. in a server worker
+        while True:
+            counts = payment_reconciler.run_once()
+            self.stdout.write(
+                f"Checked {counts['checked']} payments: {counts['updated']} updated, {counts['failed']} failed")
+            if not options["loop"]:
+                return
+            try:
+                time.sleep(PAYMENT_RECONCILIATION_INTERVAL)
+            except KeyboardInterrupt:
+                return
@@ -0,0 +1,376 @@
+"""
+Low-overhead metrics, exposed in the Prometheus text format.
+
+Counters and histograms keep a separate set of values per thread, so updating them
+needs neither a lock nor an atomic operation: an update is a dictionary lookup (for the
+labels) and a couple of list writes. The per-thread values are only summed up when the
+metrics are collected. Gauges are computed by a callback at collection time, so they
+cost nothing on the hot path.
+
+Each gunicorn worker has its own metrics. When `METRICS_DIR` is set, every worker
+periodically writes a snapshot of its metrics to that directory, and `/metrics` merges
+the snapshots of all workers, so it does not matter which worker serves the scrape.
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from restful_payment_gateway_api.settings import METRICS_DIR, METRICS_SNAPSHOT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Seconds, suitable for both request handling and upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ThreadShards:
+    """A list of values per thread, so that each thread can update its own without locking."""
+    __slots__ = ("_size", "_local", "_shards", "_lock")
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._shards: list[list[float]] = []
+        self._lock = threading.Lock()
+
+    def get(self) -> list[float]:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = [0.0] * self._size
+            with self._lock:
+                # Kept after the thread exits, as its counts still count
+                self._shards.append(values)
+            self._local.values = values
+            return values
+
+    def sum(self) -> list[float]:
+        with self._lock:
+            shards = list(self._shards)
+        return [math.fsum(column) for column in zip(*shards)] if shards else [0.0] * self._size
+
+
+class _CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = _ThreadShards(1)
+
+    def inc(self, amount: float = 1.0):
+        self._shards.get()[0] += amount
+
+    def values(self) -> list[float]:
+        return self._shards.sum()
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_shards")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self._buckets = buckets
+        # A count per bucket, the count of values above the last bucket, and the sum
+        self._shards = _ThreadShards(len(buckets) + 2)
+
+    def observe(self, value: float):
+        values = self._shards.get()
+        values[bisect_left(self._buckets, value)] += 1
+        values[-1] += value
+
+    def values(self) -> list[float]:
+        return self._shards.sum()
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Children by the label values as given (e.g. status codes as integers), for fast lookups,
+        # and by the label values as strings, for collection
+        self._children: dict[tuple, object] = {}
+        self._children_by_labels: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *labelvalues):
+        """The child metric with the given label values (in the order of `labelnames`)."""
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"{self.name} has labels {self.labelnames}")
+            with self._lock:
+                child = self._children_by_labels.setdefault(
+                    tuple(str(value) for value in labelvalues), self._new_child())
+                self._children[labelvalues] = child
+        return child
+
+    def samples(self) -> dict[tuple[str, ...], list[float]]:
+        with self._lock:
+            children = list(self._children_by_labels.items())
+        return {labelvalues: child.values() for labelvalues, child in children}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Iterable[str] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+class Gauge(_Metric):
+    """A gauge whose samples are computed by `fun` (label values -> value) when collected."""
+    type = "gauge"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Iterable[str] = (),
+            fun: Callable[[], dict[tuple[str, ...], float]] | None = None
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.fun = fun
+
+    def samples(self) -> dict[tuple[str, ...], list[float]]:
+        if self.fun is None:
+            return {}
+        try:
+            return {tuple(str(value) for value in labelvalues): [float(value)]
+                    for labelvalues, value in self.fun().items()}
+        except Exception:
+            logger.exception("Could not collect %s", self.name)
+            return {}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"{metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Iterable[str] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Iterable[str] = (),
+            fun: Callable[[], dict[tuple[str, ...], float]] | None = None
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, fun))
+
+    def snapshot(self) -> dict:
+        """The current values of all metrics, in a JSON serializable form."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "metrics": {
+                metric.name: {
+                    "type": metric.type,
+                    "documentation": metric.documentation,
+                    "labelnames": list(metric.labelnames),
+                    "buckets": list(getattr(metric, "buckets", ())),
+                    "samples": [[list(labelvalues), values] for labelvalues, values in metric.samples().items()],
+                }
+                for metric in metrics
+            },
+        }
+
+
+def merge_snapshots(snapshots: list[dict], now: float, max_age: float) -> dict:
+    """
+    Merges the snapshots of several workers. Counters and histograms are summed.
+    Gauges are summed too, but only from recent snapshots, as those of workers that
+    exited no longer describe anything.
+    """
+    merged: dict[str, dict] = {}
+    for snapshot in snapshots:
+        recent = now - snapshot["time"] <= max_age
+        for name, metric in snapshot["metrics"].items():
+            if metric["type"] == "gauge" and not recent:
+                continue
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            if target["type"] != metric["type"] or target["buckets"] != metric["buckets"]:
+                # Changed between deployments; the newest definition wins
+                continue
+            for labelvalues, values in metric["samples"]:
+                key = tuple(labelvalues)
+                current = target["samples"].get(key)
+                target["samples"][key] = values if current is None else [a + b for a, b in zip(current, values)]
+    for metric in merged.values():
+        metric["samples"] = [[list(key), values] for key, values in metric["samples"].items()]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra: tuple[str, str] | None = None) -> str:
+    pairs = list(zip(labelnames, labelvalues))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render(metrics: dict[str, dict]) -> str:
+    """Renders (merged) snapshot metrics in the Prometheus text exposition format."""
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labelnames"]
+        for labelvalues, values in sorted(metric["samples"]):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labelvalues)} {_format_value(values[0])}")
+                continue
+            cumulative = 0.0
+            for bound, count in zip([*metric["buckets"], math.inf], values[:-1]):
+                cumulative += count
+                le = ("le", _format_value(bound) if bound == math.inf else repr(float(bound)))
+                lines.append(f"{name}_bucket{_format_labels(labelnames, labelvalues, le)} {_format_value(cumulative)}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labelvalues)} {_format_value(values[-1])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labelvalues)} {_format_value(cumulative)}")
+    return "\n".join(lines) + "\n"
+
+
+class SnapshotWriter:
+    """
+    Writes snapshots of a registry to `directory` every `interval` seconds (and at exit),
+    one file per process, and reads the snapshots of all processes.
+    """
+
+    def __init__(self, registry: MetricsRegistry, directory: str, interval: float = METRICS_SNAPSHOT_INTERVAL):
+        self._registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        # Computed on every write, as the pid changes when gunicorn forks a worker
+        return os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+
+    def write(self) -> dict:
+        snapshot = self._registry.snapshot()
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(snapshot, file)
+        # Atomic, so readers never see a partially written snapshot
+        os.replace(temporary_path, self.path)
+        return snapshot
+
+    def read_all(self) -> list[dict]:
+        """The snapshots of all processes, with the snapshot of this one up to date."""
+        own = self.write()
+        snapshots = [own]
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if not filename.endswith(".json") or path == self.path:
+                continue
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                logger.warning("Skipping unreadable metrics snapshot %s", path)
+        return snapshots
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics-snapshots", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=self.interval + 1)
+        try:
+            self.write()
+        except OSError:
+            logger.exception("Could not write the metrics snapshot")
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                logger.exception("Could not write the metrics snapshot")
+
+
+registry = MetricsRegistry()
+snapshot_writer = SnapshotWriter(registry, METRICS_DIR) if METRICS_DIR else None
+
+
+def collect() -> str:
+    """The metrics of this process, or of all processes when `METRICS_DIR` is set, in the text format."""
+    if snapshot_writer is None:
+        return render(merge_snapshots([registry.snapshot()], time.time(), math.inf))
+    return render(merge_snapshots(snapshot_writer.read_all(), time.time(), snapshot_writer.interval * 3))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['initiated_at', 'id'], name='payment_initiated_at_id_idx'),
+        ),
+    ]
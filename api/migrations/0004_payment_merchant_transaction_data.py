@@ -0,0 +1,24 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:53
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_payment_last_checked_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='merchant',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='transaction_data',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
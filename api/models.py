@@ -1,10 +1,14 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 class Payment(models.Model):
     PAYMENT_STATUS = (
         ("pending", "Pending"),
+        ("ongoing", "Ongoing"),
+        ("abandoned", "Abandoned"),
         ("success", "Success"),
         ("failed", "Failed"),
+        ("reversed", "Reversed"),
     )
 
     reference = models.CharField(max_length=100, unique=True)
@@ -14,4 +18,29 @@ class Payment(models.Model):
     status = models.CharField(choices=PAYMENT_STATUS, default=PAYMENT_STATUS[0][0], max_length=10)
     paid_at = models.DateTimeField(null=True, blank=True)
     initiated_at = models.DateTimeField(auto_now_add=True)
+    # The id of the merchant (in `PAYSTACK_MERCHANTS`) the payment is of, or "" for the default merchant
+    merchant = models.CharField(max_length=100, blank=True, default="")
+    # The transaction data of the last status lookup or webhook event, as its provider reported it,
+    # so that lookups of settled payments can be answered without calling the provider
+    transaction_data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # When the status was last looked up by the reconciliation sweeper
+    last_checked_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of exports
+            models.Index(fields=["initiated_at", "id"], name="payment_initiated_at_id_idx"),
+            # Finding unsettled payments to reconcile, most recent first
+            models.Index(fields=["status", "-initiated_at"], name="payment_status_initiated_idx"),
+        ]
+
+
+class Lease(models.Model):
+    """
+    A lock held by one process at a time (e.g. the reconciliation sweeper), which works across
+    workers and hosts sharing the database. It is taken with a conditional update, and expires
+    if its holder stops renewing it, e.g. because the process died.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    holder = models.CharField(max_length=100, blank=True, default="")
+    expires_at = models.DateTimeField()
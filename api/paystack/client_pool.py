@@ -0,0 +1,161 @@
+"""
+Paystack clients of several merchants.
+
+Every merchant has its own Paystack secret key, and so its own `AsyncPaystackClient`
+with its own pool of keep-alive connections. Creating a client per request would mean a
+TLS handshake per request, and keeping one per merchant forever would mean sockets
+growing with the number of merchants, so clients are kept in a bounded LRU: the least
+recently used client is closed when another one is needed, as are clients that have been
+idle for a while. A client is only closed once the requests using it are done with it.
+"""
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+from api.paystack.paystack_client import AsyncPaystackClient
+from api.throttling import API_KEY_HEADER
+from restful_payment_gateway_api.settings import \
+    (PAYSTACK_MERCHANTS, PAYSTACK_MERCHANT_API_KEYS, PAYSTACK_MERCHANT_HEADER,
+     PAYSTACK_CLIENT_POOL_MAX_CLIENTS, PAYSTACK_CLIENT_POOL_IDLE_TIMEOUT)
+
+
+class UnknownMerchant(Exception):
+    """Raised when a request selects a merchant that is not configured."""
+
+    def __init__(self, merchant_id: str):
+        super().__init__(f"Unknown merchant {merchant_id!r}")
+        self.merchant_id = merchant_id
+
+
+def select_merchant(
+        request,
+        merchants: dict[str, str] = PAYSTACK_MERCHANTS,
+        api_keys: dict[str, str] = PAYSTACK_MERCHANT_API_KEYS,
+        header: str = PAYSTACK_MERCHANT_HEADER
+) -> tuple[str, str] | None:
+    """
+    The id and secret key of the merchant `request` selects, by API key or else by header,
+    or `None` if it selects none (i.e. the default merchant).
+    Raises `UnknownMerchant` if it selects a merchant that is not configured.
+    """
+    merchant_id = None
+    api_key = request.headers.get(API_KEY_HEADER)
+    if api_key:
+        for key, key_merchant_id in api_keys.items():
+            if hmac.compare_digest(api_key.encode(), key.encode()):
+                merchant_id = key_merchant_id
+                break
+    if merchant_id is None and header:
+        merchant_id = request.headers.get(header)
+    if not merchant_id:
+        return None
+    secret_key = merchants.get(merchant_id)
+    if secret_key is None:
+        raise UnknownMerchant(merchant_id)
+    return merchant_id, secret_key
+
+
+class _PooledClient:
+    __slots__ = ("client", "in_use", "last_used", "evicted")
+
+    def __init__(self, client: AsyncPaystackClient, now: float):
+        self.client = client
+        self.in_use = 0
+        self.last_used = now
+        self.evicted = False
+
+
+class PaystackClientPool:
+    """A bounded LRU of `AsyncPaystackClient`s, one per secret key."""
+
+    def __init__(
+            self,
+            client_fun: Callable[[str], AsyncPaystackClient],
+            max_clients: int = PAYSTACK_CLIENT_POOL_MAX_CLIENTS,
+            idle_timeout: float = PAYSTACK_CLIENT_POOL_IDLE_TIMEOUT,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Parameters:
+            client_fun: A function that creates the client of a secret key.
+            max_clients: The maximum number of clients kept open.
+            idle_timeout: The number of seconds after which an unused client is closed.
+            clock: The monotonic clock used for idleness (mostly for testing).
+        """
+        self._client_fun = client_fun
+        self._max_clients = max_clients
+        self._idle_timeout = idle_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        # digest of the secret key -> client
+        self._clients: OrderedDict[str, _PooledClient] = OrderedDict()
+        self.evictions = 0
+
+    @staticmethod
+    def _key(secret_key: str) -> str:
+        # Secret keys are not kept around as dictionary keys
+        return hashlib.sha256(secret_key.encode()).hexdigest()
+
+    def _checkout(self, secret_key: str) -> tuple[_PooledClient, list[_PooledClient]]:
+        """The (marked as used) client of `secret_key`, and the evicted clients that can be closed now."""
+        key = self._key(secret_key)
+        now = self._clock()
+        with self._lock:
+            pooled = self._clients.get(key)
+            if pooled is None:
+                pooled = self._clients[key] = _PooledClient(self._client_fun(secret_key), now)
+            else:
+                self._clients.move_to_end(key)
+            pooled.in_use += 1
+            pooled.last_used = now
+            return pooled, self._evict(now)
+
+    def _evict(self, now: float) -> list[_PooledClient]:
+        """Evicts clients over the limit and idle clients, oldest first. Must be called with the lock held."""
+        closable = []
+        while self._clients:
+            key, oldest = next(iter(self._clients.items()))
+            if len(self._clients) <= self._max_clients and (
+                    oldest.in_use or now - oldest.last_used < self._idle_timeout):
+                break
+            del self._clients[key]
+            oldest.evicted = True
+            self.evictions += 1
+            if not oldest.in_use:
+                closable.append(oldest)
+        return closable
+
+    @asynccontextmanager
+    async def use(self, secret_key: str) -> AsyncIterator[AsyncPaystackClient]:
+        """The client of `secret_key`, for the duration of an `async with` block."""
+        pooled, closable = self._checkout(secret_key)
+        try:
+            for evicted in closable:
+                await evicted.client.aclose()
+            yield pooled.client
+        finally:
+            with self._lock:
+                pooled.in_use -= 1
+                pooled.last_used = self._clock()
+                # Evicted while in use, so it was left for the last user to close
+                close = pooled.evicted and not pooled.in_use
+            if close:
+                await pooled.client.aclose()
+
+    async def aclose(self):
+        """Closes every client that is not in use; the others are closed when their requests are done."""
+        with self._lock:
+            pooled_clients = list(self._clients.values())
+            self._clients.clear()
+            for pooled in pooled_clients:
+                pooled.evicted = True
+        for pooled in pooled_clients:
+            if not pooled.in_use:
+                await pooled.client.aclose()
+
+    def __len__(self):
+        return len(self._clients)
@@ -0,0 +1,134 @@
+"""
+Hedged requests.
+
+A few slow calls set the tail latency of status lookups, although most calls are fast and
+lookups are safe to repeat. So a lookup that has not been answered after the delay within
+which most lookups are (a percentile of recent latencies) is sent a second time, and
+whichever response comes first is used; the other call is cancelled.
+
+Hedges are paid for from a budget that every call adds a fraction of a token to (see
+`RetryBudget`), so they are at most that fraction of the calls, and cannot double the load
+on an upstream that is slow for everyone.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+from api.metrics import registry
+from api.paystack.retries import RetryBudget
+from restful_payment_gateway_api.settings import \
+    (PAYSTACK_HEDGE_ENABLED, PAYSTACK_HEDGE_PERCENTILE, PAYSTACK_HEDGE_MIN_DELAY, PAYSTACK_HEDGE_MAX_RATIO)
+
+HEDGES = registry.counter("paystack_hedges_total", "Hedged Paystack calls, by endpoint.", ["endpoint"])
+HEDGE_WINS = registry.counter(
+    "paystack_hedge_wins_total", "Hedged Paystack calls whose hedge answered first, by endpoint.", ["endpoint"])
+
+T = TypeVar("T")
+
+
+class HedgePolicy:
+    """When calls to an endpoint are hedged, from the latencies of its recent calls."""
+
+    def __init__(
+            self,
+            endpoint: str,
+            enabled: bool = PAYSTACK_HEDGE_ENABLED,
+            percentile: float = PAYSTACK_HEDGE_PERCENTILE,
+            min_delay: float = PAYSTACK_HEDGE_MIN_DELAY,
+            max_ratio: float = PAYSTACK_HEDGE_MAX_RATIO,
+            window_size: int = 1000,
+            min_samples: int = 50,
+            budget: RetryBudget | None = None
+    ):
+        """
+        Parameters:
+            endpoint: The name of the endpoint, used in metrics.
+            enabled: Whether calls are hedged at all.
+            percentile: The percentile (0 to 100) of recent latencies after which a call is hedged.
+            min_delay: The minimum number of seconds after which a call is hedged.
+            max_ratio: The maximum fraction of calls that are hedged.
+            window_size: The number of recent latencies the percentile is computed from.
+            min_samples: The number of latencies needed before calls are hedged.
+            budget: The budget hedges are paid for from.
+        """
+        self.endpoint = endpoint
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = budget if budget is not None else RetryBudget(
+            ratio=max_ratio, min_per_second=0.0, max_tokens=10.0)
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=window_size)
+        # The percentile is recomputed every `_recompute_every` latencies, rather than for every call
+        self._recompute_every = max(window_size // 20, 1)
+        self._since_recomputed = 0
+        self._delay: float | None = None
+        self.hedges = 0
+        self.wins = 0
+
+    def record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self._since_recomputed += 1
+            if len(self._latencies) >= self.min_samples and (
+                    self._delay is None or self._since_recomputed >= self._recompute_every):
+                ordered = sorted(self._latencies)
+                index = min(math.ceil(len(ordered) * self.percentile / 100) - 1, len(ordered) - 1)
+                self._delay = max(ordered[max(index, 0)], self.min_delay)
+                self._since_recomputed = 0
+
+    def delay(self) -> float | None:
+        """The number of seconds after which a call is hedged, or `None` if calls are not hedged (yet)."""
+        return self._delay if self.enabled else None
+
+    def snapshot(self) -> dict:
+        return {"enabled": self.enabled, "delay": self._delay, "hedges": self.hedges, "wins": self.wins}
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Awaits `call()`, and if it takes longer than the delay (and the budget allows),
+        a second `call()` as well. The first to succeed is returned, and the other is cancelled;
+        if both fail, the exception of the first call is raised.
+        """
+        if not self.enabled:
+            return await call()
+        self.budget.deposit()
+        started_at = time.perf_counter()
+        delay = self._delay
+        if delay is None:
+            # Not enough latencies yet
+            result = await call()
+            self.record(time.perf_counter() - started_at)
+            return result
+
+        first = asyncio.ensure_future(call())
+        tasks = [first]
+        try:
+            await asyncio.wait(tasks, timeout=delay)
+            if not first.done() and self.budget.try_withdraw():
+                with self._lock:
+                    self.hedges += 1
+                HEDGES.labels(self.endpoint).inc()
+                tasks.append(asyncio.ensure_future(call()))
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task in done and task.exception() is None:
+                        # If the hedge won, the first call took at least this long
+                        self.record(time.perf_counter() - started_at)
+                        if task is not first:
+                            with self._lock:
+                                self.wins += 1
+                            HEDGE_WINS.labels(self.endpoint).inc()
+                        return task.result()
+            raise first.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
@@ -1,13 +1,56 @@
+import asyncio
+import atexit
+import importlib.util
+import logging
+import threading
+import time
 from json import JSONDecodeError
 from typing import Callable
 
 import httpx
 from rest_framework import status
 
-from api.paystack.paystack_serializers import PaystackTransactionInitResponseSerializer, \
-    PaystackTransactionStatusResponseSerializer
+from api.metrics import registry
+from api.providers import PaymentProvider, PaymentProviderException
+from api.paystack.hedging import HedgePolicy
+from api.paystack.resilience import UpstreamGuard, UpstreamUnavailable
+from api.paystack.retries import Deadline, RetryPolicy, get_deadline
+from api.paystack.paystack_parsers import transaction_init_response_parser, \
+    transaction_status_response_parser
+from api.paystack.single_flight import SingleFlight, AsyncSingleFlight
+from api.paystack.status_cache import PaymentStatusCache
+from api.tracing import CLIENT, TRACEPARENT_HEADER, Span, tracer
 from restful_payment_gateway_api.settings import \
-    (PAYSTACK_TEST_SECRET_KEY, PAYSTACK_API_BASE_URL)
+    (PAYSTACK_TEST_SECRET_KEY, PAYSTACK_API_BASE_URL, PAYSTACK_HTTP_MAX_CONNECTIONS,
+     PAYSTACK_HTTP_MAX_KEEPALIVE_CONNECTIONS, PAYSTACK_HTTP_KEEPALIVE_EXPIRY, PAYSTACK_HTTP2,
+     PAYSTACK_HTTP_TIMEOUT, PAYSTACK_HTTP_CONNECT_TIMEOUT, PAYSTACK_CALL_DEADLINE)
+
+logger = logging.getLogger(__name__)
+
+PAYSTACK_REQUESTS = registry.counter(
+    "paystack_requests_total",
+    "Attempted Paystack calls, by endpoint and outcome (status code, timeout, connection_error or rejected).",
+    ["endpoint", "outcome"])
+PAYSTACK_REQUEST_DURATION = registry.histogram(
+    "paystack_request_duration_seconds", "Duration of Paystack calls (each attempt), by endpoint.", ["endpoint"])
+PAYSTACK_RETRIES = registry.counter("paystack_retries_total", "Retried Paystack calls, by endpoint.", ["endpoint"])
+
+
+def get_paystack_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=PAYSTACK_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=PAYSTACK_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=PAYSTACK_HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_paystack_timeout(timeout: float = PAYSTACK_HTTP_TIMEOUT) -> httpx.Timeout:
+    return httpx.Timeout(timeout, connect=min(PAYSTACK_HTTP_CONNECT_TIMEOUT, timeout))
+
+
+def http2_available() -> bool:
+    """HTTP/2 support in httpx depends on the optional `h2` package."""
+    return PAYSTACK_HTTP2 and importlib.util.find_spec("h2") is not None
 
 
 def get_paystack_client(base_url: str, secret_key: str) -> httpx.Client:
@@ -15,30 +58,301 @@ def get_paystack_client(base_url: str, secret_key: str) -> httpx.Client:
         "Authorization": f"Bearer {secret_key}",
         "Content-Type": "application/json",
     }
-    return httpx.Client(base_url=base_url, headers=headers)
+    return httpx.Client(
+        base_url=base_url,
+        headers=headers,
+        limits=get_paystack_limits(),
+        timeout=get_paystack_timeout(),
+        http2=http2_available())
+
+
+def get_async_paystack_client(base_url: str, secret_key: str) -> httpx.AsyncClient:
+    headers = {
+        "Authorization": f"Bearer {secret_key}",
+        "Content-Type": "application/json",
+    }
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        limits=get_paystack_limits(),
+        timeout=get_paystack_timeout(),
+        http2=http2_available())
+
+
+# Closes of replaced clients in progress, which must be referenced until they are done
+_closing_clients: set[asyncio.Task] = set()
+
+
+async def _aclose_replaced_client(client: httpx.AsyncClient):
+    try:
+        await client.aclose()
+    except RuntimeError:
+        # Its event loop is closed, so its connections cannot be shut down cleanly. The pool is
+        # emptied all the same, and their sockets are closed when they are garbage collected.
+        pass
+
+
+def close_replaced_client(client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop):
+    """
+    Closes `client`, a pooled `httpx.AsyncClient` of the event loop `loop`, which is being replaced
+    by a client of the running loop. If `loop` is still running (in another thread), the client is
+    closed on it; otherwise it is closed, as far as it can be, on the running loop.
+    """
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        return
+    task = asyncio.get_running_loop().create_task(_aclose_replaced_client(client))
+    _closing_clients.add(task)
+    task.add_done_callback(_closing_clients.discard)
+
+
+class PaystackClientException(PaymentProviderException):
+    pass
+
+
+INIT_PAYMENT_ENDPOINT = "init_payment"
+PAYMENT_STATUS_ENDPOINT = "payment_status"
+
+
+def create_paystack_guards() -> dict[str, UpstreamGuard]:
+    """A guard (circuit breaker and concurrency limit) for each Paystack endpoint, configured by the settings."""
+    return {endpoint: UpstreamGuard(endpoint) for endpoint in (INIT_PAYMENT_ENDPOINT, PAYMENT_STATUS_ENDPOINT)}
 
 
-class PaystackClientException(Exception):
+class BasePaystackClient:
+    """
+    Request building and response handling shared by `PaystackClient` and
+    `AsyncPaystackClient`, which only differ in how they do the I/O.
+
+    Calls to each endpoint go through a circuit breaker and an adaptive concurrency limit
+    (see `api.paystack.resilience`). Rejected calls are not made, and raise a
+    `PaystackClientException` with a 503 status code.
+
+    Every call has a deadline (see `api.paystack.retries`), and failed attempts are retried
+    within it when that is safe: status lookups after connection errors, timeouts, and 5xx
+    or 429 responses, but initializations only when the request was never sent. A call that
+    still fails raises a `PaystackClientException` with a 502 or (after a timeout) 504 status code.
+    """
+
     def __init__(
             self,
-            *args,
-            data=None,
-            status_code=status.HTTP_400_BAD_REQUEST):
-        super().__init__(*args)
-        self.data: dict | None = data
-        self.status_code = status_code
+            http_client_fun: Callable[[str, str], httpx.Client | httpx.AsyncClient],
+            secret_key: str = PAYSTACK_TEST_SECRET_KEY,
+            base_url: str = PAYSTACK_API_BASE_URL,
+            status_cache: PaymentStatusCache | None = None,
+            guards: dict[str, UpstreamGuard] | None = None,
+            retry_policy: RetryPolicy | None = None,
+            timeout: float = PAYSTACK_HTTP_TIMEOUT,
+            call_deadline: float = PAYSTACK_CALL_DEADLINE
+    ):
+        """
+        Parameters:
+            http_client_fun: A function that returns an `httpx` client instance
+                with provided secret key and base URL to make requests to the Paystack API.
+                This can be swapped with a mock implementation for testing purposes.
+                It is called once, and the returned client is reused until it is closed.
+            secret_key: The secret key used to authenticate requests to the Paystack API.
+            base_url: The base URL used to make requests to the Paystack API.
+            status_cache: An optional cache for payment status lookups.
+            guards: The guards of calls to each endpoint (see `create_paystack_guards`).
+            retry_policy: How failed calls are retried.
+            timeout: The number of seconds after which an attempt of a call times out.
+            call_deadline: The number of seconds a call, including its retries, may take.
+        """
+        self._http_client_fun = http_client_fun
+        self._secret_key = secret_key
+        self._base_url = base_url
+        self.status_cache = status_cache
+        self.guards = guards if guards is not None else create_paystack_guards()
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.timeout = timeout
+        self.call_deadline = call_deadline
+
+    @property
+    def secret_key(self) -> str:
+        return self._secret_key
+
+    def guard_snapshot(self) -> dict:
+        """The state of the circuit breaker and concurrency limit of each endpoint, for monitoring."""
+        return {endpoint: guard.snapshot() for endpoint, guard in self.guards.items()}
+
+    @staticmethod
+    def _unavailable_exception(e: UpstreamUnavailable) -> PaystackClientException:
+        return PaystackClientException(
+            data={
+                "status": False,
+                "message": "Paystack is temporarily unavailable, please try again later",
+                "data": {"endpoint": e.endpoint, "reason": e.reason, "retry_after": round(e.retry_after, 3)}
+            },
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @staticmethod
+    def _failed_call_exception(error: Exception | None) -> PaystackClientException:
+        """The exception for a call that failed without a response (`error` is `None` if it ran out of time)."""
+        if error is None or isinstance(error, (httpx.TimeoutException, TimeoutError)):
+            return PaystackClientException(
+                data={"status": False, "message": "Paystack did not respond in time", "data": {}},
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+        return PaystackClientException(
+            data={"status": False, "message": "Could not connect to Paystack", "data": {}},
+            status_code=status.HTTP_502_BAD_GATEWAY)
+
+    def _attempt_timeout(self, deadline: Deadline) -> httpx.Timeout:
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise self._failed_call_exception(None)
+        return get_paystack_timeout(min(self.timeout, remaining))
+
+    def _retry_delay(
+            self,
+            attempt: int,
+            idempotent: bool,
+            response: httpx.Response | None,
+            error: Exception | None,
+            deadline: Deadline
+    ) -> float | None:
+        """The delay before retrying a failed attempt, or `None` if it should not be retried."""
+        if error is not None:
+            # A request that could not connect was never sent, so it is always safe to retry
+            retryable = idempotent or isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+        else:
+            retryable = idempotent and (response.status_code >= 500 or response.status_code == 429)
+        if not retryable or attempt + 1 >= self.retry_policy.max_attempts:
+            return None
+        delay = self.retry_policy.backoff(attempt)
+        if delay >= deadline.remaining() or not self.retry_policy.budget.try_withdraw():
+            return None
+        return delay
+
+    @staticmethod
+    def _attempt_span(endpoint: str, method: str, path: str, attempt: int):
+        return tracer.start_span(f"paystack {endpoint}", CLIENT, {
+            "http.request.method": method,
+            "url.path": path,
+            "paystack.endpoint": endpoint,
+            "paystack.attempt": attempt,
+        })
+
+    @staticmethod
+    def _trace_headers(span: Span | None) -> dict[str, str] | None:
+        # Lets Paystack (or a proxy in front of it) tie the call to the request's trace
+        return {TRACEPARENT_HEADER: span.traceparent} if span is not None else None
+
+    @staticmethod
+    def _record_attempt(
+            endpoint: str,
+            started_at: float,
+            response: httpx.Response | None,
+            error: Exception | None,
+            span: Span | None = None
+    ):
+        PAYSTACK_REQUEST_DURATION.labels(endpoint).observe(time.perf_counter() - started_at)
+        if response is not None:
+            outcome = response.status_code
+        elif isinstance(error, (httpx.TimeoutException, TimeoutError)):
+            outcome = "timeout"
+        else:
+            outcome = "connection_error"
+        PAYSTACK_REQUESTS.labels(endpoint, outcome).inc()
+        if span is not None:
+            if response is not None:
+                span.set_attribute("http.response.status_code", response.status_code)
+            else:
+                span.error = outcome
 
+    def pool_stats(self) -> dict[str, int] | None:
+        """The number of open and idle pooled connections, or `None` if there is no pool (yet)."""
+        client = getattr(self, "_client", None)
+        # `httpx` does not expose its pool, so this relies on its (and httpcore's) internals
+        connections = getattr(getattr(getattr(client, "_transport", None), "_pool", None), "connections", None)
+        if connections is None:
+            return None
+        return {
+            "open": len(connections),
+            "idle": sum(1 for connection in connections if connection.is_idle()),
+        }
 
-class PaystackClient:
+    @staticmethod
+    def _init_payment_payload(email: str, amount: float) -> dict:
+        return {
+            "email": email,
+            "amount": int(amount * 100)
+        }
+
+    @staticmethod
+    def _payment_status_path(payment_id: str) -> str:
+        return f"/transaction/verify/{payment_id}"
+
+    @staticmethod
+    def _handle_init_payment_response(response: httpx.Response):
+        if not response.is_success:
+            try:
+                raise PaystackClientException(data=response.json(), upstream_status_code=response.status_code)
+            except JSONDecodeError:
+                # In case the error is one without a JSON response body (e.g. 5xx)
+                logger.warning("Paystack initialization failed with status %s and no JSON body", response.status_code)
+                raise PaystackClientException(
+                    data={"status": False, "message": "Server error", "data": {}},
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+
+        validated_data, errors = transaction_init_response_parser.validate(response.json())
+        if errors is not None:
+            raise PaystackClientException(errors)
+
+        return validated_data
+
+    @staticmethod
+    def _handle_payment_status_response(payment_id: str, response: httpx.Response):
+        try:
+            data = response.json()
+        except JSONDecodeError:
+            # In case the error is one without a JSON response body (e.g. 5xx)
+            logger.warning("Paystack verification of %s failed with status %s and no JSON body",
+                           payment_id, response.status_code)
+            raise PaystackClientException(
+                data={"payment_id": payment_id, "status": "failed", "message": "Server error"},
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if not response.is_success:
+            if data.get("code") == "transaction_not_found":
+                raise PaystackClientException(
+                    data={
+                        "payment_id": payment_id,
+                        "status": "failed",
+                        "message": "Payment with the given payment id not found"
+                    },
+                    status_code=status.HTTP_404_NOT_FOUND)
+
+            logger.warning("Paystack verification of %s failed with status %s: %s", payment_id, response.status_code, data)
+            raise PaystackClientException(
+                data={"payment_id": payment_id, "status": "failed"})
+
+        validated_data, errors = transaction_status_response_parser.validate(data)
+        if errors is not None:
+            raise PaystackClientException(data=errors)
+
+        return validated_data
+
+
+class PaystackClient(BasePaystackClient):
     """
     A lightweight client for interacting with the Paystack API.
+
+    The underlying `httpx.Client` is created on first use and then kept for the
+    lifetime of the instance, so requests share a pool of keep-alive connections
+    instead of paying for a new TCP + TLS handshake each time.
     """
 
     def __init__(
             self,
             http_client_fun: Callable[[str, str], httpx.Client] = get_paystack_client,
             secret_key: str = PAYSTACK_TEST_SECRET_KEY,
-            base_url: str = PAYSTACK_API_BASE_URL
+            base_url: str = PAYSTACK_API_BASE_URL,
+            status_cache: PaymentStatusCache | None = None,
+            guards: dict[str, UpstreamGuard] | None = None,
+            retry_policy: RetryPolicy | None = None,
+            timeout: float = PAYSTACK_HTTP_TIMEOUT,
+            call_deadline: float = PAYSTACK_CALL_DEADLINE
     ):
         """
         Creates a new `PaystackClient` instance.
@@ -46,61 +360,235 @@ class PaystackClient:
             http_client_fun: A function that returns an `httpx.Client` instance that accepts a
                 with provided secret key and base URL to make requests to the Paystack API.
                 This can be swapped with a mock implementation for testing purposes.
+                It is called once, and the returned client is reused until `close()` is called.
             secret_key: The secret key used to authenticate requests to the Paystack API.
             base_url: The base URL used to make requests to the Paystack API.
+            status_cache: An optional cache for payment status lookups.
+            guards: The guards of calls to each endpoint (see `create_paystack_guards`).
+            retry_policy: How failed calls are retried.
+            timeout: The number of seconds after which an attempt of a call times out.
+            call_deadline: The number of seconds a call, including its retries, may take.
         """
-        self._http_client_fun = http_client_fun
-        self._secret_key = secret_key
-        self._base_url = base_url
+        super().__init__(
+            http_client_fun, secret_key, base_url, status_cache, guards, retry_policy, timeout, call_deadline)
+        self._client: httpx.Client | None = None
+        self._client_lock = threading.Lock()
+        self._status_flights = SingleFlight()
 
     def _get_client(self) -> httpx.Client:
-        return self._http_client_fun(self._base_url, self._secret_key)
+        client = self._client
+        if client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._http_client_fun(self._base_url, self._secret_key)
+                    # Close the pool's sockets when the worker process exits
+                    atexit.register(self.close)
+                client = self._client
+        return client
 
-    def init_payment(self, email: str, amount: float):
-        with self._get_client() as client:
-            data = {
-                "email": email,
-                "amount": int(amount * 100)
-            }
-            response = client.post("/transaction/initialize", json=data)
-            if not response.is_success:
+    def close(self):
+        """Closes the pooled connections. The next request opens a new pool."""
+        with self._client_lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _send(self, endpoint: str, method: str, path: str, idempotent: bool, json: dict | None = None):
+        deadline = get_deadline(self.call_deadline)
+        self.retry_policy.budget.deposit()
+        attempt = 0
+        while True:
+            response, error = None, None
+            timeout = self._attempt_timeout(deadline)
+            started_at = time.perf_counter()
+            with self._attempt_span(endpoint, method, path, attempt) as span:
                 try:
-                    raise PaystackClientException(data=response.json())
-                except JSONDecodeError as e:
-                    # In case the error is one without a JSON response body (e.g. 5xx)
-                    print(e)
-                    raise PaystackClientException(
-                        data={"status": False, "message": "Server error", "data": {}},
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-                    )
+                    with self.guards[endpoint].call() as call:
+                        response = self._get_client().request(
+                            method, path, json=json, timeout=timeout, headers=self._trace_headers(span))
+                        call.record_status(response.status_code)
+                except UpstreamUnavailable as e:
+                    PAYSTACK_REQUESTS.labels(endpoint, "rejected").inc()
+                    raise self._unavailable_exception(e) from e
+                except httpx.TransportError as e:
+                    error = e
+                self._record_attempt(endpoint, started_at, response, error, span)
 
-            data = response.json()
-            serializer = PaystackTransactionInitResponseSerializer(data=data)
-            if not serializer.is_valid():
-                raise PaystackClientException(serializer.errors)
+            delay = self._retry_delay(attempt, idempotent, response, error, deadline)
+            if delay is None:
+                if error is not None:
+                    raise self._failed_call_exception(error) from error
+                return response
+            PAYSTACK_RETRIES.labels(endpoint).inc()
+            time.sleep(delay)
+            attempt += 1
 
-            return serializer.validated_data
+    def init_payment(self, email: str, amount: float):
+        response = self._send(
+            INIT_PAYMENT_ENDPOINT, "POST", "/transaction/initialize",
+            idempotent=False, json=self._init_payment_payload(email, amount))
+        return self._handle_init_payment_response(response)
 
     def get_payment_status(self, payment_id: str):
-        with self._get_client() as client:
-            response = client.get(f"/transaction/verify/{payment_id}")
-            data = response.json()
-            if not response.is_success:
-                if data["code"] == "transaction_not_found":
-                    raise PaystackClientException(
-                        data={
-                            "payment_id": payment_id,
-                            "status": "failed",
-                            "message": "Payment with the given payment id not found"
-                        },
-                        status_code=status.HTTP_404_NOT_FOUND)
-
-                print(data)
-                raise PaystackClientException(
-                    data={"payment_id": payment_id, "status": "failed"})
+        if self.status_cache is not None:
+            data = self.status_cache.get(payment_id)
+            if data is not None:
+                return data
+
+        # Concurrent lookups of the same payment share one request to Paystack
+        return self._status_flights.do(payment_id, lambda: self._fetch_payment_status(payment_id))
+
+    def _fetch_payment_status(self, payment_id: str):
+        response = self._send(
+            PAYMENT_STATUS_ENDPOINT, "GET", self._payment_status_path(payment_id), idempotent=True)
+        data = self._handle_payment_status_response(payment_id, response)
+
+        if self.status_cache is not None:
+            self.status_cache.set(payment_id, data)
+        return data
+
+
+class AsyncPaystackClient(BasePaystackClient, PaymentProvider):
+    """
+    The `asyncio` counterpart of `PaystackClient`, built on `httpx.AsyncClient`.
+
+    It has the same API and error mapping, but requests are awaited, so a worker can
+    have many Paystack calls in flight on one event loop. The pooled `httpx.AsyncClient`
+    is bound to the event loop it was created on; if it is used from a different loop
+    (e.g. separate `async_to_sync` calls) a new pool is created for that loop, and the old one is closed.
+    It is the Paystack `PaymentProvider`.
+    """
+    name = "paystack"
+
+    def __init__(
+            self,
+            http_client_fun: Callable[[str, str], httpx.AsyncClient] = get_async_paystack_client,
+            secret_key: str = PAYSTACK_TEST_SECRET_KEY,
+            base_url: str = PAYSTACK_API_BASE_URL,
+            status_cache: PaymentStatusCache | None = None,
+            guards: dict[str, UpstreamGuard] | None = None,
+            retry_policy: RetryPolicy | None = None,
+            timeout: float = PAYSTACK_HTTP_TIMEOUT,
+            call_deadline: float = PAYSTACK_CALL_DEADLINE,
+            hedge_policy: HedgePolicy | None = None
+    ):
+        """
+        Creates a new `AsyncPaystackClient` instance.
+        Parameters:
+            http_client_fun: A function that returns an `httpx.AsyncClient` instance
+                with provided secret key and base URL to make requests to the Paystack API.
+                This can be swapped with a mock implementation for testing purposes.
+            secret_key: The secret key used to authenticate requests to the Paystack API.
+            base_url: The base URL used to make requests to the Paystack API.
+            status_cache: An optional cache for payment status lookups.
+            guards: The guards of calls to each endpoint (see `create_paystack_guards`).
+            retry_policy: How failed calls are retried.
+            timeout: The number of seconds after which an attempt of a call times out.
+            call_deadline: The number of seconds a call, including its retries, may take.
+            hedge_policy: When status lookups are hedged (see `api.paystack.hedging`).
+        """
+        BasePaystackClient.__init__(
+            self, http_client_fun, secret_key, base_url, status_cache, guards, retry_policy, timeout, call_deadline)
+        self.hedge_policy = hedge_policy if hedge_policy is not None else HedgePolicy(PAYMENT_STATUS_ENDPOINT)
+        self._client: httpx.AsyncClient | None = None
+        self._client_loop: asyncio.AbstractEventLoop | None = None
+        self._status_flights = AsyncSingleFlight()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            if self._client is None:
+                atexit.register(self._close_at_exit)
+            else:
+                close_replaced_client(self._client, self._client_loop)
+            self._client = self._http_client_fun(self._base_url, self._secret_key)
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        """Closes the pooled connections. The next request opens a new pool."""
+        client, self._client, self._client_loop = self._client, None, None
+        if client is not None:
+            atexit.unregister(self._close_at_exit)
+            await client.aclose()
+
+    def _close_at_exit(self):
+        # The event loop the pool belongs to is usually gone by now,
+        # so closing is best effort.
+        try:
+            asyncio.run(self.aclose())
+        except Exception:
+            pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def _send(self, endpoint: str, method: str, path: str, idempotent: bool, json: dict | None = None):
+        deadline = get_deadline(self.call_deadline)
+        self.retry_policy.budget.deposit()
+        attempt = 0
+        while True:
+            response, error = None, None
+            timeout = self._attempt_timeout(deadline)
+            started_at = time.perf_counter()
+            with self._attempt_span(endpoint, method, path, attempt) as span:
+                try:
+                    async with self.guards[endpoint].call(deadline.remaining()) as call:
+                        # Within what is left of the deadline after waiting for a slot
+                        timeout = get_paystack_timeout(min(timeout.read, deadline.remaining()))
+                        # httpx's timeouts apply to each network operation, so the whole attempt is bounded too
+                        response = await asyncio.wait_for(
+                            self._get_client().request(
+                                method, path, json=json, timeout=timeout, headers=self._trace_headers(span)),
+                            timeout.read)
+                        call.record_status(response.status_code)
+                except UpstreamUnavailable as e:
+                    PAYSTACK_REQUESTS.labels(endpoint, "rejected").inc()
+                    raise self._unavailable_exception(e) from e
+                except (httpx.TransportError, asyncio.TimeoutError) as e:
+                    error = e
+                self._record_attempt(endpoint, started_at, response, error, span)
+
+            delay = self._retry_delay(attempt, idempotent, response, error, deadline)
+            if delay is None:
+                if error is not None:
+                    raise self._failed_call_exception(error) from error
+                return response
+            PAYSTACK_RETRIES.labels(endpoint).inc()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def init_payment(self, email: str, amount: float):
+        response = await self._send(
+            INIT_PAYMENT_ENDPOINT, "POST", "/transaction/initialize",
+            idempotent=False, json=self._init_payment_payload(email, amount))
+        return self._handle_init_payment_response(response)
+
+    async def get_payment_status(self, payment_id: str):
+        if self.status_cache is not None:
+            data = await self.status_cache.aget(payment_id)
+            if data is not None:
+                return data
+
+        # Concurrent lookups of the same payment share one request to Paystack
+        return await self._status_flights.do(payment_id, lambda: self._fetch_payment_status(payment_id))
 
-            serializer = PaystackTransactionStatusResponseSerializer(data=data)
-            if not serializer.is_valid():
-                return PaystackClientException(data=serializer.errors)
+    async def _fetch_payment_status(self, payment_id: str):
+        # Lookups are safe to repeat, so a slow one may be hedged with a second one
+        response = await self.hedge_policy.run(lambda: self._send(
+            PAYMENT_STATUS_ENDPOINT, "GET", self._payment_status_path(payment_id), idempotent=True))
+        data = self._handle_payment_status_response(payment_id, response)
 
-            return serializer.validated_data
+        if self.status_cache is not None:
+            await self.status_cache.aset(payment_id, data)
+        return data
@@ -0,0 +1,11 @@
+"""
+Fast-path parsers for Paystack responses, compiled from the serializers in `paystack_serializers`,
+which remain the source of truth for the fields (and are what the OpenAPI schema is generated from).
+"""
+from api.fast_parsers import compile_parser
+from api.paystack.paystack_serializers import PaystackTransactionInitResponseSerializer, \
+    PaystackTransactionStatusResponseSerializer, PaystackWebhookEventSerializer
+
+transaction_init_response_parser = compile_parser(PaystackTransactionInitResponseSerializer)
+transaction_status_response_parser = compile_parser(PaystackTransactionStatusResponseSerializer)
+webhook_event_parser = compile_parser(PaystackWebhookEventSerializer)
@@ -25,3 +25,8 @@ class PaystackTransactionStatusDataSerializer(serializers.Serializer):
 
 class PaystackTransactionStatusResponseSerializer(BasePaystackResponseSerializer):
     data = PaystackTransactionStatusDataSerializer()
+
+class PaystackWebhookEventSerializer(serializers.Serializer):
+    event = serializers.CharField()
+    # `charge.*` events carry the same transaction data as the verify endpoint
+    data = PaystackTransactionStatusDataSerializer()
@@ -0,0 +1,353 @@
+"""
+Protection of the service against a degraded upstream API.
+
+Each upstream endpoint gets an `UpstreamGuard`, made of a `CircuitBreaker` (which stops
+calls for a while after repeated failures) and an `AdaptiveLimiter` (which caps the number
+of calls in flight, lowering the cap when the upstream slows down or fails and slowly
+raising it while it is healthy). Calls that are not let through fail with `UpstreamUnavailable`,
+instead of tying up the worker until the upstream times out: right away while the circuit is
+open, and after waiting briefly for a call to finish when the concurrency limit is reached.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+from restful_payment_gateway_api.settings import \
+    (PAYSTACK_CIRCUIT_FAILURE_THRESHOLD, PAYSTACK_CIRCUIT_RECOVERY_TIMEOUT, PAYSTACK_CIRCUIT_HALF_OPEN_CALLS,
+     PAYSTACK_CONCURRENCY_LIMIT_INITIAL, PAYSTACK_CONCURRENCY_LIMIT_MIN, PAYSTACK_CONCURRENCY_LIMIT_MAX,
+     PAYSTACK_CONCURRENCY_LATENCY_THRESHOLD, PAYSTACK_CONCURRENCY_QUEUE_TIMEOUT)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when a call to an upstream endpoint is rejected without being made."""
+
+    def __init__(self, endpoint: str, reason: str, retry_after: float):
+        super().__init__(f"{endpoint} is unavailable ({reason})")
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker. While closed, calls are let through and consecutive failures
+    are counted; after `failure_threshold` of them it opens, and calls are rejected for
+    `recovery_timeout` seconds. It is then half-open: up to `half_open_calls` trial calls
+    are let through at a time, and the first of them to succeed closes it again,
+    while a failure opens it for another `recovery_timeout` seconds.
+    """
+
+    def __init__(
+            self,
+            failure_threshold: int = PAYSTACK_CIRCUIT_FAILURE_THRESHOLD,
+            recovery_timeout: float = PAYSTACK_CIRCUIT_RECOVERY_TIMEOUT,
+            half_open_calls: int = PAYSTACK_CIRCUIT_HALF_OPEN_CALLS,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._half_open_calls = half_open_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self._recovery_timeout:
+            self._state = HALF_OPEN
+            self._trial_calls = 0
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def before_call(self) -> tuple[bool, float | None]:
+        """
+        Admits or rejects a call. Returns `(trial, retry_after)`, where `retry_after` is `None`
+        if the call is admitted, and otherwise the number of seconds until calls may be let
+        through again, and `trial` is whether an admitted call is a trial call (made while half-open).
+        Admitted calls must be followed by `on_success`, `on_failure` or `on_cancel`.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return False, None
+            if state == HALF_OPEN:
+                if self._trial_calls < self._half_open_calls:
+                    self._trial_calls += 1
+                    return True, None
+                # Rejected until the trial calls finish
+                return False, 1.0
+            return False, max(self._recovery_timeout - (self._clock() - self._opened_at), 0.0)
+
+    def on_success(self, trial: bool):
+        with self._lock:
+            if trial:
+                self._trial_calls = max(self._trial_calls - 1, 0)
+                if self._state == HALF_OPEN:
+                    self._state = CLOSED
+            if self._state == CLOSED:
+                self._failures = 0
+
+    def on_failure(self, trial: bool):
+        with self._lock:
+            if trial:
+                self._trial_calls = max(self._trial_calls - 1, 0)
+                if self._state == HALF_OPEN:
+                    self._open()
+                return
+            if self._state == CLOSED:
+                self._failures += 1
+                if self._failures >= self._failure_threshold:
+                    self._open()
+
+    def on_cancel(self, trial: bool):
+        """Records that an admitted call was not made, or that its outcome is unknown."""
+        with self._lock:
+            if trial:
+                self._trial_calls = max(self._trial_calls - 1, 0)
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._failures = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            state = self._current_state()
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "retry_after": (
+                    max(self._recovery_timeout - (self._clock() - self._opened_at), 0.0)
+                    if state == OPEN else 0.0),
+            }
+
+
+class AdaptiveLimiter:
+    """
+    A limit on the number of calls in flight, adjusted by AIMD (additive increase,
+    multiplicative decrease) like TCP congestion control: the limit is multiplied by
+    `backoff_ratio` when a call fails or takes longer than `latency_threshold` seconds,
+    and grows by about one for every `limit` calls that succeed while it is being used.
+
+    Async calls over the limit (see `acquire`) wait in line for up to `queue_timeout` seconds
+    for a call to finish, so that e.g. a lookup made while a bulk lookup fills the limit is
+    delayed rather than rejected; synchronous calls (`try_acquire`) are rejected right away.
+    """
+
+    def __init__(
+            self,
+            initial_limit: int = PAYSTACK_CONCURRENCY_LIMIT_INITIAL,
+            min_limit: int = PAYSTACK_CONCURRENCY_LIMIT_MIN,
+            max_limit: int = PAYSTACK_CONCURRENCY_LIMIT_MAX,
+            latency_threshold: float = PAYSTACK_CONCURRENCY_LATENCY_THRESHOLD,
+            backoff_ratio: float = 0.5,
+            queue_timeout: float = PAYSTACK_CONCURRENCY_QUEUE_TIMEOUT
+    ):
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._latency_threshold = latency_threshold
+        self._backoff_ratio = backoff_ratio
+        self._queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._rejected = 0
+        # Futures of the async calls waiting for a slot, which may be of different event loops
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            # Calls waiting in line are let through first
+            if self._waiters or self._in_flight >= int(self._limit):
+                self._rejected += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    async def acquire(self, max_wait: float = math.inf) -> bool:
+        """
+        Takes a slot for a call, waiting in line for up to `queue_timeout` (and at most `max_wait`)
+        seconds if the limit is reached. Returns whether a slot was taken.
+        """
+        timeout = min(self._queue_timeout, max_wait)
+        with self._lock:
+            if not self._waiters and self._in_flight < int(self._limit):
+                self._in_flight += 1
+                return True
+            if timeout <= 0:
+                self._rejected += 1
+                return False
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+
+        try:
+            async with asyncio.timeout(None if math.isinf(timeout) else timeout):
+                await waiter
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # The slot was handed over before the call stopped waiting, so it is given back here
+                    # (if the waiter was cancelled before the hand over, `_hand_over` gives it back)
+                    self._in_flight -= 1
+                    self._wake_waiters()
+                if isinstance(e, asyncio.TimeoutError):
+                    self._rejected += 1
+                    return False
+            raise
+        return True
+
+    def _wake_waiters(self):
+        """Hands the free slots over to the calls waiting in line. Called with the lock held."""
+        while self._waiters and self._in_flight < int(self._limit):
+            waiter = self._waiters.popleft()
+            try:
+                waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter)
+            except RuntimeError:
+                # Its event loop is closed
+                continue
+            self._in_flight += 1
+
+    def _hand_over(self, waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(None)
+            return
+        # The call stopped waiting (timed out or was cancelled) after it was handed a slot
+        with self._lock:
+            self._in_flight -= 1
+            self._wake_waiters()
+
+    def release(self, latency: float, failed: bool):
+        with self._lock:
+            # Only grow the limit when it is actually being used
+            in_use = self._in_flight >= self._limit / 2
+            self._in_flight -= 1
+            if failed or latency > self._latency_threshold:
+                self._limit = max(self._limit * self._backoff_ratio, self._min_limit)
+            elif in_use:
+                self._limit = min(self._limit + 1 / self._limit, self._max_limit)
+            self._wake_waiters()
+
+    def cancel(self):
+        """Releases a call without using it as a sample (e.g. because it was never made)."""
+        with self._lock:
+            self._in_flight -= 1
+            self._wake_waiters()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "limit": int(self._limit), "in_flight": self._in_flight,
+                "waiting": len(self._waiters), "rejected": self._rejected}
+
+
+class UpstreamGuard:
+    """
+    Guards calls to one upstream endpoint with a circuit breaker and an adaptive limiter:
+
+        with guard.call() as call:
+            response = client.get(...)
+            call.record_status(response.status_code)
+
+    or `async with guard.call(max_wait)`, which waits (for at most `max_wait` seconds, e.g. what
+    is left of the call's deadline) for a slot if the concurrency limit is reached.
+    Raises `UpstreamUnavailable` when entering the block if the call is rejected.
+    The call counts as failed if the block raises, or if `record_status` is given a
+    5xx or 429 status code; other responses (e.g. 404) mean the upstream is healthy.
+    """
+
+    def __init__(
+            self,
+            endpoint: str,
+            breaker: CircuitBreaker | None = None,
+            limiter: AdaptiveLimiter | None = None,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self.endpoint = endpoint
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.limiter = limiter if limiter is not None else AdaptiveLimiter()
+        self._clock = clock
+
+    def call(self, max_wait: float = math.inf) -> "GuardedCall":
+        return GuardedCall(self, max_wait)
+
+    def snapshot(self) -> dict:
+        return {"circuit": self.breaker.snapshot(), "concurrency": self.limiter.snapshot()}
+
+
+class GuardedCall:
+    __slots__ = ("_guard", "_max_wait", "_started_at", "_trial", "failed")
+
+    def __init__(self, guard: UpstreamGuard, max_wait: float = math.inf):
+        self._guard = guard
+        self._max_wait = max_wait
+        self._started_at = 0.0
+        self._trial = False
+        self.failed = False
+
+    def record_status(self, status_code: int):
+        self.failed = status_code >= 500 or status_code == 429
+
+    def __enter__(self) -> "GuardedCall":
+        if not self._guard.limiter.try_acquire():
+            raise UpstreamUnavailable(self._guard.endpoint, "concurrency_limit", 1.0)
+        return self._admit()
+
+    async def __aenter__(self) -> "GuardedCall":
+        if not await self._guard.limiter.acquire(self._max_wait):
+            raise UpstreamUnavailable(self._guard.endpoint, "concurrency_limit", 1.0)
+        return self._admit()
+
+    def _admit(self) -> "GuardedCall":
+        """Checks the circuit breaker, once the call has a slot."""
+        guard = self._guard
+        self._trial, retry_after = guard.breaker.before_call()
+        if retry_after is not None:
+            guard.limiter.cancel()
+            raise UpstreamUnavailable(guard.endpoint, "circuit_open", retry_after)
+        self._started_at = guard._clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        guard = self._guard
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            # The caller went away (e.g. the client disconnected), which says nothing about the upstream
+            guard.limiter.cancel()
+            guard.breaker.on_cancel(self._trial)
+            return
+        failed = self.failed or exc_type is not None
+        guard.limiter.release(guard._clock() - self._started_at, failed)
+        if failed:
+            guard.breaker.on_failure(self._trial)
+        else:
+            guard.breaker.on_success(self._trial)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.__exit__(exc_type, exc_value, traceback)
+
+
+def retry_after_header(retry_after: float) -> str:
+    """The value of a `Retry-After` header (whole seconds) for `retry_after` seconds."""
+    return str(max(math.ceil(retry_after), 1))
@@ -0,0 +1,148 @@
+"""
+Retries and deadlines of calls to an upstream API.
+
+A `Deadline` is the point in time by which a call (including all of its retries) must be
+done. The deadline of the request being handled is kept in a context variable (see
+`deadline_scope`), so calls made while handling it never outlive it.
+
+Retries wait for an exponentially growing, fully jittered delay, and are paid for from
+a `RetryBudget`, so that when the upstream is down retries add a bounded fraction of
+load instead of multiplying it.
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from restful_payment_gateway_api.settings import \
+    (PAYSTACK_RETRY_MAX_ATTEMPTS, PAYSTACK_RETRY_BASE_DELAY, PAYSTACK_RETRY_MAX_DELAY,
+     PAYSTACK_RETRY_BUDGET_RATIO, PAYSTACK_RETRY_BUDGET_MIN_PER_SECOND)
+
+
+class Deadline:
+    __slots__ = ("expires_at", "_clock")
+
+    def __init__(self, timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.expires_at = clock() + timeout
+        self._clock = clock
+
+    def remaining(self) -> float:
+        return max(self.expires_at - self._clock(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_current_deadline: contextvars.ContextVar[Deadline | None] = contextvars.ContextVar(
+    "current_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(timeout: float):
+    """
+    Sets a deadline `timeout` seconds from now for calls made in the block
+    (including in tasks started from it), unless an earlier one is already set.
+    """
+    current = _current_deadline.get()
+    deadline = Deadline(timeout)
+    if current is not None and current.expires_at <= deadline.expires_at:
+        deadline = current
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def get_deadline(timeout: float) -> Deadline:
+    """The deadline of a call that takes at most `timeout` seconds, within the current deadline (if any)."""
+    current = _current_deadline.get()
+    deadline = Deadline(timeout)
+    if current is not None and current.expires_at < deadline.expires_at:
+        return current
+    return deadline
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of calls: every call deposits `ratio` tokens, and every
+    retry withdraws one, so retries are at most about `ratio` of the calls. In addition,
+    `min_per_second` tokens are deposited every second so that a low-traffic service
+    can still retry. At most `max_tokens` tokens are kept.
+    """
+
+    def __init__(
+            self,
+            ratio: float = PAYSTACK_RETRY_BUDGET_RATIO,
+            min_per_second: float = PAYSTACK_RETRY_BUDGET_MIN_PER_SECOND,
+            max_tokens: float | None = None,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self._ratio = ratio
+        self._min_per_second = min_per_second
+        self._max_tokens = max_tokens if max_tokens is not None else max(min_per_second * 10, 10.0)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = self._max_tokens
+        self._updated_at = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self._tokens + (now - self._updated_at) * self._min_per_second, self._max_tokens)
+        self._updated_at = now
+
+    def deposit(self):
+        """Records a call."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens + self._ratio, self._max_tokens)
+
+    def try_withdraw(self) -> bool:
+        """Pays for a retry, returning whether there was enough budget for it."""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class RetryPolicy:
+    """How many times, and after how long, a failed call is retried."""
+
+    def __init__(
+            self,
+            max_attempts: int = PAYSTACK_RETRY_MAX_ATTEMPTS,
+            base_delay: float = PAYSTACK_RETRY_BASE_DELAY,
+            max_delay: float = PAYSTACK_RETRY_MAX_DELAY,
+            budget: RetryBudget | None = None,
+            rng: random.Random | None = None
+    ):
+        """
+        Parameters:
+            max_attempts: The maximum number of attempts of a call, including the first.
+            base_delay: The maximum delay before the first retry, in seconds.
+                It doubles for every further retry.
+            max_delay: The maximum delay before any retry, in seconds.
+            budget: The budget retries are paid for from.
+            rng: The random number generator used for jitter.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget if budget is not None else RetryBudget()
+        self._rng = rng if rng is not None else random.Random()
+
+    def backoff(self, attempt: int) -> float:
+        """The delay before retrying after attempt number `attempt` (starting at 0) failed."""
+        # "Full jitter", so that clients that failed together do not retry together
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
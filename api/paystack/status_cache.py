@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from django.core.cache import caches
+
+from api.metrics import registry
+from restful_payment_gateway_api.settings import \
+    (PAYSTACK_STATUS_CACHE_MAX_ENTRIES, PAYSTACK_STATUS_CACHE_PENDING_TTL,
+     PAYSTACK_STATUS_CACHE_ALIAS)
+
+LOOKUPS = registry.counter(
+    "payment_status_cache_lookups_total",
+    "Payment status cache lookups, by result (local_hit, shared_hit or miss).", ["result"])
+_LOCAL_HITS = LOOKUPS.labels("local_hit")
+_SHARED_HITS = LOOKUPS.labels("shared_hit")
+_MISSES = LOOKUPS.labels("miss")
+
+# A transaction in one of these states can never change again
+TERMINAL_STATUSES = frozenset({"success", "failed", "reversed"})
+
+
+def is_terminal(data: dict) -> bool:
+    """Whether the (validated) verify response `data` is for a transaction in a terminal state."""
+    return data["data"]["status"] in TERMINAL_STATUSES
+
+
+class PaymentStatusCache:
+    """
+    A cache of validated Paystack verify responses, keyed by payment id.
+
+    Responses for transactions in a terminal state (see `TERMINAL_STATUSES`) are kept
+    until they are evicted, while other responses (e.g. `pending`, `abandoned`, `ongoing`)
+    expire after a short TTL so that polling clients still see the transaction progress.
+    A cached terminal response is never replaced by a non-terminal one, e.g. by a lookup
+    that started before a webhook event settled the transaction.
+
+    Entries are kept in an in-process LRU bounded by `max_entries`. Optionally, a Django
+    cache (e.g. Redis or Memcached) is used as a second level, so that all workers share
+    results: in-process misses are looked up there and new results are written to both.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = PAYSTACK_STATUS_CACHE_MAX_ENTRIES,
+            pending_ttl: float = PAYSTACK_STATUS_CACHE_PENDING_TTL,
+            cache_alias: str | None = PAYSTACK_STATUS_CACHE_ALIAS,
+            key_prefix: str = "paystack:status",
+            clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Parameters:
+            max_entries: The maximum number of responses kept in process memory.
+            pending_ttl: The number of seconds a non-terminal response is cached for.
+            cache_alias: The alias (in `CACHES`) of a Django cache shared by all workers,
+                or `None` to only cache in process memory.
+            key_prefix: The prefix of keys in the shared cache.
+            clock: The monotonic clock used for expiry (mostly for testing).
+        """
+        self._max_entries = max_entries
+        self._pending_ttl = pending_ttl
+        self._cache_alias = cache_alias
+        self._key_prefix = key_prefix
+        self._clock = clock
+        self._lock = threading.Lock()
+        # payment id -> (expiry time or None if the entry never expires, data)
+        self._entries: OrderedDict[str, tuple[float | None, dict]] = OrderedDict()
+
+    @property
+    def shared_cache(self):
+        return caches[self._cache_alias] if self._cache_alias is not None else None
+
+    def _shared_key(self, payment_id: str) -> str:
+        return f"{self._key_prefix}:{payment_id}"
+
+    def _timeout(self, data: dict) -> float | None:
+        return None if is_terminal(data) else self._pending_ttl
+
+    def _get_local(self, payment_id: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(payment_id)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._entries[payment_id]
+                return None
+            self._entries.move_to_end(payment_id)
+            return data
+
+    def _set_local(self, payment_id: str, data: dict, timeout: float | None):
+        expires_at = None if timeout is None else self._clock() + timeout
+        with self._lock:
+            self._entries[payment_id] = (expires_at, data)
+            self._entries.move_to_end(payment_id)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, payment_id: str) -> dict | None:
+        data = self._get_local(payment_id)
+        if data is not None:
+            _LOCAL_HITS.inc()
+            return data
+        if self.shared_cache is not None:
+            data = self.shared_cache.get(self._shared_key(payment_id))
+            if data is not None:
+                _SHARED_HITS.inc()
+                # The shared cache enforces the remaining TTL, so only terminal
+                # responses are promoted to the local cache
+                if is_terminal(data):
+                    self._set_local(payment_id, data, None)
+                return data
+        _MISSES.inc()
+        return None
+
+    async def aget(self, payment_id: str) -> dict | None:
+        data = self._get_local(payment_id)
+        if data is not None:
+            _LOCAL_HITS.inc()
+            return data
+        if self.shared_cache is not None:
+            data = await self.shared_cache.aget(self._shared_key(payment_id))
+            if data is not None:
+                _SHARED_HITS.inc()
+                if is_terminal(data):
+                    self._set_local(payment_id, data, None)
+                return data
+        _MISSES.inc()
+        return None
+
+    def _settled_locally(self, payment_id: str, data: dict) -> bool:
+        """Whether `data` is not terminal, but a terminal response of the payment is cached in process memory."""
+        if is_terminal(data):
+            return False
+        cached = self._get_local(payment_id)
+        return cached is not None and is_terminal(cached)
+
+    def set(self, payment_id: str, data: dict):
+        if self._settled_locally(payment_id, data):
+            return
+        if self.shared_cache is not None and not is_terminal(data):
+            cached = self.shared_cache.get(self._shared_key(payment_id))
+            if cached is not None and is_terminal(cached):
+                return
+        timeout = self._timeout(data)
+        self._set_local(payment_id, data, timeout)
+        if self.shared_cache is not None:
+            self.shared_cache.set(self._shared_key(payment_id), data, timeout)
+
+    async def aset(self, payment_id: str, data: dict):
+        if self._settled_locally(payment_id, data):
+            return
+        if self.shared_cache is not None and not is_terminal(data):
+            cached = await self.shared_cache.aget(self._shared_key(payment_id))
+            if cached is not None and is_terminal(cached):
+                return
+        timeout = self._timeout(data)
+        self._set_local(payment_id, data, timeout)
+        if self.shared_cache is not None:
+            await self.shared_cache.aset(self._shared_key(payment_id), data, timeout)
+
+    def clear(self):
+        """Clears the in-process entries. The shared cache is left as is."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,64 +1,258 @@
+import asyncio
+import copy
 import json
+import os
+import random
+import threading
+import time
+import uuid
 from datetime import datetime
+from typing import Callable
 
 import httpx
 
 from api.paystack.utils.sample_responses import init_payment_200_OK, verify_200_OK
 
+# Private copies, so that nothing here depends on (or changes) the shared samples
+_INIT_RESPONSE_TEMPLATE = copy.deepcopy(init_payment_200_OK)
+_VERIFY_RESPONSE_TEMPLATE = copy.deepcopy(verify_200_OK)
 
-def mock_paystack_handler(request: httpx.Request) -> httpx.Response:
-    """Mock handler for Paystack API requests"""
+NOT_FOUND_PAYMENT_IDS = frozenset({"invalid-payment-id", "test-payment-id"})
+
+
+class MockPaystackServer:
+    """
+    An in-memory stand-in for the Paystack API.
+
+    Initialized transactions are kept in a table, so that an initialize -> verify flow
+    sees consistent data, and `settle()` simulates the customer completing (or failing)
+    a payment. Unknown references are answered based on the reference itself:
+    `invalid-payment-id` and `test-payment-id` are not found, references containing
+    `failed` have failed, references containing `mock-ref` are abandoned, and any other
+    reference was paid successfully.
+
+    Every response is built from scratch, and the table is guarded by a lock,
+    so one server can be used by many threads or coroutines at once.
+    Latency and failures can be injected to simulate a remote, unreliable API.
+
+    It can be used as an httpx transport (`transport()`, `client_fun()`, `async_client_fun()`)
+    or served as an ASGI application, e.g. `uvicorn --factory api.paystack.utils.mock:create_mock_paystack_app`.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            error_rate: float = 0.0,
+            seed: int | None = None
+    ):
+        """
+        Parameters:
+            latency: The number of seconds every request takes.
+            jitter: The maximum number of seconds randomly added to `latency`.
+            error_rate: The probability of a request failing with a 500 response.
+            seed: The seed of the random number generator used for jitter and failures.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._transactions: dict[str, dict] = {}
+
+    def _random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _delay(self) -> float:
+        return self.latency + (self._random() * self.jitter if self.jitter else 0)
+
+    def _should_fail(self) -> bool:
+        return self.error_rate > 0 and self._random() < self.error_rate
+
+    def settle(self, reference: str, status: str = "success"):
+        """Simulates the customer completing (or failing) the payment of an initialized transaction."""
+        with self._lock:
+            transaction = self._transactions[reference]
+            transaction["status"] = status
+            transaction["paid_at"] = datetime.now().isoformat() if status == "success" else None
 
-    # Handle payment initialisation
-    if request.method == "POST" and request.url.path == "/transaction/initialize":
-        request_data = json.loads(request.content.decode())
-        response_data = init_payment_200_OK
-        response_data["data"]["reference"] = \
-            f"mock-ref-{request_data.get('email', 'test').replace('@', '-at-')}-{request_data.get('amount', 3000)}"
-        response_data["data"]["authorization_url"] = f"https://checkout.paystack.com/mock-reference-123"
-
-        return httpx.Response(200, json=response_data)
-
-    # Handle payment status verification
-    if request.method == "GET" and request.url.path.startswith("/transaction/verify/"):
-        payment_id = request.url.path.split("/")[-1]
-
-        # Mock different responses based on payment_id
-        if payment_id == "invalid-payment-id" or payment_id == "test-payment-id":
-            response_data = {
-                "status": False,
-                "message": "Transaction reference not found",
-                "code": "transaction_not_found"
+    def respond(self, method: str, path: str, body: bytes) -> tuple[int, dict]:
+        """Returns the status code and JSON body of the response to a request."""
+        if self._should_fail():
+            return 500, {"status": False, "message": "Mock server error"}
+
+        if method == "POST" and path == "/transaction/initialize":
+            return self._initialize(json.loads(body or b"{}"))
+
+        if method == "GET" and path.startswith("/transaction/verify/"):
+            return self._verify(path.rsplit("/", 1)[-1])
+
+        return 404, {"status": False, "message": "Endpoint not found"}
+
+    def _initialize(self, request_data: dict) -> tuple[int, dict]:
+        access_code = uuid.uuid4().hex[:15]
+        email = str(request_data.get("email", "test"))
+        reference = f"mock-ref-{email.replace('@', '-at-')}-{request_data.get('amount', 3000)}-{access_code}"
+        with self._lock:
+            self._transactions[reference] = {
+                "status": "abandoned",
+                "reference": reference,
+                "amount": request_data.get("amount", 3000),
+                "paid_at": None,
+                "created_at": datetime.now().isoformat(),
             }
-            return httpx.Response(404, json=response_data)
 
-        elif "failed" in payment_id.lower():
-            response_data = verify_200_OK
-            response_data["data"]["status"] = "failed"
-            response_data["data"]["paid_at"] = None
+        return 200, {
+            **_INIT_RESPONSE_TEMPLATE,
+            "data": {
+                "authorization_url": f"https://checkout.paystack.com/{access_code}",
+                "access_code": access_code,
+                "reference": reference,
+            },
+        }
 
-            return httpx.Response(200, json=response_data)
+    def _verify(self, payment_id: str) -> tuple[int, dict]:
+        with self._lock:
+            transaction = self._transactions.get(payment_id)
+            transaction = dict(transaction) if transaction is not None else None
 
-        else:
-            # Mock successful or pending payment
-            paid_at = None if "mock-ref" in payment_id else datetime.now().isoformat()
-            response_data = verify_200_OK
-            response_data["data"]["status"] = "success" if paid_at else "abandoned"
-            response_data["data"]["reference"] = payment_id
-            response_data["data"]["paid_at"] = paid_at
-            response_data["data"]["created_at"] = datetime.now().isoformat()
+        if transaction is None:
+            if payment_id in NOT_FOUND_PAYMENT_IDS:
+                return 404, {
+                    "status": False,
+                    "message": "Transaction reference not found",
+                    "code": "transaction_not_found"
+                }
+            now = datetime.now().isoformat()
+            if "failed" in payment_id.lower():
+                transaction = {"status": "failed", "paid_at": None}
+            elif "mock-ref" in payment_id:
+                transaction = {"status": "abandoned", "paid_at": None, "created_at": now}
+            else:
+                transaction = {"status": "success", "paid_at": now, "created_at": now}
+            transaction["reference"] = payment_id
 
-            return httpx.Response(200, json=response_data)
+        return 200, {
+            **_VERIFY_RESPONSE_TEMPLATE,
+            # The nested objects of the template are shared, but never modified
+            "data": {**_VERIFY_RESPONSE_TEMPLATE["data"], **transaction},
+        }
 
-    # Default response for unknown endpoints
-    return httpx.Response(404, json={"status": False, "message": "Endpoint not found"})
+    def _response(self, request: httpx.Request) -> httpx.Response:
+        status_code, data = self.respond(request.method, request.url.path, request.content)
+        return httpx.Response(status_code, json=data)
 
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        return self._response(request)
 
-def get_mock_paystack_client(base_url: str, secret_key: str):
-    """Factory function that returns httpx client with mock transport"""
-    headers = {
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return self._response(request)
+
+    def transport(self) -> "MockPaystackTransport":
+        return MockPaystackTransport(self)
+
+    def client_fun(self) -> Callable[[str, str], httpx.Client]:
+        """Returns a factory function for `PaystackClient` that sends requests to this server"""
+        def get_client(base_url: str, secret_key: str) -> httpx.Client:
+            return httpx.Client(base_url=base_url, headers=_headers(secret_key), transport=self.transport())
+
+        return get_client
+
+    def async_client_fun(self) -> Callable[[str, str], httpx.AsyncClient]:
+        """Returns a factory function for `AsyncPaystackClient` that sends requests to this server"""
+        def get_client(base_url: str, secret_key: str) -> httpx.AsyncClient:
+            return httpx.AsyncClient(base_url=base_url, headers=_headers(secret_key), transport=self.transport())
+
+        return get_client
+
+    async def __call__(self, scope, receive, send):
+        """Serves the mock API as an ASGI application."""
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        status_code, data = self.respond(scope["method"], scope["path"], body)
+        content = json.dumps(data).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(content)).encode())],
+        })
+        await send({"type": "http.response.body", "body": content})
+
+
+class MockPaystackTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """An httpx transport (for both sync and async clients) that sends requests to a `MockPaystackServer`"""
+
+    def __init__(self, server: MockPaystackServer):
+        self.server = server
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        return self.server.handle_request(request)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        return await self.server.handle_async_request(request)
+
+
+def _headers(secret_key: str) -> dict:
+    return {
         "Authorization": f"Bearer {secret_key}",
         "Content-Type": "application/json",
     }
-    mock_transport = httpx.MockTransport(mock_paystack_handler)
-    return httpx.Client(base_url=base_url, headers=headers, transport=mock_transport)
\ No newline at end of file
+
+
+def create_mock_paystack_app() -> MockPaystackServer:
+    """
+    Creates a mock server configured by the `MOCK_PAYSTACK_LATENCY`, `MOCK_PAYSTACK_JITTER`
+    and `MOCK_PAYSTACK_ERROR_RATE` environment variables, to be served with an ASGI server.
+    """
+    return MockPaystackServer(
+        latency=float(os.environ.get("MOCK_PAYSTACK_LATENCY", 0)),
+        jitter=float(os.environ.get("MOCK_PAYSTACK_JITTER", 0)),
+        error_rate=float(os.environ.get("MOCK_PAYSTACK_ERROR_RATE", 0)))
+
+
+# Shared by the functions below, which predate `MockPaystackServer`
+_default_server = MockPaystackServer()
+
+
+def mock_paystack_handler(request: httpx.Request) -> httpx.Response:
+    """Mock handler for Paystack API requests"""
+    return _default_server.handle_request(request)
+
+
+def get_mock_paystack_client(base_url: str, secret_key: str):
+    """Factory function that returns httpx client with mock transport"""
+    return httpx.Client(base_url=base_url, headers=_headers(secret_key), transport=_default_server.transport())
+
+
+def get_mock_async_paystack_client(base_url: str, secret_key: str):
+    """Factory function that returns an async httpx client with mock transport"""
+    return httpx.AsyncClient(base_url=base_url, headers=_headers(secret_key), transport=_default_server.transport())
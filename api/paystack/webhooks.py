@@ -0,0 +1,16 @@
+import hashlib
+import hmac
+
+# Events whose data is applied to the local payment records
+PAYMENT_STATUS_EVENTS = frozenset({"charge.success", "charge.failed"})
+
+
+def compute_signature(body: bytes, secret_key: str) -> str:
+    """Paystack signs webhook bodies with an HMAC-SHA512 keyed by the secret key."""
+    return hmac.new(secret_key.encode(), body, hashlib.sha512).hexdigest()
+
+
+def is_valid_signature(body: bytes, signature: str | None, secret_key: str | None) -> bool:
+    if not signature or not secret_key:
+        return False
+    return hmac.compare_digest(compute_signature(body, secret_key), signature)
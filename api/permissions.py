@@ -0,0 +1,23 @@
+import hmac
+
+from rest_framework import permissions
+
+from restful_payment_gateway_api.settings import PAYMENTS_EXPORT_TOKEN
+
+
+def has_bearer_token(request, token: str) -> bool:
+    """Whether `request` (a Django or DRF request) sends `token` as a bearer token."""
+    authorization = request.headers.get("Authorization", "")
+    scheme, _, sent_token = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(sent_token.encode(), token.encode())
+
+
+class HasExportToken(permissions.BasePermission):
+    """
+    Allows requests that send `PAYMENTS_EXPORT_TOKEN` as a bearer token.
+    All requests are denied when the token is not configured.
+    """
+    message = "A valid export token is required."
+
+    def has_permission(self, request, view):
+        return bool(PAYMENTS_EXPORT_TOKEN) and has_bearer_token(request, PAYMENTS_EXPORT_TOKEN)
@@ -0,0 +1,240 @@
+"""
+Payment providers and routing between them.
+
+A payment provider (e.g. Paystack or Flutterwave) initializes payments and looks up their
+statuses, with requests and responses shaped like Paystack's, which is what the API returns.
+Payments are initialized with one of `PAYMENT_PROVIDERS`, chosen by a `ProviderRouter`
+from exponentially weighted moving averages (EWMA) of each provider's latency and error
+rate: the fastest provider with an acceptable error rate is tried first, and if it fails
+(e.g. a 5xx response, timeout or open circuit), the payment is initialized with the next one instead.
+
+A provider that is not used has no fresh statistics, so every `PAYMENT_ROUTER_PROBE_INTERVAL`
+seconds it is tried first once, which lets a provider that has recovered win traffic back.
+
+The statuses of payments are looked up with the provider that initialized them, which is
+told by the prefix of their reference (Paystack's have none).
+"""
+import abc
+import logging
+import math
+import threading
+import time
+from typing import Awaitable, Callable, Sequence, TypeVar
+
+from rest_framework import status
+
+from api.metrics import registry
+from restful_payment_gateway_api.settings import \
+    (PAYMENT_ROUTER_EWMA_ALPHA, PAYMENT_ROUTER_ERROR_RATE_THRESHOLD, PAYMENT_ROUTER_PROBE_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_FAILOVERS = registry.counter(
+    "payment_provider_failovers_total", "Calls that failed over to another provider, by the provider that failed.",
+    ["provider"])
+
+T = TypeVar("T")
+
+
+class PaymentProviderException(Exception):
+    """
+    A failed call to a payment provider, with the data and status code of the API's response,
+    and the status code of the provider's response (if there was one).
+    """
+
+    def __init__(
+            self,
+            *args,
+            data=None,
+            status_code=status.HTTP_400_BAD_REQUEST,
+            upstream_status_code: int | None = None):
+        super().__init__(*args)
+        self.data: dict | None = data
+        self.status_code = status_code
+        self.upstream_status_code = upstream_status_code
+
+    @property
+    def provider_failed(self) -> bool:
+        """Whether the provider was at fault (e.g. unavailable), rather than the request."""
+        if self.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+            return True
+        return self.upstream_status_code is not None and (
+                self.upstream_status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR
+                or self.upstream_status_code == status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class PaymentProvider(abc.ABC):
+    """
+    The interface of payment provider clients. Subclasses must implement `init_payment`
+    and `get_payment_status`, or they cannot be instantiated.
+
+    Responses are shaped like Paystack's (see `api.paystack.paystack_serializers`), and
+    failures raise a `PaymentProviderException`: with a 4xx status code if the request was
+    at fault, or a 5xx status code if the provider was.
+    """
+    # The name of the provider in `PAYMENT_PROVIDERS`
+    name: str
+    # The prefix of the references of the provider's payments
+    reference_prefix: str = ""
+    status_cache = None
+
+    @abc.abstractmethod
+    async def init_payment(self, email: str, amount: float) -> dict:
+        """Initializes a payment of `amount` (in the currency's main unit, e.g. naira) by the customer with `email`."""
+
+    @abc.abstractmethod
+    async def get_payment_status(self, payment_id: str) -> dict:
+        """Looks up the status of the payment with reference `payment_id`."""
+
+    async def aclose(self):
+        """Closes the provider's pooled connections."""
+
+
+class ProviderRegistry:
+    """The providers that can be routed to, created on first use."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._factories: dict[str, tuple[Callable[[], PaymentProvider], str]] = {}
+        self._providers: dict[str, PaymentProvider] = {}
+
+    def register(self, name: str, factory: Callable[[], PaymentProvider], reference_prefix: str = ""):
+        """Registers the provider `name`, created by `factory`, whose references start with `reference_prefix`."""
+        with self._lock:
+            self._factories[name] = factory, reference_prefix
+            self._providers.pop(name, None)
+
+    def get(self, name: str) -> PaymentProvider:
+        provider = self._providers.get(name)
+        if provider is None:
+            with self._lock:
+                provider = self._providers.get(name)
+                if provider is None:
+                    provider = self._providers[name] = self._factories[name][0]()
+        return provider
+
+    def name_for_reference(self, reference: str) -> str | None:
+        """The name of the provider whose references start like `reference`, or `None` if there is none."""
+        matches = [(len(prefix), name) for name, (_, prefix) in self._factories.items()
+                   if prefix and reference.startswith(prefix)]
+        return max(matches)[1] if matches else None
+
+    def __contains__(self, name: str):
+        return name in self._factories
+
+    async def aclose(self):
+        with self._lock:
+            providers = list(self._providers.values())
+            self._providers.clear()
+        for provider in providers:
+            await provider.aclose()
+
+
+class ProviderStats:
+    """Moving averages of the latency and error rate of a provider's calls."""
+    __slots__ = ("latency", "error_rate", "calls", "last_used")
+
+    def __init__(self, now: float):
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.calls = 0
+        # Providers without calls yet are ranked last, so they are first probed a probe interval from now
+        self.last_used = now
+
+    def record(self, latency: float, failed: bool, alpha: float, now: float):
+        self.last_used = now
+        if self.calls == 0:
+            self.latency = latency
+            self.error_rate = float(failed)
+        else:
+            self.latency += alpha * (latency - self.latency)
+            self.error_rate += alpha * (float(failed) - self.error_rate)
+        self.calls += 1
+
+    def snapshot(self) -> dict:
+        return {"latency": round(self.latency, 6), "error_rate": round(self.error_rate, 4), "calls": self.calls}
+
+
+class ProviderRouter:
+    def __init__(
+            self,
+            alpha: float = PAYMENT_ROUTER_EWMA_ALPHA,
+            error_rate_threshold: float = PAYMENT_ROUTER_ERROR_RATE_THRESHOLD,
+            probe_interval: float = PAYMENT_ROUTER_PROBE_INTERVAL,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Parameters:
+            alpha: The weight of a new call in the moving averages (between 0 and 1).
+            error_rate_threshold: The error rate from which a provider is degraded, and only
+                tried after the providers that are not.
+            probe_interval: The number of seconds after which a provider that was not used is tried first once.
+            clock: The monotonic clock used for latencies and probes (mostly for testing).
+        """
+        self._alpha = alpha
+        self._error_rate_threshold = error_rate_threshold
+        self._probe_interval = probe_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats: dict[str, ProviderStats] = {}
+
+    def stats(self, name: str) -> ProviderStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            # `setdefault` is atomic, so concurrent callers get the same stats
+            stats = self._stats.setdefault(name, ProviderStats(self._clock()))
+        return stats
+
+    def rank(self, providers: Sequence[PaymentProvider]) -> list[PaymentProvider]:
+        """The order in which `providers` are tried: healthy before degraded, then fastest first, after any probe."""
+        now = self._clock()
+        with self._lock:
+            ranked = sorted(providers, key=lambda provider: self._score(self.stats(provider.name)))
+            # Providers that were not used lately have stale (or no) statistics
+            stale = [provider for provider in ranked[1:]
+                     if now - self.stats(provider.name).last_used >= self._probe_interval]
+            if stale:
+                ranked.remove(stale[0])
+                ranked.insert(0, stale[0])
+            # So that concurrent requests do not probe it too
+            self.stats(ranked[0].name).last_used = now
+        return ranked
+
+    def _score(self, stats: ProviderStats) -> tuple[bool, float]:
+        if stats.calls == 0:
+            return False, math.inf
+        return stats.error_rate >= self._error_rate_threshold, stats.latency
+
+    async def call(self, providers: Sequence[PaymentProvider], call: Callable[[PaymentProvider], Awaitable[T]]) -> T:
+        """
+        Calls the best of `providers` (see `rank`), failing over to the next one when a provider fails.
+        The exception of the last provider tried is raised if all of them fail.
+        """
+        ranked = self.rank(providers)
+        for index, provider in enumerate(ranked):
+            started_at = self._clock()
+            try:
+                result = await call(provider)
+            except PaymentProviderException as e:
+                # Errors in the request are not the provider's fault, and would fail with any provider
+                failed = e.provider_failed
+                self._record(provider, started_at, failed)
+                if not failed or index + 1 == len(ranked):
+                    raise
+                PROVIDER_FAILOVERS.labels(provider.name).inc()
+                logger.warning("%s failed with status %s, failing over to %s",
+                               provider.name, e.status_code, ranked[index + 1].name)
+                continue
+            self._record(provider, started_at, False)
+            return result
+        raise ValueError("No payment providers to call")
+
+    def _record(self, provider: PaymentProvider, started_at: float, failed: bool):
+        stats = self.stats(provider.name)
+        now = self._clock()
+        with self._lock:
+            stats.record(now - started_at, failed, self._alpha, now)
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in self._stats.items()}
@@ -0,0 +1,274 @@
+"""
+Reconciliation of unsettled payments.
+
+The status of a payment is only recorded when a client looks it up or Paystack sends a
+webhook event, so a payment whose customer never comes back (or whose event is lost) would
+stay `pending` forever. The `PaymentReconciler` sweeps such payments: it finds the payments
+that are not settled yet with an indexed query, the most recently initialized first (they are
+the most likely to have changed, and to be asked about), looks them up on their provider in
+batches, with a few lookups at a time and a token bucket capping the rate of lookups, and
+writes the statuses back with `bulk_update`.
+
+Every payment that is looked up is stamped with `last_checked_at`, whether the lookup
+succeeded or not, so that each batch moves on to other payments, and a payment is looked up
+again at most every `recheck_interval` seconds.
+
+Only one sweep runs at a time across all workers and processes sharing the database: a sweep
+holds a `Lease`, renewed before each batch, and a sweep that cannot take it ends right away.
+"""
+import asyncio
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import close_old_connections, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from api.fan_out import gather_with_concurrency
+from api.metrics import registry
+from api.models import Lease, Payment
+from api.paystack.status_cache import TERMINAL_STATUSES
+from api.providers import PaymentProvider, PaymentProviderException, ProviderRegistry
+from api.throttling import RateLimiter
+from restful_payment_gateway_api.settings import \
+    (PAYMENT_RECONCILIATION_INTERVAL, PAYMENT_RECONCILIATION_MIN_AGE, PAYMENT_RECONCILIATION_MAX_AGE,
+     PAYMENT_RECONCILIATION_RECHECK_INTERVAL, PAYMENT_RECONCILIATION_BATCH_SIZE,
+     PAYMENT_RECONCILIATION_CONCURRENCY, PAYMENT_RECONCILIATION_RATE, PAYMENT_RECONCILIATION_LEASE_TIMEOUT,
+     PAYSTACK_MERCHANTS)
+
+logger = logging.getLogger(__name__)
+
+CHECKS = registry.counter(
+    "payment_reconciliation_checks_total",
+    "Payments looked up by the reconciliation sweeper, by outcome (updated, unchanged or failed).", ["outcome"])
+
+# The statuses of payments that can still change, and all the statuses a payment can be recorded with
+UNSETTLED_STATUSES = tuple(status for status, _ in Payment.PAYMENT_STATUS if status not in TERMINAL_STATUSES)
+PAYMENT_STATUSES = frozenset(status for status, _ in Payment.PAYMENT_STATUS)
+
+LEASE_NAME = "payment_reconciliation"
+
+
+class PaymentReconciler:
+    """Looks up unsettled payments on their provider, once or every `interval` seconds in a background thread."""
+
+    def __init__(
+            self,
+            providers: ProviderRegistry,
+            default_provider: str,
+            merchant_client_fun: Callable[[str], PaymentProvider] | None = None,
+            merchants: dict[str, str] = PAYSTACK_MERCHANTS,
+            interval: float = PAYMENT_RECONCILIATION_INTERVAL,
+            min_age: float = PAYMENT_RECONCILIATION_MIN_AGE,
+            max_age: float = PAYMENT_RECONCILIATION_MAX_AGE,
+            recheck_interval: float = PAYMENT_RECONCILIATION_RECHECK_INTERVAL,
+            batch_size: int = PAYMENT_RECONCILIATION_BATCH_SIZE,
+            concurrency: int = PAYMENT_RECONCILIATION_CONCURRENCY,
+            rate: float = PAYMENT_RECONCILIATION_RATE,
+            lease_timeout: float = PAYMENT_RECONCILIATION_LEASE_TIMEOUT,
+            clock: Callable[[], datetime] = timezone.now
+    ):
+        """
+        Parameters:
+            providers: The providers payments are looked up with. They are closed after every
+                sweep, as each sweep runs in an event loop of its own.
+            default_provider: The name of the provider of payments whose reference has no provider prefix.
+            merchant_client_fun: Creates the Paystack client of a merchant other than the default one from
+                its secret key. Those clients are closed after every sweep. Without it, only payments of the
+                default merchant are looked up.
+            merchants: The merchants other than the default one, as ids and secret keys. Payments of merchants
+                that are not (or no longer) configured are not looked up, as no key can find them.
+            interval: The number of seconds between the sweeps of the background thread.
+            min_age: The number of seconds after initialization before a payment is looked up,
+                so that customers who are still paying are left alone.
+            max_age: The number of seconds after initialization after which a payment is no longer looked up.
+            recheck_interval: The minimum number of seconds between two lookups of a payment.
+            batch_size: The number of payments fetched and written back at a time.
+            concurrency: The number of lookups in flight at a time.
+            rate: The maximum number of lookups per second.
+            lease_timeout: The number of seconds after which the lease of a sweep that stopped renewing it
+                (e.g. because its process died) expires, letting another sweep take over.
+            clock: The clock used for ages and `last_checked_at` (mostly for testing).
+        """
+        self._providers = providers
+        self._default_provider = default_provider
+        self._merchant_client_fun = merchant_client_fun
+        self._merchants = merchants
+        # The clients of the merchants whose payments the current sweep looked up, by merchant id
+        self._merchant_providers: dict[str, PaymentProvider] = {}
+        self._interval = interval
+        self._min_age = timedelta(seconds=min_age)
+        self._max_age = timedelta(seconds=max_age)
+        self._recheck_interval = timedelta(seconds=recheck_interval)
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._lease_timeout = timedelta(seconds=lease_timeout)
+        self._clock = clock
+        self._limiter = RateLimiter("reconciliation", rate=rate, burst=concurrency, cache_alias=None)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def stale_payments(self, now: datetime) -> QuerySet:
+        """
+        The unsettled payments due for a lookup at `now`, the most recent first.
+        The status and initiation time are a range scan of `payment_status_initiated_idx`.
+        """
+        merchants = Q(merchant="")
+        if self._merchant_client_fun is not None and self._merchants:
+            merchants |= Q(merchant__in=list(self._merchants))
+        return Payment.objects.filter(
+            Q(last_checked_at__isnull=True) | Q(last_checked_at__lte=now - self._recheck_interval),
+            merchants,
+            status__in=UNSETTLED_STATUSES,
+            initiated_at__lte=now - self._min_age,
+            initiated_at__gt=now - self._max_age,
+        ).order_by("-initiated_at")
+
+    def _acquire_lease(self, holder: str) -> bool:
+        """Takes or renews the lease of the sweeps for `holder`. Returns whether it holds it."""
+        now = self._clock()
+        expires_at = now + self._lease_timeout
+        if Lease.objects.filter(Q(holder=holder) | Q(expires_at__lte=now), name=LEASE_NAME).update(
+                holder=holder, expires_at=expires_at):
+            return True
+        # Either another sweep holds it, or it was never taken
+        _, created = Lease.objects.get_or_create(name=LEASE_NAME, defaults={"holder": holder, "expires_at": expires_at})
+        return created
+
+    def _release_lease(self, holder: str):
+        Lease.objects.filter(name=LEASE_NAME, holder=holder).update(holder="", expires_at=self._clock())
+
+    def _fetch_batch(self, now: datetime) -> list[Payment]:
+        return list(
+            self.stale_payments(now).only("id", "reference", "merchant", "status", "paid_at")[:self._batch_size])
+
+    def _provider(self, payment: Payment) -> PaymentProvider:
+        if payment.merchant:
+            provider = self._merchant_providers.get(payment.merchant)
+            if provider is None:
+                provider = self._merchant_providers[payment.merchant] = self._merchant_client_fun(
+                    self._merchants[payment.merchant])
+            return provider
+        return self._providers.get(self._providers.name_for_reference(payment.reference) or self._default_provider)
+
+    async def _check(self, payment: Payment) -> dict | None:
+        """The transaction data of `payment` on its provider, or `None` if the lookup failed."""
+        while (wait := self._limiter.acquire_local("sweep")) > 0:
+            await asyncio.sleep(wait)
+        try:
+            data = await self._provider(payment).get_payment_status(payment.reference)
+        except PaymentProviderException as e:
+            # e.g. a provider outage; it is tried again later
+            logger.debug("Could not reconcile payment %s: %s %s", payment.reference, e.status_code, e.data)
+            return None
+        return data["data"]
+
+    def _write(self, payments: list[Payment], results: list[dict | None], checked_at: datetime) -> tuple[int, int]:
+        """Writes the looked up statuses of `payments` back. Returns the number of updated and failed lookups."""
+        updated = []
+        failed = 0
+        for payment, result in zip(payments, results):
+            if result is None:
+                failed += 1
+                continue
+            if result["status"] not in PAYMENT_STATUSES:
+                continue
+            if result["status"] != payment.status or (result["paid_at"] is not None and payment.paid_at is None):
+                payment.status, payment.paid_at = result["status"], result["paid_at"]
+                payment.transaction_data = result
+                updated.append(payment)
+
+        with transaction.atomic():
+            Payment.objects.filter(pk__in=[payment.pk for payment in payments]).update(last_checked_at=checked_at)
+            # Payments settled (e.g. by a webhook event) since the batch was fetched keep their status
+            settled = set(Payment.objects.filter(
+                pk__in=[payment.pk for payment in updated if payment.status not in TERMINAL_STATUSES],
+                status__in=TERMINAL_STATUSES).values_list("pk", flat=True))
+            updated = [payment for payment in updated if payment.pk not in settled]
+            if updated:
+                Payment.objects.bulk_update(
+                    updated, ["status", "paid_at", "transaction_data"], batch_size=self._batch_size)
+        return len(updated), failed
+
+    async def sweep(self) -> dict[str, int]:
+        """
+        Looks up every payment that is due, a batch at a time, unless another sweep is running.
+        Returns the number of payments that were checked, updated (whose status changed) and whose lookup failed.
+        """
+        counts = {"checked": 0, "updated": 0, "failed": 0}
+        # Payments are due relative to the start of the sweep, so the payments checked
+        # during the sweep are not due again before it ends
+        started_at = self._clock()
+        holder = uuid.uuid4().hex
+        if not await sync_to_async(self._acquire_lease)(holder):
+            logger.info("Skipped reconciliation, as another sweep is running")
+            return counts
+        try:
+            while not self._stopped.is_set():
+                payments = await sync_to_async(self._fetch_batch)(started_at)
+                if not payments:
+                    break
+                results = await gather_with_concurrency(
+                    self._concurrency, (self._check(payment) for payment in payments))
+                updated, failed = await sync_to_async(self._write)(payments, results, self._clock())
+
+                counts["checked"] += len(payments)
+                counts["updated"] += updated
+                counts["failed"] += failed
+                CHECKS.labels("updated").inc(updated)
+                CHECKS.labels("failed").inc(failed)
+                CHECKS.labels("unchanged").inc(len(payments) - updated - failed)
+
+                # Renewed after each batch, so that it does not expire during a long sweep
+                if not await sync_to_async(self._acquire_lease)(holder):
+                    logger.warning("Stopped reconciliation, as another sweep took over its expired lease")
+                    break
+        finally:
+            await self._providers.aclose()
+            merchant_providers, self._merchant_providers = self._merchant_providers, {}
+            for provider in merchant_providers.values():
+                await provider.aclose()
+            await sync_to_async(self._release_lease)(holder)
+
+        if counts["checked"]:
+            logger.info("Reconciled %(checked)d payments: %(updated)d updated, %(failed)d failed", counts)
+        return counts
+
+    def run_once(self) -> dict[str, int]:
+        """Runs a sweep (see `sweep`) in an event loop of its own."""
+        try:
+            return async_to_sync(self.sweep)()
+        finally:
+            close_old_connections()
+
+    def start(self):
+        """Starts sweeping every `interval` seconds in a background thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="payment-reconciler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the background thread, after the batch it is sweeping. Later sweeps (e.g. `run_once`) still run."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stopped.set()
+        thread.join()
+        # The flag also stops `sweep`, which must not stay stopped once the thread is gone
+        self._stopped.clear()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Payment reconciliation failed")
@@ -0,0 +1,240 @@
+"""
+The OpenAPI schema and its documentation pages.
+
+drf-spectacular takes a noticeable share of the start-up time, but is only needed to
+generate the schema (the production settings profile does not even install it as an app). So views are annotated with
+the `extend_schema` here, which records the annotations instead of importing
+drf-spectacular, and they are applied by a preprocessing hook when a schema is
+generated.
+
+Generating the schema introspects every view and serializer, so it is done once per
+version of the application (`APP_VERSION`): by `python manage.py build_schema`, which
+writes it to `SCHEMA_ARTIFACT_PATH` at build time, or otherwise on the first request
+for it. The schema and documentation pages are then served from memory, with strong
+ETags (so that clients can revalidate with `If-None-Match`) and precompressed gzip bodies.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import threading
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from api.compression import negotiate_encoding
+from restful_payment_gateway_api.settings import APP_VERSION, SCHEMA_ARTIFACT_PATH
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = "application/vnd.oai.openapi+json"
+YAML_CONTENT_TYPE = "application/vnd.oai.openapi"
+# The number of query strings (e.g. `?script`) whose documentation pages are cached per view
+MAX_CACHED_VARIANTS = 8
+
+_lock = threading.Lock()
+# (view, arguments of drf-spectacular's extend_schema) not applied yet
+_deferred: list[tuple[type, dict]] = []
+
+
+def extend_schema(**kwargs):
+    """
+    drf-spectacular's `extend_schema`, applied when a schema is first generated.
+    Items of `parameters` can be dictionaries of the arguments of `OpenApiParameter`,
+    so that views need not import it.
+    """
+    def decorator(view):
+        with _lock:
+            _deferred.append((view, kwargs))
+        return view
+    return decorator
+
+
+def apply_schema_extensions(endpoints):
+    """A drf-spectacular preprocessing hook applying the recorded `extend_schema` annotations."""
+    from drf_spectacular.utils import OpenApiParameter, extend_schema as spectacular_extend_schema
+
+    with _lock:
+        deferred = list(_deferred)
+        _deferred.clear()
+    for view, kwargs in deferred:
+        if "parameters" in kwargs:
+            kwargs = {**kwargs, "parameters": [
+                OpenApiParameter(**parameter) if isinstance(parameter, dict) else parameter
+                for parameter in kwargs["parameters"]]}
+        spectacular_extend_schema(**kwargs)(view)
+    return endpoints
+
+
+def generate_schema() -> dict:
+    """Generates the schema, as plain JSON data."""
+    from drf_spectacular.renderers import OpenApiJsonRenderer
+    from drf_spectacular.settings import spectacular_settings
+
+    schema = spectacular_settings.DEFAULT_GENERATOR_CLASS().get_schema(request=None, public=True)
+    # Rendered and parsed again, to turn lazy strings, decimals etc. into plain JSON values
+    return json.loads(OpenApiJsonRenderer().render(schema))
+
+
+def write_schema_artifact(path: str, schema: dict, version: str = APP_VERSION):
+    with open(path, "w") as file:
+        json.dump({"version": version, "schema": schema}, file)
+
+
+def read_schema_artifact(path: str, version: str = APP_VERSION) -> dict | None:
+    """The schema in the artifact at `path`, or `None` if there is none for `version`."""
+    try:
+        with open(path) as file:
+            artifact = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning("Ignoring unreadable schema artifact %s", path)
+        return None
+    if artifact.get("version") != version:
+        logger.info("Ignoring schema artifact %s of version %s", path, artifact.get("version"))
+        return None
+    return artifact["schema"]
+
+
+class CachedDocument:
+    """A response body kept in memory, with its ETag and gzipped body."""
+    __slots__ = ("body", "content_type", "etag", "gzipped_body", "gzipped_etag")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        # The same mtime every time, so the compressed body is deterministic
+        self.gzipped_body = gzip.compress(body, mtime=0)
+        # Each representation has its own strong ETag
+        self.gzipped_etag = f'"{digest}-gzip"'
+
+    def response(self, request: HttpRequest) -> HttpResponse:
+        gzipped = negotiate_encoding(request.headers.get("Accept-Encoding", ""), ("gzip",)) is not None
+        etag = self.gzipped_etag if gzipped else self.etag
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            etags = {tag.removeprefix("W/") for tag in parse_etags(if_none_match)}
+            if "*" in etags or etag in etags:
+                response = HttpResponseNotModified()
+                self._set_headers(response, etag)
+                return response
+
+        response = HttpResponse(self.gzipped_body if gzipped else self.body, content_type=self.content_type)
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+        self._set_headers(response, etag)
+        return response
+
+    @staticmethod
+    def _set_headers(response: HttpResponse, etag: str):
+        response["ETag"] = etag
+        response["Vary"] = "Accept, Accept-Encoding"
+        # Caches may keep it, but must revalidate, as it changes with every deployment
+        response["Cache-Control"] = "public, no-cache"
+
+
+class SchemaCache:
+    """The schema, rendered as JSON and YAML, loaded or generated on first use."""
+
+    def __init__(self, artifact_path: str | None = SCHEMA_ARTIFACT_PATH, version: str = APP_VERSION):
+        self._artifact_path = artifact_path
+        self._version = version
+        self._lock = threading.Lock()
+        self._schema: dict | None = None
+        self._documents: dict[str, CachedDocument] = {}
+
+    def schema(self) -> dict:
+        with self._lock:
+            if self._schema is None:
+                schema = None
+                if self._artifact_path is not None:
+                    schema = read_schema_artifact(self._artifact_path, self._version)
+                if schema is None:
+                    schema = generate_schema()
+                self._schema = schema
+            return self._schema
+
+    def get(self, schema_format: str) -> CachedDocument | None:
+        """The document in `schema_format`, if it was already rendered."""
+        return self._documents.get(schema_format)
+
+    def document(self, schema_format: str) -> CachedDocument:
+        """The document in `schema_format` ("json" or "yaml"), rendered if needed."""
+        document = self._documents.get(schema_format)
+        if document is None:
+            schema = self.schema()
+            if schema_format == "json":
+                document = CachedDocument(
+                    json.dumps(schema, ensure_ascii=False, separators=(",", ":")).encode(), JSON_CONTENT_TYPE)
+            else:
+                from drf_spectacular.renderers import OpenApiYamlRenderer
+                document = CachedDocument(OpenApiYamlRenderer().render(schema), YAML_CONTENT_TYPE)
+            self._documents[schema_format] = document
+        return document
+
+    def clear(self):
+        with self._lock:
+            self._schema = None
+            self._documents = {}
+
+
+schema_cache = SchemaCache()
+
+
+def negotiate_schema_format(request: HttpRequest) -> str:
+    """JSON or YAML, from the `format` query parameter or else the `Accept` header (YAML by default, like drf-spectacular)."""
+    schema_format = request.GET.get("format")
+    if schema_format in ("json", "yaml"):
+        return schema_format
+    return "json" if "json" in request.headers.get("Accept", "") else "yaml"
+
+
+async def schema_view(request: HttpRequest):
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+    schema_format = negotiate_schema_format(request)
+    document = schema_cache.get(schema_format)
+    if document is None:
+        # Generating the schema is CPU-bound and synchronous, so it is done off the event loop
+        document = await sync_to_async(schema_cache.document)(schema_format)
+    return document.response(request)
+
+
+def cached_view(view_path: str, **initkwargs):
+    """
+    A view that serves the successful responses of the class-based view at `view_path`
+    (module.Class) from memory, per query string. The view is imported on its first request.
+    """
+    view = None
+    documents: dict[str, CachedDocument] = {}
+
+    def render(request: HttpRequest) -> HttpResponse:
+        nonlocal view
+        if view is None:
+            module_name, class_name = view_path.rsplit(".", 1)
+            view = getattr(import_module(module_name), class_name).as_view(**initkwargs)
+        response = view(request)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    async def dispatch(request: HttpRequest, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET", "HEAD"])
+        key = request.META.get("QUERY_STRING", "")
+        document = documents.get(key)
+        if document is not None:
+            return document.response(request)
+        response = await sync_to_async(render)(request)
+        if response.status_code != 200 or len(documents) >= MAX_CACHED_VARIANTS:
+            return response
+        document = documents[key] = CachedDocument(response.content, response["Content-Type"])
+        return document.response(request)
+
+    return dispatch
@@ -3,9 +3,13 @@ from decimal import Decimal
 
 from rest_framework import serializers
 
+from api.export import EXPORT_FORMATS
+from api.fast_parsers import compile_parser
+from api.models import Payment
 from api.paystack.paystack_serializers import (
     PaystackTransactionStatusDataSerializer,
     PaystackTransactionInitResponseSerializer)
+from restful_payment_gateway_api.settings import PAYMENTS_BATCH_MAX_SIZE, PAYMENTS_BULK_STATUS_MAX_SIZE
 
 
 @dataclass
@@ -22,6 +26,8 @@ class PaymentInfoSerializer(serializers.Serializer):
     def to_data_class(self):
         return PaymentInfo(**self.validated_data)
 
+payment_info_parser = compile_parser(PaymentInfoSerializer)
+
 class BaseResponseSerializer(serializers.Serializer):
     status = serializers.CharField()
     message = serializers.CharField()
@@ -31,4 +37,65 @@ class InitiatePaymentResponseSerializer(BaseResponseSerializer):
     data = PaystackTransactionInitResponseSerializer()
 
 class GetPaymentStatusResponseSerializer(BaseResponseSerializer):
-    data = PaystackTransactionStatusDataSerializer()
\ No newline at end of file
+    data = PaystackTransactionStatusDataSerializer()
+
+class BatchPaymentInfoSerializer(serializers.Serializer):
+    # Each item is validated separately with `PaymentInfoSerializer`,
+    # so that invalid items do not fail the whole batch
+    payments = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=PAYMENTS_BATCH_MAX_SIZE)
+
+class BatchItemResultSerializer(serializers.Serializer):
+    index = serializers.IntegerField()
+    status_code = serializers.IntegerField()
+    data = serializers.JSONField()
+
+class BatchResponseSerializer(serializers.Serializer):
+    status = serializers.BooleanField()
+    message = serializers.CharField()
+    data = BatchItemResultSerializer(many=True)
+
+class BulkPaymentStatusRequestSerializer(serializers.Serializer):
+    references = serializers.ListField(
+        child=serializers.CharField(), allow_empty=False, max_length=PAYMENTS_BULK_STATUS_MAX_SIZE)
+
+class BulkPaymentStatusResultSerializer(serializers.Serializer):
+    reference = serializers.CharField()
+    status_code = serializers.IntegerField()
+    # `PaystackTransactionStatusDataSerializer` on success, error details otherwise
+    data = serializers.JSONField()
+
+class BulkPaymentStatusResponseSerializer(serializers.Serializer):
+    status = serializers.BooleanField()
+    message = serializers.CharField()
+    data = BulkPaymentStatusResultSerializer(many=True)
+
+class PaymentExportQuerySerializer(serializers.Serializer):
+    # Not `format`, which DRF reserves for selecting a renderer
+    file_format = serializers.ChoiceField(choices=list(EXPORT_FORMATS), default="ndjson")
+    status = serializers.ChoiceField(choices=Payment.PAYMENT_STATUS, required=False)
+    initiated_after = serializers.DateTimeField(required=False)
+    initiated_before = serializers.DateTimeField(required=False)
+
+class CircuitStateSerializer(serializers.Serializer):
+    state = serializers.ChoiceField(choices=["closed", "open", "half_open"])
+    consecutive_failures = serializers.IntegerField()
+    retry_after = serializers.FloatField()
+
+class ConcurrencyLimitStateSerializer(serializers.Serializer):
+    limit = serializers.IntegerField()
+    in_flight = serializers.IntegerField()
+    rejected = serializers.IntegerField()
+
+class UpstreamGuardStateSerializer(serializers.Serializer):
+    circuit = CircuitStateSerializer()
+    concurrency = ConcurrencyLimitStateSerializer()
+
+class PaystackHealthSerializer(serializers.Serializer):
+    init_payment = UpstreamGuardStateSerializer()
+    payment_status = UpstreamGuardStateSerializer()
+
+class PaystackHealthResponseSerializer(serializers.Serializer):
+    status = serializers.BooleanField()
+    message = serializers.CharField()
+    data = PaystackHealthSerializer()
@@ -1,27 +1,103 @@
-from django.test import Client, SimpleTestCase
+import asyncio
+import copy
+import gzip
+import io
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from io import StringIO
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.utils import timezone as django_timezone
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase
 from unittest.mock import patch
 from django.urls import reverse
 from rest_framework import status
+from rest_framework.exceptions import ParseError as DRFParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 import json
 
-from api.paystack.paystack_client import PaystackClient
-from api.paystack.utils.mock import get_mock_paystack_client
+import httpx
+
+from api.compression import StreamCompressor, negotiate_encoding
+from api.export import EXPORT_FIELDS, get_export_queryset, iter_chunks
+from api.fast_json import FastJSONParser, FastJSONRenderer
+from api.fast_parsers import ParseError, compile_parser
+from api.flutterwave.flutterwave_client import AsyncFlutterwaveClient
+from api.flutterwave.utils.mock import MockFlutterwaveServer
+from api.idempotency import IdempotencyConflict, IdempotencyStore
+from api.ledger import PaymentLedger
+from api.metrics import MetricsRegistry, SnapshotWriter, merge_snapshots, render
+from api.paystack.client_pool import PaystackClientPool
+from api.models import Lease, Payment
+from api.paystack.hedging import HedgePolicy
+from api.paystack.paystack_client import PaystackClient, AsyncPaystackClient, PaystackClientException
+from api.paystack.paystack_parsers import transaction_status_response_parser
+from api.paystack.paystack_serializers import PaystackTransactionInitResponseSerializer, \
+    PaystackTransactionStatusResponseSerializer
+from api.paystack.resilience import AdaptiveLimiter, CircuitBreaker, UpstreamGuard, UpstreamUnavailable
+from api.paystack.retries import RetryBudget, RetryPolicy, deadline_scope
+from api.paystack.single_flight import SingleFlight
+from api.paystack.status_cache import PaymentStatusCache
+from api.paystack.webhooks import compute_signature
+from api.providers import PaymentProvider, PaymentProviderException, ProviderRegistry, ProviderRouter
+from api.reconciliation import PaymentReconciler
+from api.paystack.utils.mock import get_mock_paystack_client, get_mock_async_paystack_client, \
+    mock_paystack_handler, MockPaystackServer
+from api.paystack.utils.sample_responses import init_payment_200_OK, verify_200_OK
+from api.schema import SchemaCache, write_schema_artifact
+from api.serializers import PaymentInfoSerializer
+from api.throttling import RateLimiter, rate_limiters
+from api.tracing import FileSpanExporter, InMemorySpanExporter, Tracer, parse_traceparent, tracer
+from api.views import InitPaymentView, GetPaymentStatusView, apply_payment_status_event, recorded_payment_statuses
 
 init_payment_url = reverse("api:initialize_payment")
 payment_status_url_view_name = "api:get_payment_status"
+paystack_webhook_url = reverse("api:paystack_webhook")
+batch_init_payment_url = reverse("api:initialize_payments_batch")
+bulk_payment_status_url = reverse("api:get_payment_statuses")
+export_payments_url = reverse("api:export_payments")
+mock_secret_key = "sk_test_mock"
 
 class PaystackMockTestCase(SimpleTestCase):
+    # Status lookups read the recorded payments (which these tests leave empty) before calling Paystack
+    databases = {"default"}
+
     def setUp(self):
         super().setUp()
         self.client = Client()
 
-        self.mock_paystack_client_instance = PaystackClient(http_client_fun=get_mock_paystack_client)
+        self.mock_paystack_client_instance = AsyncPaystackClient(
+            http_client_fun=get_mock_async_paystack_client,
+            secret_key=mock_secret_key,
+            status_cache=PaymentStatusCache(cache_alias=None))
         self.paystack_patcher = patch('api.views.paystack_client', self.mock_paystack_client_instance)
         self.paystack_patcher.start()
 
+        # Nothing is flushed to the database unless a test does it explicitly
+        self.payment_ledger = PaymentLedger(autostart=False)
+        self.ledger_patcher = patch('api.views.payment_ledger', self.payment_ledger)
+        self.ledger_patcher.start()
+
+        self.idempotency_store = IdempotencyStore(cache_alias=None)
+        self.idempotency_patcher = patch('api.views.idempotency_store', self.idempotency_store)
+        self.idempotency_patcher.start()
+
+        for limiter in rate_limiters.values():
+            limiter.clear()
+
     def tearDown(self):
         super().tearDown()
         self.paystack_patcher.stop()
+        self.ledger_patcher.stop()
+        self.idempotency_patcher.stop()
 
 
 class InitPaymentViewTests(PaystackMockTestCase):
@@ -49,6 +125,7 @@ class InitPaymentViewTests(PaystackMockTestCase):
         self.assertIn('data', response_data)
         self.assertIn('authorization_url', response_data['data'])
         self.assertIn('reference', response_data['data'])
+        self.assertEqual(self.payment_ledger.pending, 1)
 
     def test_empty_data(self):
         """Test initialize_payment with empty data"""
@@ -125,4 +202,2139 @@ class GetPaymentStatusViewTests(PaystackMockTestCase):
         """Test get_payment_status with the POST method (should fail)"""
         url = reverse(payment_status_url_view_name, kwargs={"payment_id": "mock-payment-123"})
         response = self.client.post(url)
-        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+class RecordedPaymentStatusTests(PaystackMockTestCase, TestCase):
+    def setUp(self):
+        super().setUp()
+        # The mock Paystack API answers that these payments were abandoned
+        self.record_payment("mock-ref-settled", "failed")
+        self.record_payment("mock-ref-unsettled", "pending")
+        self.payment_ledger.flush()
+
+    def record_payment(self, reference: str, payment_status: str, merchant: str = ""):
+        data, _ = transaction_status_response_parser.validate(copy.deepcopy(verify_200_OK))
+        data["data"].update(reference=reference, status=payment_status)
+        self.payment_ledger.record_initialized(
+            reference=reference, customer_name="John Doe", customer_email="john@example.com",
+            amount=Decimal("403.33"), merchant=merchant)
+        self.payment_ledger.record_status(reference, payment_status, data["data"]["paid_at"], data["data"])
+
+    def test_settled_payment_is_answered_from_the_database(self):
+        url = reverse(payment_status_url_view_name, kwargs={"payment_id": "mock-ref-settled"})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["data"]["status"], "failed")
+        self.assertEqual(datetime.fromisoformat(response.json()["data"]["paid_at"]),
+                         datetime(2024, 8, 22, 9, 15, 2, tzinfo=timezone.utc))
+        # And cached, so the next lookup does not query the database
+        self.assertEqual(
+            async_to_sync(self.mock_paystack_client_instance.status_cache.aget)("mock-ref-settled")["data"]["amount"],
+            Decimal("40333"))
+
+    def test_unsettled_payment_is_looked_up(self):
+        url = reverse(payment_status_url_view_name, kwargs={"payment_id": "mock-ref-unsettled"})
+        self.assertEqual(self.client.get(url).json()["data"]["status"], "abandoned")
+
+    def test_bulk_lookup_answers_settled_payments_with_one_query(self):
+        references = ["mock-ref-settled", "mock-ref-unsettled", "mock-valid-payment-123"]
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                bulk_payment_status_url, data=json.dumps({"references": references}), content_type="application/json")
+        results = response.json()["data"]
+        self.assertEqual([result["data"]["status"] for result in results], ["failed", "abandoned", "success"])
+
+    def test_webhook_during_a_lookup_is_not_overwritten(self):
+        client = self.mock_paystack_client_instance
+        fetch_payment_status = client._fetch_payment_status
+        webhook_data, _ = transaction_status_response_parser.validate(copy.deepcopy(verify_200_OK))
+        webhook_data["data"].update(reference="mock-ref-unsettled", status="success")
+
+        async def fetch_while_a_webhook_arrives(payment_id):
+            # The lookup has started when the webhook event settles the payment, and then answers "abandoned"
+            await apply_payment_status_event(client, webhook_data["data"])
+            return await fetch_payment_status(payment_id)
+
+        url = reverse(payment_status_url_view_name, kwargs={"payment_id": "mock-ref-unsettled"})
+        with patch.object(client, "_fetch_payment_status", fetch_while_a_webhook_arrives):
+            self.assertEqual(self.client.get(url).json()["data"]["status"], "abandoned")
+        self.payment_ledger.flush()
+
+        self.assertEqual(Payment.objects.get(reference="mock-ref-unsettled").status, "success")
+        self.assertEqual(async_to_sync(client.status_cache.aget)("mock-ref-unsettled")["data"]["status"], "success")
+
+        # Nor by a lookup flushed after the webhook was written
+        self.payment_ledger.record_status("mock-ref-unsettled", "abandoned", None)
+        self.payment_ledger.flush()
+        self.assertEqual(Payment.objects.get(reference="mock-ref-unsettled").status, "success")
+
+    def test_payments_of_other_merchants_are_not_answered(self):
+        self.record_payment("mock-ref-merchant", "success", merchant="merchant-1")
+        self.payment_ledger.flush()
+        references = ["mock-ref-merchant", "mock-ref-settled"]
+        self.assertEqual(async_to_sync(recorded_payment_statuses)(None, references).keys(), {"mock-ref-settled"})
+        self.assertEqual(async_to_sync(recorded_payment_statuses)(
+            ("merchant-1", "sk_test_merchant"), references).keys(), {"mock-ref-merchant"})
+
+
+class PaystackWebhookViewTests(PaystackMockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reference = "webhook-ref-123"
+        self.event = {
+            "event": "charge.success",
+            "data": {
+                "id": 302961,
+                "domain": "test",
+                "status": "success",
+                "reference": self.reference,
+                "amount": 10000,
+                "paid_at": "2025-06-06T08:27:31.000Z",
+                "created_at": "2025-06-06T08:26:51.000Z",
+                "channel": "card",
+                "currency": "KES",
+            }
+        }
+
+    def post_event(self, body: bytes, signature: str | None):
+        headers = {"HTTP_X_PAYSTACK_SIGNATURE": signature} if signature is not None else {}
+        return self.client.post(
+            paystack_webhook_url, data=body, content_type="application/json", **headers)
+
+    def test_valid_event(self):
+        body = json.dumps(self.event).encode()
+        response = self.post_event(body, compute_signature(body, mock_secret_key))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.payment_ledger.pending, 1)
+
+        # The status is now served locally, although the mock Paystack API does not know the reference
+        url = reverse(payment_status_url_view_name, kwargs={"payment_id": self.reference})
+        with patch.object(self.mock_paystack_client_instance, "_fetch_payment_status") as fetch:
+            response_data = self.client.get(url).json()
+        fetch.assert_not_called()
+        self.assertEqual(response_data["data"]["status"], "success")
+        self.assertEqual(response_data["data"]["reference"], self.reference)
+
+    def test_invalid_signature(self):
+        body = json.dumps(self.event).encode()
+        response = self.post_event(body, compute_signature(body, "sk_test_wrong"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.payment_ledger.pending, 0)
+
+    def test_missing_signature(self):
+        response = self.post_event(json.dumps(self.event).encode(), None)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_other_events_are_acknowledged(self):
+        body = json.dumps({"event": "transfer.success", "data": {}}).encode()
+        response = self.post_event(body, compute_signature(body, mock_secret_key))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.payment_ledger.pending, 0)
+
+
+class PaystackClientPoolTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.created_clients = []
+
+        def http_client_fun(base_url: str, secret_key: str):
+            client = get_mock_paystack_client(base_url, secret_key)
+            self.created_clients.append(client)
+            return client
+
+        self.paystack_client = PaystackClient(http_client_fun=http_client_fun)
+
+    def tearDown(self):
+        super().tearDown()
+        self.paystack_client.close()
+
+    def test_http_client_is_reused_across_requests(self):
+        self.paystack_client.init_payment(email="john@example.com", amount=30)
+        self.paystack_client.get_payment_status("mock-valid-payment-123")
+        self.assertEqual(len(self.created_clients), 1)
+        self.assertFalse(self.created_clients[0].is_closed)
+
+    def test_close_releases_the_pool(self):
+        self.paystack_client.get_payment_status("mock-valid-payment-123")
+        self.paystack_client.close()
+        self.assertTrue(self.created_clients[0].is_closed)
+
+        # A new pool is opened lazily after closing
+        self.paystack_client.get_payment_status("mock-valid-payment-123")
+        self.assertEqual(len(self.created_clients), 2)
+
+
+class AsyncPaystackClientTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.paystack_client = AsyncPaystackClient(http_client_fun=get_mock_async_paystack_client)
+
+    def test_views_are_async(self):
+        self.assertTrue(iscoroutinefunction(InitPaymentView.as_view()))
+        self.assertTrue(iscoroutinefunction(GetPaymentStatusView.as_view()))
+
+    def test_init_payment(self):
+        data = async_to_sync(self.paystack_client.init_payment)(email="john@example.com", amount=30)
+        self.assertTrue(data["status"])
+        self.assertIn("reference", data["data"])
+
+    def test_not_found_error_mapping(self):
+        with self.assertRaises(PaystackClientException) as context:
+            async_to_sync(self.paystack_client.get_payment_status)("invalid-payment-id")
+        self.assertEqual(context.exception.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_pool_of_previous_event_loop_is_closed(self):
+        created_clients = []
+
+        def http_client_fun(base_url: str, secret_key: str) -> httpx.AsyncClient:
+            created_clients.append(get_mock_async_paystack_client(base_url, secret_key))
+            return created_clients[-1]
+
+        paystack_client = AsyncPaystackClient(http_client_fun=http_client_fun)
+        # Each call runs in an event loop of its own
+        async_to_sync(paystack_client.get_payment_status)("mock-valid-payment-123")
+        async_to_sync(paystack_client.get_payment_status)("mock-valid-payment-456")
+        self.assertEqual(len(created_clients), 2)
+        self.assertTrue(created_clients[0].is_closed)
+        self.assertFalse(created_clients[1].is_closed)
+        async_to_sync(paystack_client.aclose)()
+
+
+class PaymentLedgerTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment_ledger = PaymentLedger(autostart=False)
+
+    def record_payment(self, reference: str):
+        self.payment_ledger.record_initialized(
+            reference=reference,
+            customer_name="John Doe",
+            customer_email="john@example.com",
+            amount=Decimal("30.00"))
+
+    def test_flush_creates_payments(self):
+        self.record_payment("ref-1")
+        self.record_payment("ref-2")
+        self.assertEqual(Payment.objects.count(), 0)
+
+        self.assertEqual(self.payment_ledger.flush(), 2)
+        self.assertEqual(self.payment_ledger.pending, 0)
+        self.assertEqual(Payment.objects.get(reference="ref-1").status, "pending")
+        self.assertEqual(Payment.objects.count(), 2)
+
+    def test_flush_updates_status(self):
+        self.record_payment("ref-1")
+        self.payment_ledger.flush()
+
+        paid_at = datetime(2025, 6, 6, 8, 27, 31, tzinfo=timezone.utc)
+        self.payment_ledger.record_status("ref-1", "success", paid_at)
+        self.payment_ledger.flush()
+
+        payment = Payment.objects.get(reference="ref-1")
+        self.assertEqual(payment.status, "success")
+        self.assertEqual(payment.paid_at, paid_at)
+
+    def test_status_recorded_before_creation_is_flushed(self):
+        self.record_payment("ref-1")
+        self.payment_ledger.record_status("ref-1", "abandoned", None)
+        self.assertEqual(self.payment_ledger.flush(), 2)
+        self.assertEqual(Payment.objects.get(reference="ref-1").status, "abandoned")
+
+    def test_unknown_reference_is_ignored(self):
+        self.payment_ledger.record_status("unknown-ref", "success", None)
+        self.payment_ledger.flush()
+        self.assertFalse(Payment.objects.exists())
+
+
+class PaymentLedgerThreadTests(TransactionTestCase):
+    def test_background_thread_flushes(self):
+        payment_ledger = PaymentLedger(flush_interval=60, batch_size=1)
+        try:
+            payment_ledger.record_initialized(
+                reference="ref-1",
+                customer_name="John Doe",
+                customer_email="john@example.com",
+                amount=Decimal("30.00"))
+        finally:
+            payment_ledger.stop()
+        self.assertTrue(Payment.objects.filter(reference="ref-1").exists())
+
+
+class PaymentStatusCacheTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 0.0
+        self.status_cache = PaymentStatusCache(
+            max_entries=2, pending_ttl=5, cache_alias=None, clock=lambda: self.now)
+
+    @staticmethod
+    def status_data(reference: str, payment_status: str):
+        return {"status": True, "data": {"reference": reference, "status": payment_status}}
+
+    def test_terminal_status_does_not_expire(self):
+        self.status_cache.set("ref-1", self.status_data("ref-1", "success"))
+        self.now = 10 ** 6
+        self.assertEqual(self.status_cache.get("ref-1")["data"]["status"], "success")
+
+    def test_pending_status_expires(self):
+        self.status_cache.set("ref-1", self.status_data("ref-1", "abandoned"))
+        self.now = 4
+        self.assertIsNotNone(self.status_cache.get("ref-1"))
+        self.now = 5
+        self.assertIsNone(self.status_cache.get("ref-1"))
+
+    def test_least_recently_used_is_evicted(self):
+        self.status_cache.set("ref-1", self.status_data("ref-1", "success"))
+        self.status_cache.set("ref-2", self.status_data("ref-2", "success"))
+        self.status_cache.get("ref-1")
+        self.status_cache.set("ref-3", self.status_data("ref-3", "success"))
+        self.assertIsNone(self.status_cache.get("ref-2"))
+        self.assertIsNotNone(self.status_cache.get("ref-1"))
+        self.assertIsNotNone(self.status_cache.get("ref-3"))
+
+    def test_shared_cache(self):
+        status_cache = PaymentStatusCache(cache_alias="default", key_prefix="test:status")
+        other_worker_status_cache = PaymentStatusCache(cache_alias="default", key_prefix="test:status")
+        status_cache.set("ref-1", self.status_data("ref-1", "failed"))
+        self.assertEqual(other_worker_status_cache.get("ref-1")["data"]["status"], "failed")
+
+    def test_client_serves_cached_statuses(self):
+        requests = []
+
+        def http_client_fun(base_url: str, secret_key: str):
+            def handler(request: httpx.Request):
+                requests.append(request)
+                return mock_paystack_handler(request)
+
+            return httpx.Client(base_url=base_url, transport=httpx.MockTransport(handler))
+
+        paystack_client = PaystackClient(http_client_fun=http_client_fun, status_cache=self.status_cache)
+        paystack_client.get_payment_status("mock-valid-payment-123")
+        paystack_client.get_payment_status("mock-valid-payment-123")
+        self.assertEqual(len(requests), 1)
+
+        # Not found errors are not cached
+        for _ in range(2):
+            with self.assertRaises(PaystackClientException):
+                paystack_client.get_payment_status("invalid-payment-id")
+        self.assertEqual(len(requests), 3)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.requests = []
+
+        async def handler(request: httpx.Request):
+            self.requests.append(request)
+            await asyncio.sleep(0.01)
+            return mock_paystack_handler(request)
+
+        self.paystack_client = AsyncPaystackClient(
+            http_client_fun=lambda base_url, secret_key: httpx.AsyncClient(
+                base_url=base_url, transport=httpx.MockTransport(handler)))
+
+    def get_statuses(self, payment_id: str, count: int):
+        async def get_statuses():
+            return await asyncio.gather(
+                *(self.paystack_client.get_payment_status(payment_id) for _ in range(count)),
+                return_exceptions=True)
+
+        return async_to_sync(get_statuses)()
+
+    def test_concurrent_lookups_share_one_request(self):
+        results = self.get_statuses("mock-valid-payment-123", 10)
+        self.assertEqual(len(self.requests), 1)
+        self.assertTrue(all(result["data"]["reference"] == "mock-valid-payment-123" for result in results))
+
+    def test_concurrent_lookups_share_errors(self):
+        results = self.get_statuses("invalid-payment-id", 5)
+        self.assertEqual(len(self.requests), 1)
+        for result in results:
+            self.assertIsInstance(result, PaystackClientException)
+            self.assertEqual(result.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sequential_lookups_are_not_coalesced(self):
+        self.get_statuses("mock-valid-payment-123", 1)
+        self.get_statuses("mock-valid-payment-123", 1)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_threaded_lookups_share_one_request(self):
+        single_flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def fun():
+            calls.append(1)
+            release.wait(1)
+            return "result"
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(single_flight.do, "key", fun) for _ in range(5)]
+            while len(calls) == 0:
+                time.sleep(0.001)
+            # Give the other threads time to join the in-flight call
+            time.sleep(0.05)
+            release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ["result"] * 5)
+
+
+class BatchInitPaymentViewTests(PaystackMockTestCase):
+    def post_batch(self, payments):
+        return self.client.post(
+            batch_init_payment_url,
+            data=json.dumps({"payments": payments}),
+            content_type="application/json")
+
+    def test_valid_batch(self):
+        payments = [
+            {"customer_name": "John Doe", "customer_email": f"john{i}@example.com", "amount": 10 + i}
+            for i in range(5)
+        ]
+        response = self.post_batch(payments)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()["data"]
+        self.assertEqual([result["index"] for result in results], list(range(5)))
+        for i, result in enumerate(results):
+            self.assertEqual(result["status_code"], status.HTTP_200_OK)
+            self.assertIn(f"john{i}-at-example.com", result["data"]["data"]["reference"])
+        self.assertEqual(self.payment_ledger.pending, 5)
+
+    def test_partial_success(self):
+        response = self.post_batch([
+            {"customer_name": "John Doe", "customer_email": "john@example.com", "amount": 10},
+            {"customer_name": "Jane Doe", "customer_email": "not-an-email", "amount": 10},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_data = response.json()
+        self.assertTrue(response_data["status"])
+        self.assertEqual(response_data["data"][0]["status_code"], status.HTTP_200_OK)
+        self.assertEqual(response_data["data"][1]["status_code"], status.HTTP_400_BAD_REQUEST)
+        self.assertIn("customer_email", response_data["data"][1]["data"])
+
+    def test_empty_batch(self):
+        response = self.post_batch([])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_method(self):
+        response = self.client.get(batch_init_payment_url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class BulkPaymentStatusViewTests(PaystackMockTestCase):
+    def post_references(self, references):
+        return self.client.post(
+            bulk_payment_status_url,
+            data=json.dumps({"references": references}),
+            content_type="application/json")
+
+    def test_mixed_references(self):
+        references = ["mock-valid-payment-123", "mock-failed-payment-456", "test-payment-id"]
+        response = self.post_references(references)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()["data"]
+        self.assertEqual([result["reference"] for result in results], references)
+        self.assertEqual(results[0]["data"]["status"], "success")
+        self.assertEqual(results[1]["data"]["status"], "failed")
+        self.assertEqual(results[2]["status_code"], status.HTTP_404_NOT_FOUND)
+
+    def test_cached_statuses_are_answered_locally(self):
+        self.post_references(["mock-failed-payment-456"])
+        with patch.object(self.mock_paystack_client_instance, "_fetch_payment_status") as fetch:
+            response = self.post_references(["mock-failed-payment-456", "mock-failed-payment-456"])
+        fetch.assert_not_called()
+        results = response.json()["data"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["data"]["status"], "failed")
+
+    def test_empty_references(self):
+        response = self.post_references([])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_concurrent_bulk_lookups_share_the_concurrency_limit(self):
+        # Each bulk lookup alone fills the concurrency limit
+        server = MockPaystackServer(latency=0.02)
+        guards = {
+            endpoint: UpstreamGuard(endpoint, limiter=AdaptiveLimiter(initial_limit=4, min_limit=1, max_limit=4))
+            for endpoint in ("init_payment", "payment_status")
+        }
+        paystack_client = AsyncPaystackClient(
+            http_client_fun=server.async_client_fun(), secret_key=mock_secret_key, guards=guards,
+            status_cache=PaymentStatusCache(cache_alias=None))
+
+        async def post_references(client, references):
+            return await client.post(
+                bulk_payment_status_url, data={"references": references}, content_type="application/json")
+
+        async def run():
+            client = AsyncClient()
+            return await asyncio.gather(*(
+                post_references(client, [f"ref-{i}-{j}" for j in range(8)]) for i in range(2)))
+
+        with patch("api.views.paystack_client", paystack_client), \
+                patch("api.views.PAYMENTS_BULK_STATUS_CONCURRENCY", 4):
+            responses = async_to_sync(run)()
+
+        for response in responses:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                [result["status_code"] for result in response.json()["data"]], [status.HTTP_200_OK] * 8)
+        self.assertEqual(guards["payment_status"].limiter.snapshot()["rejected"], 0)
+
+
+@patch("api.permissions.PAYMENTS_EXPORT_TOKEN", "export-token")
+class ExportPaymentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Payment.objects.bulk_create(
+            Payment(
+                reference=f"ref-{i}",
+                customer_name="John Doe",
+                customer_email=f"john{i}@example.com",
+                amount=Decimal("10.50"),
+                status="success" if i % 2 else "pending")
+            for i in range(5))
+
+    async def export(self, query: str = "", token: str | None = "export-token"):
+        headers = {"Authorization": f"Bearer {token}"} if token is not None else {}
+        response = await self.async_client.get(f"{export_payments_url}?{query}", headers=headers)
+        content = b"".join([part async for part in response.streaming_content]) if response.streaming else b""
+        return response, content.decode()
+
+    async def test_ndjson_export(self):
+        response, content = await self.export()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["reference"] for row in rows], [f"ref-{i}" for i in range(5)])
+        self.assertEqual(rows[0]["amount"], "10.50")
+
+    async def test_compressed_export(self):
+        response = await self.async_client.get(
+            export_payments_url, headers={"Authorization": "Bearer export-token", "Accept-Encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertFalse(response.has_header("Content-Length"))
+        content = gzip.decompress(b"".join([part async for part in response.streaming_content]))
+        self.assertEqual(len(content.splitlines()), 5)
+
+    async def test_csv_export_filtered_by_status(self):
+        response, content = await self.export("file_format=csv&status=success")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = content.splitlines()
+        self.assertEqual(lines[0].split(","), list(EXPORT_FIELDS))
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["ref-1", "ref-3"])
+
+    async def test_invalid_filter(self):
+        response, _ = await self.export("status=unknown")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_export_token_is_required(self):
+        response, _ = await self.export(token=None)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response, _ = await self.export(token="wrong-token")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_chunks_are_contiguous(self):
+        queryset = get_export_queryset()
+        chunks = list(iter_chunks(queryset, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(
+            [row["reference"] for chunk in chunks for row in chunk], [f"ref-{i}" for i in range(5)])
+
+    def test_management_command(self):
+        output = StringIO()
+        call_command("export_payments", "--chunk-size", "2", "--status", "pending", stdout=output)
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([row["reference"] for row in rows], ["ref-0", "ref-2", "ref-4"])
+
+
+class FastParserTests(SimpleTestCase):
+    def assert_same_as_serializer(self, serializer_class, data):
+        serializer = serializer_class(data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(compile_parser(serializer_class).parse(data), serializer.validated_data)
+
+    def test_sample_responses(self):
+        self.assert_same_as_serializer(PaystackTransactionInitResponseSerializer, copy.deepcopy(init_payment_200_OK))
+        self.assert_same_as_serializer(PaystackTransactionStatusResponseSerializer, copy.deepcopy(verify_200_OK))
+
+    def test_nulls_and_whitespace(self):
+        data = copy.deepcopy(verify_200_OK)
+        data["data"]["paid_at"] = None
+        data["data"]["channel"] = " card "
+        data["data"]["amount"] = "1000.5"
+        self.assert_same_as_serializer(PaystackTransactionStatusResponseSerializer, data)
+
+    def test_float_amounts(self):
+        for amount in (30.5, 30.1, 1.0, 12345678.99):
+            data = {"customer_name": "John Doe", "customer_email": "john@example.com", "amount": amount}
+            self.assert_same_as_serializer(PaymentInfoSerializer, data)
+        # More digits than the field allows, which the serializer reports
+        data = {"customer_name": "John Doe", "customer_email": "john@example.com", "amount": 0.1 + 0.2}
+        with self.assertRaises(ParseError):
+            compile_parser(PaymentInfoSerializer).parse(data)
+        self.assertIsNotNone(compile_parser(PaymentInfoSerializer).validate(data)[1])
+
+    def test_non_canonical_input_falls_back_to_serializer(self):
+        parser = compile_parser(PaymentInfoSerializer)
+        data = {"customer_name": 1234, "customer_email": "john@example.com", "amount": 30.5}
+        with self.assertRaises(ParseError):
+            parser.parse(data)
+        validated_data, errors = parser.validate(data)
+        self.assertIsNone(errors)
+        self.assertEqual(validated_data["customer_name"], "1234")
+        self.assertEqual(validated_data["amount"], Decimal("30.50"))
+
+    def test_invalid_input_returns_serializer_errors(self):
+        data = {"customer_name": "", "customer_email": "not-an-email", "amount": "1e20"}
+        validated_data, errors = compile_parser(PaymentInfoSerializer).validate(data)
+        self.assertIsNone(validated_data)
+        serializer = PaymentInfoSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(errors, serializer.errors)
+
+
+class MockPaystackServerTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = MockPaystackServer()
+        self.paystack_client = PaystackClient(http_client_fun=self.server.client_fun())
+
+    def tearDown(self):
+        super().tearDown()
+        self.paystack_client.close()
+
+    def test_initialize_then_verify(self):
+        reference = self.paystack_client.init_payment(email="john@example.com", amount=30)["data"]["reference"]
+        data = self.paystack_client.get_payment_status(reference)["data"]
+        self.assertEqual(data["reference"], reference)
+        self.assertEqual(data["status"], "abandoned")
+        self.assertIsNone(data["paid_at"])
+
+        self.server.settle(reference)
+        data = self.paystack_client.get_payment_status(reference)["data"]
+        self.assertEqual(data["status"], "success")
+        self.assertIsNotNone(data["paid_at"])
+
+    def test_concurrent_requests_get_their_own_references(self):
+        def init_payment(i: int):
+            return self.paystack_client.init_payment(email=f"john{i}@example.com", amount=30)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(init_payment, range(50)))
+
+        references = [response["data"]["reference"] for response in responses]
+        self.assertEqual(len(set(references)), 50)
+        for i, reference in enumerate(references):
+            self.assertIn(f"john{i}-at-example.com", reference)
+            self.assertEqual(self.paystack_client.get_payment_status(reference)["data"]["reference"], reference)
+
+    def test_sample_responses_are_not_modified(self):
+        init_payment_sample = copy.deepcopy(init_payment_200_OK)
+        verify_sample = copy.deepcopy(verify_200_OK)
+        self.paystack_client.init_payment(email="john@example.com", amount=30)
+        self.paystack_client.get_payment_status("mock-failed-payment-456")
+        self.assertEqual(init_payment_200_OK, init_payment_sample)
+        self.assertEqual(verify_200_OK, verify_sample)
+
+    def test_error_injection(self):
+        server = MockPaystackServer(error_rate=1.0)
+        paystack_client = AsyncPaystackClient(http_client_fun=server.async_client_fun())
+        with self.assertRaises(PaystackClientException):
+            async_to_sync(paystack_client.get_payment_status)("mock-valid-payment-123")
+
+    def test_latency_injection(self):
+        server = MockPaystackServer(latency=0.02)
+        paystack_client = AsyncPaystackClient(http_client_fun=server.async_client_fun())
+        start = time.perf_counter()
+        async_to_sync(paystack_client.get_payment_status)("mock-valid-payment-123")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.02)
+
+    def test_asgi_application(self):
+        async def init_and_verify():
+            transport = httpx.ASGITransport(app=self.server)
+            async with httpx.AsyncClient(transport=transport, base_url="http://mock-paystack") as client:
+                response = await client.post("/transaction/initialize", json={"email": "john@example.com", "amount": 3000})
+                reference = response.json()["data"]["reference"]
+                return reference, await client.get(f"/transaction/verify/{reference}")
+
+        reference, response = async_to_sync(init_and_verify)()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["reference"], reference)
+
+
+class IdempotencyKeyTests(PaystackMockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.valid_data = {
+            "customer_name": "John Doe",
+            "customer_email": "john@example.com",
+            "amount": 30.00
+        }
+        self.init_payment_calls = 0
+        self.use_paystack(get_mock_async_paystack_client)
+
+    def use_paystack(self, http_client_fun):
+        """Patches the views with a Paystack client that counts its `init_payment` calls."""
+        paystack_client = AsyncPaystackClient(http_client_fun=http_client_fun, secret_key=mock_secret_key)
+        init_payment = paystack_client.init_payment
+
+        async def counting_init_payment(*args, **kwargs):
+            self.init_payment_calls += 1
+            return await init_payment(*args, **kwargs)
+
+        paystack_client.init_payment = counting_init_payment
+        patcher = patch('api.views.paystack_client', paystack_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data: dict, idempotency_key: str):
+        return self.client.post(
+            init_payment_url, data=json.dumps(data), content_type="application/json",
+            headers={"Idempotency-Key": idempotency_key})
+
+    def test_retry_is_answered_from_storage(self):
+        response = self.post(self.valid_data, "key-1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Idempotent-Replayed", response.headers)
+
+        retry = self.post(self.valid_data, "key-1")
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), response.json())
+        self.assertEqual(self.init_payment_calls, 1)
+        self.assertEqual(self.payment_ledger.pending, 1)
+
+    def test_different_keys_initialize_different_payments(self):
+        first = self.post(self.valid_data, "key-1").json()
+        second = self.post(self.valid_data, "key-2").json()
+        self.assertNotEqual(first["data"]["reference"], second["data"]["reference"])
+        self.assertEqual(self.init_payment_calls, 2)
+
+    def test_key_reused_for_different_request(self):
+        self.post(self.valid_data, "key-1")
+        response = self.post({**self.valid_data, "amount": 40.00}, "key-1")
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(self.init_payment_calls, 1)
+
+    def test_invalid_key(self):
+        response = self.post(self.valid_data, "k" * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.init_payment_calls, 0)
+
+    def test_concurrent_duplicates_wait_for_the_first_request(self):
+        self.use_paystack(MockPaystackServer(latency=0.05).async_client_fun())
+
+        async def post_concurrently():
+            return await asyncio.gather(*(
+                self.async_client.post(
+                    init_payment_url, data=self.valid_data, content_type="application/json",
+                    headers={"Idempotency-Key": "key-1"})
+                for _ in range(5)))
+
+        responses = async_to_sync(post_concurrently)()
+        self.assertEqual(self.init_payment_calls, 1)
+        self.assertEqual(len({response.json()["data"]["reference"] for response in responses}), 1)
+        self.assertEqual(sum(1 for response in responses if "Idempotent-Replayed" not in response.headers), 1)
+
+    def test_failed_request_is_not_stored(self):
+        self.use_paystack(MockPaystackServer(error_rate=1.0).async_client_fun())
+        self.assertNotEqual(self.post(self.valid_data, "key-1").status_code, status.HTTP_200_OK)
+
+        self.use_paystack(get_mock_async_paystack_client)
+        self.assertEqual(self.post(self.valid_data, "key-1").status_code, status.HTTP_200_OK)
+        self.assertEqual(self.init_payment_calls, 2)
+
+
+class IdempotencyStoreTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = 0
+
+    async def initialize(self):
+        self.calls += 1
+        return {"reference": f"ref-{self.calls}"}, 200
+
+    def test_shared_between_workers(self):
+        store = IdempotencyStore(cache_alias="default", key_prefix="test:idempotency")
+        other_worker_store = IdempotencyStore(cache_alias="default", key_prefix="test:idempotency")
+
+        data, _, replayed = async_to_sync(store.run)("key-1", "fingerprint", self.initialize)
+        self.assertFalse(replayed)
+        other_data, _, replayed = async_to_sync(other_worker_store.run)("key-1", "fingerprint", self.initialize)
+        self.assertTrue(replayed)
+        self.assertEqual(other_data, data)
+        self.assertEqual(self.calls, 1)
+
+    def test_in_flight_on_another_worker(self):
+        store = IdempotencyStore(cache_alias="default", key_prefix="test:idempotency")
+        other_worker_store = IdempotencyStore(cache_alias="default", key_prefix="test:idempotency")
+
+        async def run_while_in_flight():
+            async def initialize_slowly():
+                await asyncio.sleep(0.05)
+                return await self.initialize()
+
+            in_flight = asyncio.create_task(store.run("key-2", "fingerprint", initialize_slowly))
+            await asyncio.sleep(0.01)
+            with self.assertRaises(IdempotencyConflict) as context:
+                await other_worker_store.run("key-2", "fingerprint", self.initialize)
+            await in_flight
+            return context.exception
+
+        self.assertEqual(async_to_sync(run_while_in_flight)().status_code, 409)
+        self.assertEqual(self.calls, 1)
+
+    def test_expiry(self):
+        now = [0.0]
+        store = IdempotencyStore(ttl=10, cache_alias=None, clock=lambda: now[0])
+        async_to_sync(store.run)("key-1", "fingerprint", self.initialize)
+        now[0] = 11
+        data, _, replayed = async_to_sync(store.run)("key-1", "fingerprint", self.initialize)
+        self.assertFalse(replayed)
+        self.assertEqual(data, {"reference": "ref-2"})
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 0.0
+        self.breaker = CircuitBreaker(
+            failure_threshold=3, recovery_timeout=10, half_open_calls=1, clock=lambda: self.now)
+
+    def fail(self, times: int):
+        for _ in range(times):
+            trial, retry_after = self.breaker.before_call()
+            self.assertIsNone(retry_after)
+            self.breaker.on_failure(trial)
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.breaker.on_success(False)
+        self.fail(2)
+        self.assertEqual(self.breaker.state, "closed")
+        self.fail(1)
+        self.assertEqual(self.breaker.state, "open")
+        self.now = 4
+        self.assertEqual(self.breaker.before_call(), (False, 6))
+
+    def test_half_open_trial_calls(self):
+        self.fail(3)
+        self.now = 10
+        self.assertEqual(self.breaker.state, "half_open")
+        trial, retry_after = self.breaker.before_call()
+        self.assertTrue(trial)
+        self.assertIsNone(retry_after)
+        # Only one trial call at a time
+        self.assertIsNotNone(self.breaker.before_call()[1])
+
+        self.breaker.on_failure(trial)
+        self.assertEqual(self.breaker.state, "open")
+
+        self.now = 20
+        trial, _ = self.breaker.before_call()
+        self.breaker.on_success(trial)
+        self.assertEqual(self.breaker.state, "closed")
+
+
+class AdaptiveLimiterTests(SimpleTestCase):
+    def test_rejects_calls_over_the_limit(self):
+        limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=10, latency_threshold=1)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        self.assertEqual(limiter.snapshot(), {"limit": 2, "in_flight": 2, "waiting": 0, "rejected": 1})
+
+    def test_async_calls_wait_for_a_slot(self):
+        limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=1, latency_threshold=1, queue_timeout=5)
+
+        async def run():
+            self.assertTrue(await limiter.acquire())
+            waiting = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.snapshot()["waiting"], 1)
+            # Calls waiting in line are let through first
+            self.assertFalse(limiter.try_acquire())
+            limiter.release(latency=0.1, failed=False)
+            self.assertTrue(await waiting)
+
+        asyncio.run(run())
+        self.assertEqual(limiter.snapshot(), {"limit": 1, "in_flight": 1, "waiting": 0, "rejected": 1})
+
+    def test_slot_handed_to_a_cancelled_call_is_given_back(self):
+        limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=1, latency_threshold=1, queue_timeout=5)
+
+        async def run():
+            self.assertTrue(await limiter.acquire())
+            waiting = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+            limiter.release(latency=0.1, failed=False)
+            # The slot is handed over, but the call is cancelled (e.g. a losing hedge) before it resumes
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            self.assertEqual(limiter.snapshot()["in_flight"], 0)
+            self.assertTrue(await limiter.acquire(max_wait=0))
+
+        asyncio.run(run())
+
+    def test_async_calls_give_up_after_the_queue_timeout(self):
+        limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=1, latency_threshold=1, queue_timeout=5)
+
+        async def run():
+            self.assertTrue(await limiter.acquire())
+            self.assertFalse(await limiter.acquire(max_wait=0.01))
+            self.assertFalse(await limiter.acquire(max_wait=0))
+            limiter.release(latency=0.1, failed=False)
+            self.assertTrue(await limiter.acquire(max_wait=0))
+
+        asyncio.run(run())
+        self.assertEqual(limiter.snapshot(), {"limit": 1, "in_flight": 1, "waiting": 0, "rejected": 2})
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = AdaptiveLimiter(initial_limit=4, min_limit=1, max_limit=10, latency_threshold=1)
+        for _ in range(8):
+            for _ in range(limiter.limit):
+                limiter.try_acquire()
+            for _ in range(limiter.limit):
+                limiter.release(latency=0.1, failed=False)
+        self.assertGreater(limiter.limit, 4)
+
+        limit = limiter.limit
+        limiter.try_acquire()
+        limiter.release(latency=0.1, failed=True)
+        self.assertEqual(limiter.limit, limit // 2)
+
+        limiter.try_acquire()
+        limiter.release(latency=5, failed=False)
+        self.assertEqual(limiter.limit, max(limit // 4, 1))
+
+    def test_does_not_grow_while_idle(self):
+        limiter = AdaptiveLimiter(initial_limit=4, min_limit=1, max_limit=10, latency_threshold=1)
+        for _ in range(100):
+            limiter.try_acquire()
+            limiter.release(latency=0.1, failed=False)
+        self.assertEqual(limiter.limit, 4)
+
+
+class PaystackGuardTests(PaystackMockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = MockPaystackServer(error_rate=1.0)
+        self.guards = {
+            endpoint: UpstreamGuard(endpoint, breaker=CircuitBreaker(failure_threshold=2, recovery_timeout=30))
+            for endpoint in ("init_payment", "payment_status")
+        }
+        self.paystack_client = AsyncPaystackClient(
+            http_client_fun=self.server.async_client_fun(), secret_key=mock_secret_key, guards=self.guards,
+            retry_policy=RetryPolicy(max_attempts=1))
+        patcher = patch('api.views.paystack_client', self.paystack_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_open_circuit_fails_fast(self):
+        for payment_id in ("ref-1", "ref-2"):
+            response = self.client.get(reverse("api:get_payment_status", args=[payment_id]))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Paystack has recovered, but the circuit is open
+        self.server.error_rate = 0.0
+        response = self.client.get(reverse("api:get_payment_status", args=["ref-3"]))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertEqual(response.json()["data"]["reason"], "circuit_open")
+        self.assertEqual(response.json()["data"]["endpoint"], "payment_status")
+
+        # Endpoints are tracked separately
+        response = self.client.post(
+            init_payment_url,
+            data=json.dumps({"customer_name": "John Doe", "customer_email": "john@example.com", "amount": 30}),
+            content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_not_found_is_not_a_failure(self):
+        self.server.error_rate = 0.0
+        for _ in range(3):
+            response = self.client.get(reverse("api:get_payment_status", args=["invalid-payment-id"]))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.guards["payment_status"].breaker.state, "closed")
+
+    def test_concurrency_limit(self):
+        guard = UpstreamGuard("payment_status", limiter=AdaptiveLimiter(initial_limit=1))
+        with guard.call():
+            with self.assertRaises(UpstreamUnavailable) as context:
+                with guard.call():
+                    pass
+        self.assertEqual(context.exception.reason, "concurrency_limit")
+        self.assertEqual(guard.limiter.in_flight, 0)
+
+    def test_health(self):
+        response = self.client.get(reverse("api:paystack_health"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()["status"])
+
+        for payment_id in ("ref-1", "ref-2"):
+            self.client.get(reverse("api:get_payment_status", args=[payment_id]))
+        data = self.client.get(reverse("api:paystack_health")).json()
+        self.assertFalse(data["status"])
+        self.assertEqual(data["data"]["payment_status"]["circuit"]["state"], "open")
+        self.assertEqual(data["data"]["init_payment"]["circuit"]["state"], "closed")
+
+
+class PaystackRetryTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.requests: list[httpx.Request] = []
+        self.outcomes: list = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        """Fails with the queued outcomes (responses or exceptions), then answers like Paystack."""
+        self.requests.append(request)
+        if self.outcomes:
+            outcome = self.outcomes.pop(0)
+            if isinstance(outcome, type) and issubclass(outcome, Exception):
+                raise outcome("Mock failure", request=request)
+            return outcome
+        return mock_paystack_handler(request)
+
+    def get_client(self, base_url: str, secret_key: str) -> httpx.AsyncClient:
+        return httpx.AsyncClient(base_url=base_url, transport=httpx.MockTransport(self.handler))
+
+    def paystack_client(self, **kwargs) -> AsyncPaystackClient:
+        kwargs.setdefault("retry_policy", RetryPolicy(max_attempts=3, base_delay=0.001))
+        return AsyncPaystackClient(http_client_fun=self.get_client, secret_key=mock_secret_key, **kwargs)
+
+    def test_payment_status_is_retried(self):
+        self.outcomes = [httpx.Response(503, text="Service Unavailable"), httpx.ConnectError]
+        data = async_to_sync(self.paystack_client().get_payment_status)("mock-valid-payment-123")
+        self.assertEqual(data["data"]["status"], "success")
+        self.assertEqual(len(self.requests), 3)
+
+    def test_retries_are_limited(self):
+        self.outcomes = [httpx.Response(503, text="Service Unavailable")] * 5
+        with self.assertRaises(PaystackClientException) as context:
+            async_to_sync(self.paystack_client().get_payment_status)("mock-valid-payment-123")
+        self.assertEqual(context.exception.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(len(self.requests), 3)
+
+    def test_not_found_is_not_retried(self):
+        with self.assertRaises(PaystackClientException) as context:
+            async_to_sync(self.paystack_client().get_payment_status)("invalid-payment-id")
+        self.assertEqual(context.exception.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_init_payment_is_only_retried_if_not_sent(self):
+        self.outcomes = [httpx.ConnectError]
+        async_to_sync(self.paystack_client().init_payment)(email="john@example.com", amount=30)
+        self.assertEqual(len(self.requests), 2)
+
+        self.requests.clear()
+        self.outcomes = [httpx.ReadError]
+        with self.assertRaises(PaystackClientException) as context:
+            async_to_sync(self.paystack_client().init_payment)(email="john@example.com", amount=30)
+        self.assertEqual(context.exception.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_retry_budget(self):
+        budget = RetryBudget(ratio=0, min_per_second=0, max_tokens=1)
+        paystack_client = self.paystack_client(retry_policy=RetryPolicy(max_attempts=3, base_delay=0.001, budget=budget))
+        self.outcomes = [httpx.ConnectError] * 5
+        with self.assertRaises(PaystackClientException):
+            async_to_sync(paystack_client.get_payment_status)("mock-valid-payment-123")
+        # The budget only had one retry
+        self.assertEqual(len(self.requests), 2)
+        self.assertFalse(budget.try_withdraw())
+
+    def test_attempt_timeout(self):
+        server = MockPaystackServer(latency=0.5)
+        paystack_client = AsyncPaystackClient(
+            http_client_fun=server.async_client_fun(), secret_key=mock_secret_key,
+            retry_policy=RetryPolicy(max_attempts=2, base_delay=0.001), timeout=0.05)
+        start = time.perf_counter()
+        with self.assertRaises(PaystackClientException) as context:
+            async_to_sync(paystack_client.get_payment_status)("mock-valid-payment-123")
+        self.assertEqual(context.exception.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertLess(time.perf_counter() - start, 0.4)
+
+    def test_deadline_propagation(self):
+        server = MockPaystackServer(latency=0.5)
+        paystack_client = AsyncPaystackClient(http_client_fun=server.async_client_fun(), secret_key=mock_secret_key)
+
+        async def get_payment_status_within_deadline():
+            with deadline_scope(0.05):
+                return await paystack_client.get_payment_status("mock-valid-payment-123")
+
+        start = time.perf_counter()
+        with self.assertRaises(PaystackClientException) as context:
+            async_to_sync(get_payment_status_within_deadline)()
+        self.assertEqual(context.exception.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertLess(time.perf_counter() - start, 0.4)
+
+    def test_sync_client_retries(self):
+        self.outcomes = [httpx.Response(502, text="Bad Gateway")]
+        paystack_client = PaystackClient(
+            http_client_fun=lambda base_url, secret_key: httpx.Client(
+                base_url=base_url, transport=httpx.MockTransport(self.handler)),
+            secret_key=mock_secret_key, retry_policy=RetryPolicy(max_attempts=3, base_delay=0.001))
+        with paystack_client:
+            data = paystack_client.get_payment_status("mock-valid-payment-123")
+        self.assertEqual(data["data"]["status"], "success")
+        self.assertEqual(len(self.requests), 2)
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = MetricsRegistry()
+        self.counter = self.registry.counter("requests_total", "Requests.", ["status"])
+        self.histogram = self.registry.histogram("duration_seconds", "Duration.", ["view"], buckets=(0.1, 1.0))
+
+    def test_updates_from_several_threads(self):
+        def update(_):
+            for _ in range(1000):
+                self.counter.labels(200).inc()
+                self.histogram.labels("InitPaymentView").observe(0.5)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(update, range(8)))
+
+        samples = self.registry.snapshot()["metrics"]
+        self.assertEqual(samples["requests_total"]["samples"], [[["200"], [8000.0]]])
+        self.assertEqual(samples["duration_seconds"]["samples"], [[["InitPaymentView"], [0.0, 8000.0, 0.0, 4000.0]]])
+
+    def test_render(self):
+        self.counter.labels(200).inc()
+        self.histogram.labels("InitPaymentView").observe(0.05)
+        self.histogram.labels("InitPaymentView").observe(5)
+        self.registry.gauge("pending", "Pending.", (), lambda: {(): 3})
+
+        text = render(merge_snapshots([self.registry.snapshot()], time.time(), 10))
+        self.assertIn("# TYPE requests_total counter\nrequests_total{status=\"200\"} 1\n", text)
+        self.assertIn('duration_seconds_bucket{view="InitPaymentView",le="0.1"} 1\n', text)
+        self.assertIn('duration_seconds_bucket{view="InitPaymentView",le="1.0"} 1\n', text)
+        self.assertIn('duration_seconds_bucket{view="InitPaymentView",le="+Inf"} 2\n', text)
+        self.assertIn('duration_seconds_count{view="InitPaymentView"} 2\n', text)
+        self.assertIn('duration_seconds_sum{view="InitPaymentView"} 5.05\n', text)
+        self.assertIn("# TYPE pending gauge\npending 3\n", text)
+
+    def test_merge_snapshots_of_workers(self):
+        self.counter.labels(200).inc(2)
+        self.registry.gauge("pending", "Pending.", (), lambda: {(): 3})
+        snapshot = self.registry.snapshot()
+        exited_worker_snapshot = {**snapshot, "time": snapshot["time"] - 60}
+
+        merged = merge_snapshots([snapshot, exited_worker_snapshot], snapshot["time"], 10)
+        self.assertEqual(merged["requests_total"]["samples"], [[["200"], [4.0]]])
+        # Gauges of workers that stopped updating their snapshot are left out
+        self.assertEqual(merged["pending"]["samples"], [[[], [3.0]]])
+
+    def test_snapshot_writer(self):
+        self.counter.labels(200).inc()
+        with tempfile.TemporaryDirectory() as directory:
+            other_worker_snapshot = self.registry.snapshot()
+            other_worker_snapshot["pid"] = -1
+            with open(f"{directory}/metrics-other.json", "w") as file:
+                json.dump(other_worker_snapshot, file)
+
+            snapshots = SnapshotWriter(self.registry, directory).read_all()
+        merged = merge_snapshots(snapshots, time.time(), 10)
+        self.assertEqual(merged["requests_total"]["samples"], [[["200"], [2.0]]])
+
+
+class MetricsEndpointTests(PaystackMockTestCase):
+    def test_metrics(self):
+        self.client.post(
+            init_payment_url,
+            data=json.dumps({"customer_name": "John Doe", "customer_email": "john@example.com", "amount": 30}),
+            content_type="application/json")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.content.decode()
+        self.assertIn('http_requests_total{view="InitPaymentView",method="POST",status="200"}', text)
+        self.assertIn('paystack_requests_total{endpoint="init_payment",outcome="200"}', text)
+        self.assertIn('validation_duration_seconds_count{serializer="PaymentInfoSerializer",path="fast"}', text)
+        self.assertIn('paystack_circuit_open{endpoint="payment_status"} 0', text)
+
+    @patch("api.views.METRICS_TOKEN", "metrics-token")
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get("/metrics", headers={"Authorization": "Bearer metrics-token"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TracingTests(PaystackMockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.exporter = InMemorySpanExporter()
+        for name, value in (("enabled", True), ("sample_rate", 1.0), ("_exporter", self.exporter)):
+            patcher = patch.object(tracer, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.paystack_headers = []
+
+        def handler(request: httpx.Request):
+            self.paystack_headers.append(request.headers)
+            return mock_paystack_handler(request)
+
+        paystack_client = AsyncPaystackClient(
+            http_client_fun=lambda base_url, secret_key: httpx.AsyncClient(
+                base_url=base_url, transport=httpx.MockTransport(handler)),
+            secret_key=mock_secret_key)
+        patcher = patch('api.views.paystack_client', paystack_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, **headers):
+        return self.client.post(
+            init_payment_url,
+            data=json.dumps({"customer_name": "John Doe", "customer_email": "john@example.com", "amount": 30}),
+            content_type="application/json", headers=headers)
+
+    def test_request_is_traced(self):
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        spans = {span.name: span for span in self.exporter.spans}
+        self.assertEqual(
+            set(spans),
+            {"POST InitPaymentView", "validate PaymentInfoSerializer", "paystack init_payment",
+             "validate PaystackTransactionInitResponseSerializer", "render"})
+        root = spans["POST InitPaymentView"]
+        self.assertIsNone(root.parent_span_id)
+        self.assertEqual(response["X-Trace-Id"], root.trace_id)
+        for name in ("validate PaymentInfoSerializer", "paystack init_payment",
+                     "validate PaystackTransactionInitResponseSerializer", "render"):
+            self.assertEqual(spans[name].trace_id, root.trace_id)
+            self.assertEqual(spans[name].parent_span_id, root.span_id)
+        self.assertEqual(spans["paystack init_payment"].attributes["http.response.status_code"], 200)
+        self.assertEqual(spans["validate PaymentInfoSerializer"].attributes["validation.path"], "fast")
+
+        # The trace is continued by the call to Paystack
+        self.assertEqual(self.paystack_headers[0]["traceparent"], spans["paystack init_payment"].traceparent)
+
+    def test_incoming_trace_is_continued(self):
+        trace_id, parent_span_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+        self.post(traceparent=f"00-{trace_id}-{parent_span_id}-01")
+        root = next(span for span in self.exporter.spans if span.name == "POST InitPaymentView")
+        self.assertEqual(root.trace_id, trace_id)
+        self.assertEqual(root.parent_span_id, parent_span_id)
+
+        # The caller decided not to sample the trace
+        self.exporter.spans.clear()
+        response = self.post(traceparent=f"00-{trace_id}-{parent_span_id}-00")
+        self.assertEqual(self.exporter.spans, [])
+        self.assertNotIn("X-Trace-Id", response.headers)
+
+    def test_parent_sampled_requests_are_rate_limited(self):
+        now = [0.0]
+        limited_tracer = Tracer(
+            enabled=True, sample_rate=0.0, parent_sampled_max_rate=2, exporter=self.exporter, clock=lambda: now[0])
+        traceparent = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+        def sampled():
+            with limited_tracer.start_request_span("request", traceparent, {}) as span:
+                return span is not None
+
+        # A client cannot force every request to be traced
+        self.assertEqual([sampled() for _ in range(5)], [True, True, False, False, False])
+        now[0] = 0.5
+        self.assertEqual([sampled() for _ in range(2)], [True, False])
+        with patch.object(limited_tracer, "sample_rate", 1.0):
+            self.assertTrue(sampled())
+
+    def test_unsampled_request(self):
+        with patch.object(tracer, "sample_rate", 0.0):
+            response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.exporter.spans, [])
+        self.assertNotIn("traceparent", self.paystack_headers[0])
+
+    def test_parse_traceparent(self):
+        self.assertEqual(
+            parse_traceparent("00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"),
+            ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True))
+        self.assertIsNone(parse_traceparent("00-00000000000000000000000000000000-00f067aa0ba902b7-01"))
+        self.assertIsNone(parse_traceparent("not a traceparent"))
+        self.assertIsNone(parse_traceparent(None))
+
+    def test_file_exporter(self):
+        with tempfile.TemporaryDirectory() as directory:
+            exporter = FileSpanExporter(f"{directory}/traces.jsonl", flush_interval=60)
+            with patch.object(tracer, "_exporter", exporter):
+                self.post()
+            exporter.stop()
+            with open(exporter.path) as file:
+                requests = [json.loads(line) for line in file]
+
+        self.assertEqual(len(requests), 1)
+        resource_spans = requests[0]["resourceSpans"][0]
+        self.assertIn(
+            {"key": "service.name", "value": {"stringValue": "restful-payment-gateway-api"}},
+            resource_spans["resource"]["attributes"])
+        spans = resource_spans["scopeSpans"][0]["spans"]
+        self.assertEqual(len(spans), 5)
+        paystack_span = next(span for span in spans if span["name"] == "paystack init_payment")
+        self.assertEqual(paystack_span["kind"], "SPAN_KIND_CLIENT")
+        self.assertIn({"key": "http.response.status_code", "value": {"intValue": "200"}}, paystack_span["attributes"])
+
+    def test_file_exporter_rotates_the_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            exporter = FileSpanExporter(f"{directory}/traces.jsonl", flush_interval=60, max_bytes=1)
+            with patch.object(tracer, "_exporter", exporter):
+                self.post()
+                exporter.flush()
+                self.post()
+            exporter.stop()
+            with open(exporter.path) as file:
+                current = [json.loads(line) for line in file]
+            with open(f"{exporter.path}.1") as file:
+                rotated = [json.loads(line) for line in file]
+
+        self.assertEqual(len(current), 1)
+        self.assertEqual(len(rotated), 1)
+        self.assertNotEqual(current, rotated)
+
+
+class SchemaTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.schema_cache = SchemaCache(artifact_path=None)
+        patcher = patch("api.schema.schema_cache", self.schema_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_schema(self):
+        response = self.client.get(reverse("api:schema"), headers={"Accept": "application/vnd.oai.openapi+json"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/vnd.oai.openapi+json")
+        schema = response.json()
+        # Annotations recorded by `api.schema.extend_schema` are applied
+        parameters = schema["paths"]["/api/v1/payments/"]["post"]["parameters"]
+        self.assertIn("Idempotency-Key", [parameter["name"] for parameter in parameters])
+        self.assertIn("text/csv", schema["paths"]["/api/v1/payments/export/"]["get"]["responses"]["200"]["content"])
+
+        yaml_response = self.client.get(reverse("api:schema"))
+        self.assertEqual(yaml_response["Content-Type"], "application/vnd.oai.openapi")
+        self.assertIn(b"openapi: 3.0.3", yaml_response.content)
+
+    def test_etag(self):
+        url = f"{reverse('api:schema')}?format=json"
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "public, no-cache")
+
+        not_modified = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified["ETag"], etag)
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": '"other"'}).status_code, status.HTTP_200_OK)
+
+    def test_gzip(self):
+        url = f"{reverse('api:schema')}?format=json"
+        plain = self.client.get(url)
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertNotEqual(response["ETag"], plain["ETag"])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        # gzip is not acceptable
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip;q=0, identity"})
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response.content, plain.content)
+
+    def test_artifact(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/schema.json"
+            call_command("build_schema", output=path, app_version="1.2.3", stderr=StringIO())
+            with open(path) as file:
+                artifact = json.load(file)
+            self.assertEqual(artifact["version"], "1.2.3")
+
+            artifact["schema"]["info"]["title"] = "From the artifact"
+            write_schema_artifact(path, artifact["schema"], "1.2.3")
+            self.assertEqual(SchemaCache(path, "1.2.3").schema()["info"]["title"], "From the artifact")
+            # An artifact of another version is ignored, and the schema generated instead
+            self.assertEqual(SchemaCache(path, "1.2.4").schema()["info"]["title"], "Payment Gateway API")
+
+    def test_schema_ui(self):
+        response = self.client.get(reverse("api:swagger-ui"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/html"))
+        not_modified = self.client.get(reverse("api:swagger-ui"), headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(reverse("api:redoc")).status_code, status.HTTP_200_OK)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+
+    def clock(self):
+        return self.now
+
+    def test_token_bucket(self):
+        limiter = RateLimiter("test", rate=2.0, burst=3, cache_alias=None, clock=self.clock)
+        self.assertEqual([limiter.acquire_local("a") for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(limiter.acquire_local("a"), 0.5)
+        # Other clients have their own buckets
+        self.assertEqual(limiter.acquire_local("b"), 0.0)
+
+        self.now += 0.5
+        self.assertEqual(limiter.acquire_local("a"), 0.0)
+        self.assertGreater(limiter.acquire_local("a"), 0)
+        # Tokens are added back up to the burst size
+        self.now += 60
+        self.assertEqual([limiter.acquire_local("a") for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertGreater(limiter.acquire_local("a"), 0)
+
+    def test_cost(self):
+        limiter = RateLimiter("test", rate=1.0, burst=4, cache_alias=None, clock=self.clock)
+        self.assertEqual(limiter.acquire_local("a", cost=3), 0.0)
+        # Not enough tokens are left for another 3
+        self.assertAlmostEqual(limiter.acquire_local("a", cost=3), 2.0)
+        self.assertEqual(limiter.acquire_local("a"), 0.0)
+
+        # A cost over the burst size takes a full bucket, and leaves it in debt
+        self.assertAlmostEqual(limiter.acquire_local("b", cost=6), 0.0)
+        self.now += 2
+        self.assertAlmostEqual(limiter.acquire_local("b"), 1.0)
+        self.now += 3
+        self.assertAlmostEqual(limiter.acquire_local("b", cost=6), 1.0)
+        self.now += 1
+        self.assertEqual(limiter.acquire_local("b", cost=6), 0.0)
+
+    def test_shared_cost(self):
+        limiter = RateLimiter("test-shared-cost", rate=1.0, burst=4, cache_alias="default", clock=self.clock,
+                              wall_clock=self.clock)
+        self.assertEqual(async_to_sync(limiter.acquire_shared)("client", 3), 0.0)
+        self.assertGreater(async_to_sync(limiter.acquire_shared)("client", 2), 0)
+
+    def test_least_recently_seen_clients_are_forgotten(self):
+        limiter = RateLimiter("test", rate=1.0, burst=1, max_clients=2, cache_alias=None, clock=self.clock)
+        limiter.acquire_local("a")
+        limiter.acquire_local("b")
+        limiter.acquire_local("a")
+        limiter.acquire_local("c")
+        self.assertEqual(len(limiter), 2)
+        # "b" was forgotten, so it has a full bucket again, unlike "a"
+        self.assertGreater(limiter.acquire_local("a"), 0)
+        self.assertEqual(limiter.acquire_local("b"), 0.0)
+
+    def test_shared_limit(self):
+        # Two workers, each with its own buckets
+        workers = [
+            RateLimiter("test-shared", rate=1.0, burst=4, cache_alias="default", clock=self.clock,
+                        wall_clock=self.clock)
+            for _ in range(2)]
+
+        async def acquire_all():
+            return [await workers[i % 2].acquire("client") for i in range(6)]
+
+        waits = async_to_sync(acquire_all)()
+        # Each worker would allow 4 requests on its own
+        self.assertEqual(waits[:4], [0.0] * 4)
+        self.assertTrue(all(wait > 0 for wait in waits[4:]))
+
+        # Once the window has slid past the requests, they are allowed again
+        self.now += 8
+        self.assertEqual(async_to_sync(workers[0].acquire)("client"), 0.0)
+
+
+class RateLimitTests(PaystackMockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.limiter = RateLimiter("init_payment", rate=0.1, burst=2, cache_alias=None)
+        patcher = patch.dict(rate_limiters, {"init_payment": self.limiter})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, **kwargs):
+        return self.client.post(
+            init_payment_url,
+            data=json.dumps({"customer_name": "John Doe", "customer_email": "john@example.com", "amount": 30}),
+            content_type="application/json", **kwargs)
+
+    def test_rate_limit(self):
+        self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "10")
+        self.assertEqual(self.payment_ledger.pending, 2)
+
+        # Other clients are not limited
+        self.assertEqual(self.post(REMOTE_ADDR="10.0.0.2").status_code, status.HTTP_200_OK)
+
+    def test_batch_takes_a_token_per_payment(self):
+        payment = {"customer_name": "John Doe", "customer_email": "john@example.com", "amount": 30}
+
+        def post_batch(size):
+            return self.client.post(
+                batch_init_payment_url, data=json.dumps({"payments": [payment] * size}),
+                content_type="application/json")
+
+        self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+        # One token is left, which is not enough for two payments
+        response = post_batch(2)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.payment_ledger.pending, 1)
+        self.assertEqual(post_batch(1).status_code, status.HTTP_200_OK)
+
+    def test_bulk_status_takes_a_token_per_reference(self):
+        limiter = RateLimiter("payment_status", rate=0.1, burst=3, cache_alias=None)
+        with patch.dict(rate_limiters, {"payment_status": limiter}):
+            def post_references(references):
+                return self.client.post(
+                    bulk_payment_status_url, data=json.dumps({"references": references}),
+                    content_type="application/json")
+
+            self.assertEqual(post_references(["ref-1", "ref-2"]).status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                post_references(["ref-3", "ref-4"]).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(post_references(["ref-3"]).status_code, status.HTTP_200_OK)
+
+    def test_spoofed_forwarded_for_does_not_get_a_new_bucket(self):
+        for i in range(2):
+            self.assertEqual(self.post(HTTP_X_FORWARDED_FOR=f"203.0.113.{i}").status_code, status.HTTP_200_OK)
+        # Without proxies in front of the application, X-Forwarded-For is made up by the client
+        response = self.post(HTTP_X_FORWARDED_FOR="203.0.113.99")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @patch("api.throttling.RATE_LIMIT_API_KEYS", ("partner-key",))
+    def test_api_key(self):
+        self.post()
+        self.post()
+        self.assertEqual(self.post(headers={"X-API-Key": "partner-key"}).status_code, status.HTTP_200_OK)
+        # Unknown keys do not get a bucket of their own
+        self.assertEqual(
+            self.post(headers={"X-API-Key": "made-up"}).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @patch("api.throttling.RATE_LIMIT_ENABLED", False)
+    def test_disabled(self):
+        for _ in range(3):
+            self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+
+
+class MerchantClientPoolTests(SimpleTestCase):
+    class Client:
+        def __init__(self, secret_key: str):
+            self.secret_key = secret_key
+            self.closed = False
+
+        async def aclose(self):
+            self.closed = True
+
+    def setUp(self):
+        self.now = 0.0
+        self.pool = PaystackClientPool(self.Client, max_clients=2, idle_timeout=60, clock=lambda: self.now)
+
+    async def get(self, secret_key: str):
+        async with self.pool.use(secret_key) as client:
+            return client
+
+    def test_reuse(self):
+        client = async_to_sync(self.get)("sk_a")
+        self.assertIs(async_to_sync(self.get)("sk_a"), client)
+        self.assertIsNot(async_to_sync(self.get)("sk_b"), client)
+        self.assertEqual(len(self.pool), 2)
+
+    def test_lru_eviction(self):
+        a = async_to_sync(self.get)("sk_a")
+        b = async_to_sync(self.get)("sk_b")
+        async_to_sync(self.get)("sk_a")
+        async_to_sync(self.get)("sk_c")
+        # The least recently used client is closed
+        self.assertTrue(b.closed)
+        self.assertFalse(a.closed)
+        self.assertEqual(len(self.pool), 2)
+        self.assertIsNot(async_to_sync(self.get)("sk_b"), b)
+
+    def test_idle_eviction(self):
+        a = async_to_sync(self.get)("sk_a")
+        self.now = 61
+        async_to_sync(self.get)("sk_b")
+        self.assertTrue(a.closed)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_client_in_use_is_closed_after_use(self):
+        async def evict_while_in_use():
+            async with self.pool.use("sk_a") as a:
+                await self.get("sk_b")
+                await self.get("sk_c")
+                # Evicted, but still in use
+                self.assertEqual(len(self.pool), 2)
+                self.assertFalse(a.closed)
+            return a
+
+        self.assertTrue(async_to_sync(evict_while_in_use)().closed)
+
+    def test_aclose(self):
+        a = async_to_sync(self.get)("sk_a")
+        async_to_sync(self.pool.aclose)()
+        self.assertTrue(a.closed)
+        self.assertEqual(len(self.pool), 0)
+
+
+@patch.dict("api.paystack.client_pool.PAYSTACK_MERCHANTS", {"shop-a": "sk_test_shop_a"})
+@patch.dict("api.paystack.client_pool.PAYSTACK_MERCHANT_API_KEYS", {"shop-a-key": "shop-a"})
+class MultiMerchantTests(PaystackMockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.merchant_clients = PaystackClientPool(lambda secret_key: AsyncPaystackClient(
+            http_client_fun=get_mock_async_paystack_client,
+            secret_key=secret_key,
+            status_cache=PaymentStatusCache(cache_alias=None)))
+        patcher = patch("api.views.merchant_clients", self.merchant_clients)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_status(self, **kwargs):
+        return self.client.get(
+            reverse(payment_status_url_view_name, kwargs={"payment_id": "mock-valid-payment-123"}), **kwargs)
+
+    def merchant_client(self) -> AsyncPaystackClient:
+        async def get():
+            async with self.merchant_clients.use("sk_test_shop_a") as client:
+                return client
+        return async_to_sync(get)()
+
+    def test_default_merchant(self):
+        self.assertEqual(self.get_status().status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.merchant_clients), 0)
+        self.assertEqual(len(self.mock_paystack_client_instance.status_cache), 1)
+
+    def test_merchant_header(self):
+        self.assertEqual(self.get_status(headers={"X-Merchant-Id": "shop-a"}).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_status(headers={"X-Merchant-Id": "shop-a"}).status_code, status.HTTP_200_OK)
+        # One client for both requests, whose status cache is separate from the default merchant's
+        self.assertEqual(len(self.merchant_clients), 1)
+        self.assertEqual(len(self.merchant_client().status_cache), 1)
+        self.assertEqual(len(self.mock_paystack_client_instance.status_cache), 0)
+
+    def test_merchant_api_key(self):
+        response = self.get_status(headers={"X-API-Key": "shop-a-key", "X-Merchant-Id": "unknown"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.merchant_client().status_cache), 1)
+
+    def test_unknown_merchant(self):
+        response = self.get_status(headers={"X-Merchant-Id": "unknown"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"status": False, "message": "Unknown merchant 'unknown'"})
+
+    @patch.dict("api.views.PAYSTACK_MERCHANTS", {"shop-a": "sk_test_shop_a"})
+    def test_webhook(self):
+        body = json.dumps({"event": "charge.success", "data": {
+            "id": 1, "domain": "test", "status": "success", "reference": "shop-a-ref", "amount": 10000,
+            "paid_at": "2025-06-06T08:27:31.000Z", "created_at": "2025-06-06T08:26:51.000Z",
+            "channel": "card", "currency": "KES"}}).encode()
+        url = f"{paystack_webhook_url}?merchant=shop-a"
+
+        # Signed with the default merchant's key
+        response = self.client.post(url, data=body, content_type="application/json",
+                                    HTTP_X_PAYSTACK_SIGNATURE=compute_signature(body, mock_secret_key))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = self.client.post(url, data=body, content_type="application/json",
+                                    HTTP_X_PAYSTACK_SIGNATURE=compute_signature(body, "sk_test_shop_a"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(self.merchant_client().status_cache.get("shop-a-ref"))
+
+
+class ProviderRouterTests(SimpleTestCase):
+    class Provider(PaymentProvider):
+        def __init__(self, name: str, router_test: "ProviderRouterTests", latency: float = 0.0):
+            self.name = name
+            self.router_test = router_test
+            self.latency = latency
+            self.status_code: int | None = None
+            self.calls = 0
+
+        async def init_payment(self, email: str, amount: float) -> dict:
+            self.calls += 1
+            self.router_test.now += self.latency
+            if self.status_code is not None:
+                raise PaymentProviderException(data={"status": False}, status_code=self.status_code)
+            return {"status": True, "provider": self.name}
+
+        async def get_payment_status(self, payment_id: str) -> dict:
+            return {"status": True, "provider": self.name}
+
+    def setUp(self):
+        self.now = 0.0
+        self.router = ProviderRouter(alpha=0.5, error_rate_threshold=0.5, probe_interval=60, clock=lambda: self.now)
+        self.fast = self.Provider("fast", self, latency=0.1)
+        self.slow = self.Provider("slow", self, latency=1.0)
+        self.providers = [self.slow, self.fast]
+
+    def init_payment(self) -> dict:
+        return async_to_sync(self.router.call)(
+            self.providers, lambda provider: provider.init_payment("john@example.com", 30))
+
+    def test_incomplete_provider_cannot_be_created(self):
+        class IncompleteProvider(PaymentProvider):
+            name = "incomplete"
+
+            async def init_payment(self, email: str, amount: float) -> dict:
+                return {"status": True}
+
+        registry = ProviderRegistry()
+        registry.register("incomplete", IncompleteProvider)
+        with self.assertRaises(TypeError):
+            registry.get("incomplete")
+
+    def sample_providers(self):
+        # Without calls yet, providers are tried in their order, until the others are probed
+        self.assertEqual(self.init_payment()["provider"], "slow")
+        self.now += 60
+        self.assertEqual(self.init_payment()["provider"], "fast")
+        # By now, the slow provider was not used for a while either
+        self.assertEqual(self.init_payment()["provider"], "slow")
+
+    def test_fastest_provider_is_chosen(self):
+        self.sample_providers()
+        for _ in range(5):
+            self.assertEqual(self.init_payment()["provider"], "fast")
+        self.assertEqual(self.slow.calls, 2)
+        self.assertAlmostEqual(self.router.stats("fast").latency, 0.1)
+
+    def test_failover(self):
+        self.sample_providers()
+        self.fast.status_code = status.HTTP_502_BAD_GATEWAY
+        self.assertEqual(self.init_payment()["provider"], "slow")
+        self.assertEqual(self.router.stats("fast").error_rate, 0.5)
+        # The fast provider is degraded now, so the slow one is tried first
+        self.assertEqual(self.init_payment()["provider"], "slow")
+        self.assertEqual(self.fast.calls, 2)
+
+    def test_request_errors_do_not_fail_over(self):
+        self.sample_providers()
+        self.fast.status_code = status.HTTP_400_BAD_REQUEST
+        with self.assertRaises(PaymentProviderException):
+            self.init_payment()
+        self.assertEqual(self.slow.calls, 2)
+        self.assertEqual(self.router.stats("fast").error_rate, 0.0)
+
+    def test_all_providers_fail(self):
+        self.fast.status_code = self.slow.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        with self.assertRaises(PaymentProviderException) as context:
+            self.init_payment()
+        self.assertEqual(context.exception.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.fast.calls + self.slow.calls, 2)
+
+    def test_probe(self):
+        self.sample_providers()
+        self.init_payment()
+        self.assertEqual(self.slow.calls, 2)
+        # The slow provider has not been chosen for a while, so it is tried again once
+        self.now += 60
+        self.assertEqual(self.init_payment()["provider"], "slow")
+        self.assertEqual(self.init_payment()["provider"], "fast")
+
+
+class FlutterwaveClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = MockFlutterwaveServer()
+        self.flutterwave_client = AsyncFlutterwaveClient(
+            http_client_fun=self.server.async_client_fun(), secret_key="FLWSECK_TEST-mock",
+            base_url="https://api.flutterwave.com/v3", currency="KES")
+
+    def test_init_payment_and_status(self):
+        data = async_to_sync(self.flutterwave_client.init_payment)(email="john@example.com", amount=Decimal("30.50"))
+        reference = data["data"]["reference"]
+        self.assertTrue(reference.startswith("flw_"))
+        self.assertTrue(data["data"]["authorization_url"].startswith("https://checkout.flutterwave.com/"))
+
+        data = async_to_sync(self.flutterwave_client.get_payment_status)(reference)["data"]
+        self.assertEqual(data["status"], "pending")
+        self.assertIsNone(data["paid_at"])
+        # In the currency's subunit, like Paystack's amounts
+        self.assertEqual(data["amount"], Decimal("3050.00"))
+        self.assertEqual(data["currency"], "KES")
+        self.assertEqual(data["domain"], "test")
+
+        self.server.settle(reference)
+        data = async_to_sync(self.flutterwave_client.get_payment_status)(reference)["data"]
+        self.assertEqual(data["status"], "success")
+        self.assertIsNotNone(data["paid_at"])
+
+    def test_not_found(self):
+        with self.assertRaises(PaymentProviderException) as context:
+            async_to_sync(self.flutterwave_client.get_payment_status)("flw_unknown")
+        self.assertEqual(context.exception.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_server_error(self):
+        self.server.error_rate = 1.0
+        with self.assertRaises(PaymentProviderException) as context:
+            async_to_sync(self.flutterwave_client.init_payment)(email="john@example.com", amount=30)
+        self.assertTrue(context.exception.provider_failed)
+
+
+@patch("api.views.PAYMENT_PROVIDERS", ("paystack", "flutterwave"))
+class PaymentProviderRoutingTests(PaystackMockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.flutterwave_server = MockFlutterwaveServer()
+        self.payment_providers = ProviderRegistry()
+        self.payment_providers.register("flutterwave", lambda: AsyncFlutterwaveClient(
+            http_client_fun=self.flutterwave_server.async_client_fun(), secret_key="FLWSECK_TEST-mock",
+            base_url="https://api.flutterwave.com/v3"), "flw_")
+        self.router = ProviderRouter(probe_interval=60)
+        for target, value in (("api.views.payment_providers", self.payment_providers),
+                              ("api.views.provider_router", self.router)):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self):
+        return self.client.post(
+            init_payment_url,
+            data=json.dumps({"customer_name": "John Doe", "customer_email": "john@example.com", "amount": 30}),
+            content_type="application/json")
+
+    def test_failover_to_flutterwave(self):
+        failing_paystack_client = AsyncPaystackClient(
+            http_client_fun=MockPaystackServer(error_rate=1.0).async_client_fun(), secret_key=mock_secret_key,
+            retry_policy=RetryPolicy(max_attempts=1))
+        with patch("api.views.paystack_client", failing_paystack_client):
+            response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        reference = response.json()["data"]["reference"]
+        self.assertTrue(reference.startswith("flw_"))
+        self.assertEqual(self.flutterwave_server.requests, 1)
+
+        # Statuses are looked up with the provider that initialized the payment
+        response = self.client.get(reverse(payment_status_url_view_name, kwargs={"payment_id": reference}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["data"]["reference"], reference)
+        self.assertEqual(self.flutterwave_server.requests, 2)
+
+    def test_paystack_references(self):
+        self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+        response = self.client.get(
+            reverse(payment_status_url_view_name, kwargs={"payment_id": "mock-valid-payment-123"}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.flutterwave_server.requests, 0)
+
+
+class HedgingTests(SimpleTestCase):
+    def hedge_policy(self, **kwargs) -> HedgePolicy:
+        kwargs.setdefault("min_delay", 0.01)
+        policy = HedgePolicy("payment_status", enabled=True, percentile=95, min_samples=10, **kwargs)
+        for _ in range(10):
+            policy.record(0.001)
+        return policy
+
+    def test_delay(self):
+        policy = HedgePolicy("payment_status", enabled=True, percentile=95, min_delay=0.05, window_size=100)
+        for latency in range(1, 50):
+            policy.record(latency / 100)
+        self.assertIsNone(policy.delay())
+        for latency in range(50, 101):
+            policy.record(latency / 100)
+        self.assertEqual(policy.delay(), 0.95)
+
+        self.assertEqual(self.hedge_policy().delay(), 0.01)
+        self.assertIsNone(HedgePolicy("payment_status", enabled=False).delay())
+
+    def test_slow_call_is_hedged(self):
+        policy = self.hedge_policy()
+        calls = []
+
+        async def call():
+            calls.append(None)
+            await asyncio.sleep(10 if len(calls) == 1 else 0)
+            return len(calls)
+
+        started_at = time.perf_counter()
+        self.assertEqual(async_to_sync(policy.run)(call), 2)
+        self.assertLess(time.perf_counter() - started_at, 1)
+        self.assertEqual((policy.hedges, policy.wins), (1, 1))
+
+    def test_fast_call_is_not_hedged(self):
+        policy = self.hedge_policy()
+
+        async def call():
+            return "first"
+
+        self.assertEqual(async_to_sync(policy.run)(call), "first")
+        self.assertEqual(policy.hedges, 0)
+
+    def test_hedges_are_limited(self):
+        policy = self.hedge_policy(budget=RetryBudget(ratio=0, min_per_second=0, max_tokens=1))
+        calls = []
+
+        async def call():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+
+        async def run_concurrently():
+            await asyncio.gather(*(policy.run(call) for _ in range(5)))
+
+        async_to_sync(run_concurrently)()
+        self.assertEqual(policy.hedges, 1)
+        self.assertEqual(len(calls), 6)
+
+    def test_failed_hedge_waits_for_first_call(self):
+        policy = self.hedge_policy()
+        calls = []
+
+        async def call():
+            calls.append(None)
+            if len(calls) == 2:
+                raise httpx.ConnectError("Mock failure")
+            await asyncio.sleep(0.05)
+            return "first"
+
+        self.assertEqual(async_to_sync(policy.run)(call), "first")
+        self.assertEqual((policy.hedges, policy.wins), (1, 0))
+
+    def test_payment_status(self):
+        requests = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            if len(requests) == 1:
+                await asyncio.sleep(10)
+            return mock_paystack_handler(request)
+
+        paystack_client = AsyncPaystackClient(
+            http_client_fun=lambda base_url, secret_key: httpx.AsyncClient(
+                base_url=base_url, transport=httpx.MockTransport(handler)),
+            secret_key=mock_secret_key, hedge_policy=self.hedge_policy())
+        data = async_to_sync(paystack_client.get_payment_status)("mock-valid-payment-123")
+        self.assertEqual(data["data"]["status"], "success")
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(paystack_client.hedge_policy.wins, 1)
+
+
+class PaymentReconcilerTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = MockPaystackServer()
+        self.providers = ProviderRegistry()
+        self.providers.register(AsyncPaystackClient.name, lambda: AsyncPaystackClient(
+            http_client_fun=self.server.async_client_fun(), secret_key=mock_secret_key))
+        self.now = django_timezone.now()
+
+    def reconciler(self, **kwargs) -> PaymentReconciler:
+        kwargs = {"min_age": 60, "max_age": 24 * 60 * 60, "recheck_interval": 300, "batch_size": 10,
+                  "concurrency": 4, "rate": 1000, "clock": lambda: self.now, **kwargs}
+        return PaymentReconciler(self.providers, AsyncPaystackClient.name, **kwargs)
+
+    def create_payment(self, reference: str, age: float, status: str = "pending") -> Payment:
+        payment = Payment.objects.create(
+            reference=reference,
+            customer_name="John Doe",
+            customer_email="john@example.com",
+            amount=Decimal("30.00"),
+            status=status)
+        # `initiated_at` is set on creation
+        Payment.objects.filter(pk=payment.pk).update(initiated_at=self.now - timedelta(seconds=age))
+        return payment
+
+    def test_sweep_records_statuses_of_stale_payments(self):
+        self.create_payment("ref-paid", age=600)
+        self.create_payment("ref-failed", age=600)
+        self.create_payment("mock-ref-abandoned", age=600)
+        self.create_payment("ref-too-recent", age=10)
+        self.create_payment("ref-too-old", age=2 * 24 * 60 * 60)
+        self.create_payment("ref-settled", age=600, status="failed")
+
+        counts = async_to_sync(self.reconciler().sweep)()
+        self.assertEqual(counts, {"checked": 3, "updated": 3, "failed": 0})
+
+        payments = {payment.reference: payment for payment in Payment.objects.all()}
+        self.assertEqual(payments["ref-paid"].status, "success")
+        self.assertIsNotNone(payments["ref-paid"].paid_at)
+        self.assertEqual(payments["ref-failed"].status, "failed")
+        self.assertEqual(payments["mock-ref-abandoned"].status, "abandoned")
+        for reference in ("ref-too-recent", "ref-too-old", "ref-settled"):
+            self.assertIsNone(payments[reference].last_checked_at)
+        self.assertEqual(payments["ref-too-recent"].status, "pending")
+        self.assertEqual(payments["ref-settled"].status, "failed")
+
+    def test_recent_payments_are_checked_first_in_batches(self):
+        for age in (3000, 1000, 2000):
+            self.create_payment(f"mock-ref-{age}", age=age)
+
+        reconciler = self.reconciler(batch_size=2)
+        self.assertEqual(
+            [payment.reference for payment in reconciler.stale_payments(self.now)],
+            ["mock-ref-1000", "mock-ref-2000", "mock-ref-3000"])
+
+        counts = async_to_sync(reconciler.sweep)()
+        self.assertEqual(counts["checked"], 3)
+        self.assertFalse(Payment.objects.filter(last_checked_at__isnull=True).exists())
+
+        # Checked payments are only due again after the recheck interval
+        self.now += timedelta(seconds=60)
+        self.assertEqual(async_to_sync(reconciler.sweep)()["checked"], 0)
+        self.now += timedelta(seconds=300)
+        self.assertEqual(async_to_sync(reconciler.sweep)()["checked"], 3)
+
+    def test_failed_lookups_are_checked_again_later(self):
+        self.create_payment("invalid-payment-id", age=600)
+
+        counts = async_to_sync(self.reconciler().sweep)()
+        self.assertEqual(counts, {"checked": 1, "updated": 0, "failed": 1})
+        payment = Payment.objects.get(reference="invalid-payment-id")
+        self.assertEqual(payment.status, "pending")
+        self.assertEqual(payment.last_checked_at, self.now)
+
+    def test_command_sweeps_while_the_background_thread_runs(self):
+        self.create_payment("ref-paid", age=600)
+        reconciler = self.reconciler(interval=3600)
+        reconciler.start()
+        self.addCleanup(reconciler.stop)
+
+        out = StringIO()
+        with patch("api.management.commands.reconcile_payments.payment_reconciler", reconciler):
+            call_command("reconcile_payments", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Checked 1 payments: 1 updated, 0 failed")
+        self.assertEqual(Payment.objects.get(reference="ref-paid").status, "success")
+
+    def test_payments_of_other_merchants_are_looked_up_with_their_key(self):
+        self.create_payment("ref-default", age=600)
+        Payment.objects.filter(pk=self.create_payment("ref-shop-a", age=600).pk).update(merchant="shop-a")
+        # A merchant that is no longer configured
+        Payment.objects.filter(pk=self.create_payment("ref-shop-b", age=600).pk).update(merchant="shop-b")
+
+        secret_keys = []
+
+        def merchant_client_fun(secret_key):
+            secret_keys.append(secret_key)
+            return AsyncPaystackClient(http_client_fun=self.server.async_client_fun(), secret_key=secret_key)
+
+        reconciler = self.reconciler(merchant_client_fun=merchant_client_fun, merchants={"shop-a": "sk_test_shop_a"})
+        self.assertEqual(async_to_sync(reconciler.sweep)(), {"checked": 2, "updated": 2, "failed": 0})
+        self.assertEqual(secret_keys, ["sk_test_shop_a"])
+        self.assertEqual(Payment.objects.get(reference="ref-shop-a").status, "success")
+        self.assertIsNone(Payment.objects.get(reference="ref-shop-b").last_checked_at)
+
+        # Without a way to create their clients, only the default merchant's payments are looked up
+        self.now += timedelta(seconds=600)
+        Payment.objects.update(status="pending")
+        self.assertEqual(async_to_sync(self.reconciler().sweep)()["checked"], 1)
+
+    def test_one_sweep_runs_at_a_time(self):
+        self.create_payment("ref-paid", age=600)
+        # Another worker is sweeping
+        Lease.objects.create(name="payment_reconciliation", holder="other", expires_at=self.now + timedelta(seconds=60))
+        self.assertEqual(async_to_sync(self.reconciler().sweep)(), {"checked": 0, "updated": 0, "failed": 0})
+        self.assertIsNone(Payment.objects.get(reference="ref-paid").last_checked_at)
+
+        # Its lease expires, e.g. because the worker died
+        self.now += timedelta(seconds=61)
+        self.assertEqual(async_to_sync(self.reconciler().sweep)()["checked"], 1)
+        # And is released after the sweep
+        lease = Lease.objects.get(name="payment_reconciliation")
+        self.assertEqual(lease.holder, "")
+        self.assertLessEqual(lease.expires_at, self.now)
+
+    def test_lookups_are_rate_limited(self):
+        for i in range(4):
+            self.create_payment(f"mock-ref-{i}", age=600)
+
+        start = time.perf_counter()
+        async_to_sync(self.reconciler(concurrency=2, rate=20).sweep)()
+        # 2 lookups right away (the burst), then 2 more at 20 per second
+        self.assertGreaterEqual(time.perf_counter() - start, 0.09)
+
+
+class FastJSONTests(SimpleTestCase):
+    def test_renders_like_drf(self):
+        status_response, _ = transaction_status_response_parser.validate(verify_200_OK)
+        payloads = [
+            status_response,
+            {
+                "amount": Decimal("30.10"),
+                "paid_at": datetime(2025, 6, 6, 8, 27, 31, 123456, tzinfo=timezone.utc),
+                "created_at": datetime(2025, 6, 6, 11, 26, 51),
+                "date": datetime(2025, 6, 6).date(),
+                "message": "line\u2028separator \u00e9",
+                1: "non-string key",
+                "large": 2 ** 70,
+            },
+            [1, 2.5, None, True],
+        ]
+        for payload in payloads:
+            self.assertEqual(FastJSONRenderer().render(payload), JSONRenderer().render(payload))
+
+    def test_indented_output_falls_back(self):
+        data = {"status": True}
+        self.assertEqual(
+            FastJSONRenderer().render(data, "application/json; indent=4"),
+            JSONRenderer().render(data, "application/json; indent=4"))
+
+    def test_parses_like_drf(self):
+        for body in (b'{"amount": 30.5, "references": ["a", "b"]}', b'{"amount": 123456789012345678901234567890}'):
+            self.assertEqual(
+                FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+
+    def test_invalid_input_errors_like_drf(self):
+        for body in (b'{"amount": ', b'{"amount": NaN}', b''):
+            with self.assertRaises(DRFParseError) as expected:
+                JSONParser().parse(io.BytesIO(body))
+            with self.assertRaises(DRFParseError) as actual:
+                FastJSONParser().parse(io.BytesIO(body))
+            self.assertEqual(str(actual.exception), str(expected.exception))
+
+
+class CompressionTests(PaystackMockTestCase):
+    def test_negotiate_encoding(self):
+        encodings = ("br", "gzip")
+        self.assertEqual(negotiate_encoding("gzip, deflate, br", encodings), "br")
+        self.assertEqual(negotiate_encoding("br;q=0.5, gzip", encodings), "gzip")
+        self.assertEqual(negotiate_encoding("gzip", encodings), "gzip")
+        self.assertEqual(negotiate_encoding("*", encodings), "br")
+        self.assertEqual(negotiate_encoding("*, br;q=0", encodings), "gzip")
+        self.assertIsNone(negotiate_encoding("gzip;q=0", encodings))
+        self.assertIsNone(negotiate_encoding("identity", encodings))
+        self.assertIsNone(negotiate_encoding("", encodings))
+
+    def post_references(self, accept_encoding: str | None):
+        headers = {"Accept-Encoding": accept_encoding} if accept_encoding is not None else {}
+        return self.client.post(
+            bulk_payment_status_url,
+            data=json.dumps({"references": [f"mock-valid-payment-{i}" for i in range(10)]}),
+            content_type="application/json",
+            headers=headers)
+
+    def test_large_response_is_compressed(self):
+        response = self.post_references("gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(data["data"]), 10)
+
+    def test_response_is_not_compressed_unless_accepted(self):
+        response = self.post_references(None)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(len(response.json()["data"]), 10)
+
+    def test_small_response_is_not_compressed(self):
+        response = self.client.get(
+            reverse(payment_status_url_view_name, args=["mock-valid-payment-123"]), headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    @patch("api.schema.schema_cache", SchemaCache(artifact_path=None))
+    def test_precompressed_response_is_left_alone(self):
+        response = self.client.get(f"{reverse('api:schema')}?format=json", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertFalse(response["ETag"].startswith("W/"))
+        self.assertIn(b'"openapi"', gzip.decompress(response.content))
+
+    def test_stream_compressor(self):
+        chunks = [b'{"reference": "ref-%d"}\n' % i for i in range(100)]
+        compressed = list(StreamCompressor("gzip").compress_sequence(iter(chunks)))
+        # Every chunk is flushed, so it can be sent before the next one is ready
+        self.assertTrue(all(compressed[:-1]))
+        self.assertEqual(gzip.decompress(b"".join(compressed)), b"".join(chunks))
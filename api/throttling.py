@@ -0,0 +1,208 @@
+"""
+Per-client rate limiting.
+
+The API is unauthenticated, so clients are told apart by their IP address, or by their
+API key if they send one of the `RATE_LIMIT_API_KEYS` in an `X-API-Key` header.
+Each client gets a token bucket per scope (e.g. payment initialization), kept in process
+memory: a request takes a token (or one per item, for requests that act on several
+payments), and tokens are added back at a steady rate up to the burst size, so a check is a
+dictionary lookup and a little arithmetic under a lock. A request costing more tokens than
+the burst size is let through only when the bucket is full, and leaves it in debt.
+
+In memory, the limits apply per worker. With `RATE_LIMIT_CACHE_ALIAS` set to a shared
+cache (e.g. Redis), requests that the local bucket allows are also counted in that cache,
+so that the limits hold across all workers. As the cache API has no compare-and-set, the
+shared check is a sliding window counter built on atomic increments: it allows about
+`burst` requests per `burst / rate` seconds, which is the same average rate and burst
+as the token bucket.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from api.metrics import registry
+from restful_payment_gateway_api.settings import \
+    (RATE_LIMIT_ENABLED, RATE_LIMITS, RATE_LIMIT_MAX_CLIENTS, RATE_LIMIT_CACHE_ALIAS, RATE_LIMIT_API_KEYS)
+
+logger = logging.getLogger(__name__)
+
+API_KEY_HEADER = "X-API-Key"
+
+RATE_LIMITED = registry.counter(
+    "rate_limited_requests_total", "Requests rejected by the rate limits, by scope.", ["scope"])
+
+
+class RateLimiter:
+    def __init__(
+            self,
+            scope: str,
+            rate: float,
+            burst: int,
+            max_clients: int = RATE_LIMIT_MAX_CLIENTS,
+            cache_alias: str | None = RATE_LIMIT_CACHE_ALIAS,
+            clock: Callable[[], float] = time.monotonic,
+            wall_clock: Callable[[], float] = time.time
+    ):
+        """
+        Parameters:
+            scope: The name of the limit, used in cache keys and metrics.
+            rate: The number of tokens added back per second.
+            burst: The size of the bucket, i.e. how many requests a client can make at once.
+            max_clients: The maximum number of clients whose buckets are kept in memory.
+                The least recently seen clients are forgotten first.
+            cache_alias: The alias (in `CACHES`) of a cache shared by all workers,
+                or `None` to only limit requests per worker.
+            clock: The monotonic clock used for the local buckets.
+            wall_clock: The clock used for the shared windows, which must agree across workers.
+        """
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+        self._max_clients = max_clients
+        self._cache_alias = cache_alias
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._lock = threading.Lock()
+        # client key -> [tokens, time they were counted at]
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+        # The time it takes to refill an empty bucket, used as the shared window
+        self._window = burst / rate
+
+    @property
+    def shared_cache(self):
+        return caches[self._cache_alias] if self._cache_alias is not None else None
+
+    def acquire_local(self, key: str, cost: int = 1) -> float:
+        """
+        Takes `cost` tokens from the client's bucket. Returns 0 if there were enough, or else the seconds until
+        there are (with a full bucket for a cost over the burst size, which is then let through).
+        """
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                if len(self._buckets) > self._max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(bucket[0] + (now - bucket[1]) * self.rate, self.burst)
+                bucket[1] = now
+            needed = min(cost, self.burst)
+            if bucket[0] >= needed:
+                bucket[0] -= cost
+                return 0.0
+            return (needed - bucket[0]) / self.rate
+
+    async def acquire_shared(self, key: str, cost: int = 1) -> float:
+        """
+        Counts a request of the client costing `cost` tokens in the shared cache.
+        Returns 0 if it is allowed, or else the seconds to wait.
+        """
+        cache = self.shared_cache
+        now = self._wall_clock()
+        window = math.floor(now / self._window)
+        cache_key = f"ratelimit:{self.scope}:{key}"
+        try:
+            count, previous_count = await asyncio.gather(
+                self._aincr(cache, f"{cache_key}:{window}", cost), cache.aget(f"{cache_key}:{window - 1}", 0))
+        except Exception:
+            # Rather than rejecting every request while the cache is unavailable
+            logger.warning("Could not check the shared rate limit of %s", self.scope, exc_info=True)
+            return 0.0
+        # The previous window is weighted by how much of it the sliding window still covers
+        elapsed = now / self._window - window
+        weighted_count = previous_count * (1 - elapsed) + count
+        # A cost over the burst size is allowed if nothing else is counted
+        if weighted_count <= max(self.burst, cost):
+            return 0.0
+        return (weighted_count - max(self.burst, cost)) / self.rate
+
+    async def _aincr(self, cache, key: str, delta: int = 1) -> int:
+        try:
+            return await cache.aincr(key, delta)
+        except ValueError:
+            # The first request of the window. The count expires after the next window,
+            # in which it is still used as the previous one.
+            if await cache.aadd(key, delta, math.ceil(self._window * 2) + 1):
+                return delta
+            # Another worker added it first
+            return await cache.aincr(key, delta)
+
+    async def acquire(self, key: str, cost: int = 1) -> float:
+        wait = self.acquire_local(key, cost)
+        if wait == 0 and self._cache_alias is not None:
+            wait = await self.acquire_shared(key, cost)
+        if wait:
+            RATE_LIMITED.labels(self.scope).inc()
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+rate_limiters = {scope: RateLimiter(scope, rate, burst) for scope, (rate, burst) in RATE_LIMITS.items()}
+
+
+def client_key(request, ident: str) -> str:
+    """The key of the client making `request`: its API key if it sent a known one, or else its IP address (`ident`)."""
+    api_key = request.headers.get(API_KEY_HEADER)
+    if api_key and any(hmac.compare_digest(api_key.encode(), key.encode()) for key in RATE_LIMIT_API_KEYS):
+        # Keys are secrets, so only a digest of them is kept
+        return f"key:{hashlib.sha256(api_key.encode()).hexdigest()[:32]}"
+    return f"ip:{ident}"
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Limits requests per client with the `RateLimiter` of the view's `throttle_scope`.
+    A request costs one token, or what the view's `get_throttle_cost(request)` returns.
+    `AsyncGenericAPIView` awaits `aallow_request`, which also checks the shared cache;
+    synchronous views only check the local bucket.
+    """
+
+    def __init__(self):
+        self._wait = 0.0
+
+    @staticmethod
+    def get_limiter(view) -> RateLimiter | None:
+        if not RATE_LIMIT_ENABLED:
+            return None
+        return rate_limiters.get(getattr(view, "throttle_scope", None))
+
+    @staticmethod
+    def get_cost(request, view) -> int:
+        get_throttle_cost = getattr(view, "get_throttle_cost", None)
+        return max(get_throttle_cost(request), 1) if get_throttle_cost is not None else 1
+
+    def allow_request(self, request, view) -> bool:
+        limiter = self.get_limiter(view)
+        if limiter is None:
+            return True
+        self._wait = limiter.acquire_local(client_key(request, self.get_ident(request)), self.get_cost(request, view))
+        if self._wait:
+            RATE_LIMITED.labels(limiter.scope).inc()
+        return not self._wait
+
+    async def aallow_request(self, request, view) -> bool:
+        limiter = self.get_limiter(view)
+        if limiter is None:
+            return True
+        self._wait = await limiter.acquire(client_key(request, self.get_ident(request)), self.get_cost(request, view))
+        return not self._wait
+
+    def wait(self) -> float | None:
+        return self._wait or None
@@ -0,0 +1,320 @@
+"""
+Opt-in request tracing.
+
+When `TRACING_ENABLED` is set, a sampled fraction (`TRACING_SAMPLE_RATE`) of requests is
+traced: the request gets a root span, and the stages it goes through (input validation,
+each Paystack call, and rendering the response) get child spans. Spans are exported in
+the OpenTelemetry protocol's JSON encoding, one batch per line, to `TRACING_EXPORT_PATH`,
+which the OpenTelemetry Collector can read (e.g. with its `otlpjsonfile` receiver).
+
+Trace context is propagated with W3C `traceparent` headers: a request that comes with one
+continues its trace, and calls to Paystack send one. Since any client can send a header that
+asks for its request to be sampled, that is only followed for `TRACING_PARENT_SAMPLED_MAX_RATE`
+requests per second (per worker); further requests are sampled at `TRACING_SAMPLE_RATE`.
+The export file is rotated once it reaches `TRACING_EXPORT_MAX_BYTES`.
+The current span is kept in a context variable, so code that is not part of a sampled
+trace only pays for looking it up.
+"""
+import atexit
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from restful_payment_gateway_api.settings import \
+    (TRACING_ENABLED, TRACING_SAMPLE_RATE, TRACING_PARENT_SAMPLED_MAX_RATE, TRACING_EXPORT_PATH,
+     TRACING_EXPORT_MAX_BYTES, TRACING_SERVICE_NAME)
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+_TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+SERVER = "SPAN_KIND_SERVER"
+CLIENT = "SPAN_KIND_CLIENT"
+INTERNAL = "SPAN_KIND_INTERNAL"
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind",
+                 "start_time_ns", "end_time_ns", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_span_id: str | None, name: str, kind: str, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = 0
+        self.attributes = attributes
+        self.error: str | None = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        """The span in the OpenTelemetry protocol's JSON encoding."""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": "STATUS_CODE_UNSET"} if self.error is None
+            else {"code": "STATUS_CODE_ERROR", "message": self.error},
+        }
+        if self.parent_span_id is not None:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed_value = {"boolValue": value}
+    elif isinstance(value, int):
+        # 64-bit integers are strings in the JSON encoding
+        typed_value = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed_value = {"doubleValue": value}
+    else:
+        typed_value = {"stringValue": str(value)}
+    return {"key": key, "value": typed_value}
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str, bool] | None:
+    """The trace id, parent span id and sampled flag of a `traceparent` header, or `None` if it is invalid."""
+    if not header:
+        return None
+    match = _TRACEPARENT_PATTERN.match(header.strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class _SpanScope:
+    """Makes a span the current span for the duration of a `with` block, and ends and exports it after."""
+    __slots__ = ("_tracer", "_span", "_token")
+
+    def __init__(self, tracer: "Tracer", span: Span | None):
+        self._tracer = tracer
+        self._span = span
+        self._token = None
+
+    def __enter__(self) -> Span | None:
+        if self._span is not None:
+            self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        span = self._span
+        if span is None:
+            return
+        _current_span.reset(self._token)
+        span.end_time_ns = time.time_ns()
+        if exc_type is not None and span.error is None:
+            span.error = f"{exc_type.__name__}: {exc_value}"
+        self._tracer.exporter.export(span)
+
+
+_NOT_TRACED = _SpanScope(None, None)
+
+
+class Tracer:
+    def __init__(
+            self,
+            enabled: bool = TRACING_ENABLED,
+            sample_rate: float = TRACING_SAMPLE_RATE,
+            parent_sampled_max_rate: float = TRACING_PARENT_SAMPLED_MAX_RATE,
+            exporter=None,
+            clock=time.monotonic
+    ):
+        """
+        Parameters:
+            enabled: Whether requests are traced at all.
+            sample_rate: The fraction of requests that are traced, unless a `traceparent` header decides it.
+            parent_sampled_max_rate: The number of requests per second that are traced because their
+                `traceparent` header asks for it. Further requests are sampled at `sample_rate`.
+            exporter: What spans are exported with (an object with an `export(span)` method).
+                Defaults to a `FileSpanExporter` writing to `TRACING_EXPORT_PATH`, created on first use.
+        """
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self._parent_sampled_max_rate = parent_sampled_max_rate
+        self._exporter = exporter
+        self._clock = clock
+        self._lock = threading.Lock()
+        # A token bucket of parent-sampled requests, holding up to a second's worth (and at least one)
+        self._parent_sampled_capacity = max(parent_sampled_max_rate, 1) if parent_sampled_max_rate > 0 else 0
+        self._parent_sampled_tokens = self._parent_sampled_capacity
+        self._parent_sampled_updated_at = clock()
+
+    @property
+    def exporter(self):
+        if self._exporter is None:
+            with self._lock:
+                if self._exporter is None:
+                    self._exporter = FileSpanExporter(TRACING_EXPORT_PATH)
+        return self._exporter
+
+    @exporter.setter
+    def exporter(self, exporter):
+        self._exporter = exporter
+
+    def start_request_span(self, name: str, traceparent: str | None, attributes: dict) -> _SpanScope:
+        """
+        Starts the root span of a request, if the request is sampled: with the sampling decision
+        of its `traceparent` header (within `parent_sampled_max_rate`), or else at `sample_rate`.
+        """
+        if not self.enabled:
+            return _NOT_TRACED
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_span_id, sampled = parent
+            if sampled and not self._take_parent_sampled():
+                sampled = random.random() < self.sample_rate
+        else:
+            trace_id, parent_span_id = None, None
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            return _NOT_TRACED
+        if trace_id is None:
+            trace_id = f"{random.getrandbits(128):032x}"
+        return _SpanScope(self, Span(trace_id, parent_span_id, name, SERVER, attributes))
+
+    def _take_parent_sampled(self) -> bool:
+        """Whether another request may be traced because its `traceparent` header asks for it."""
+        with self._lock:
+            now = self._clock()
+            self._parent_sampled_tokens = min(
+                self._parent_sampled_tokens + (now - self._parent_sampled_updated_at) * self._parent_sampled_max_rate,
+                self._parent_sampled_capacity)
+            self._parent_sampled_updated_at = now
+            if self._parent_sampled_tokens < 1:
+                return False
+            self._parent_sampled_tokens -= 1
+            return True
+
+    def start_span(self, name: str, kind: str = INTERNAL, attributes: dict | None = None) -> _SpanScope:
+        """Starts a child span of the current span. Nothing is traced if there is no current span."""
+        parent = _current_span.get()
+        if parent is None:
+            return _NOT_TRACED
+        return _SpanScope(self, Span(parent.trace_id, parent.span_id, name, kind, attributes or {}))
+
+
+class InMemorySpanExporter:
+    """Keeps exported spans in a list (e.g. for tests)."""
+
+    def __init__(self):
+        self.spans: list[Span] = []
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+
+class FileSpanExporter:
+    """
+    Appends spans to a file, in batches written by a background thread so that requests
+    never wait for the disk. Each line is an OTLP/JSON `ExportTraceServiceRequest`.
+    At most `max_queue_size` spans wait to be written; further spans are dropped.
+    Once the file reaches `max_bytes`, it is renamed to `<path>.1` (replacing the previous one)
+    and a new file is started, so that at most about twice `max_bytes` is kept on disk.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            flush_interval: float = 1.0,
+            max_queue_size: int = 10000,
+            max_bytes: int = TRACING_EXPORT_MAX_BYTES,
+            service_name: str = TRACING_SERVICE_NAME
+    ):
+        self.path = path
+        self._max_bytes = max_bytes
+        self._flush_interval = flush_interval
+        self._max_queue_size = max_queue_size
+        self._service_name = service_name
+        # Appending to and popping from a deque is thread-safe
+        self._queue: deque[Span] = deque()
+        self.dropped = 0
+        self._write_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def export(self, span: Span):
+        if len(self._queue) >= self._max_queue_size:
+            self.dropped += 1
+            return
+        self._queue.append(span)
+
+    def flush(self) -> int:
+        """Writes the queued spans, returning how many were written."""
+        with self._write_lock:
+            spans = []
+            while self._queue:
+                spans.append(self._queue.popleft())
+            if not spans:
+                return 0
+            request = {"resourceSpans": [{
+                "resource": {"attributes": [
+                    _otlp_attribute("service.name", self._service_name),
+                    _otlp_attribute("process.pid", os.getpid()),
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }]}
+            self._rotate()
+            with open(self.path, "a") as file:
+                file.write(json.dumps(request, separators=(",", ":")) + "\n")
+            return len(spans)
+
+    def _rotate(self):
+        try:
+            if os.path.getsize(self.path) < self._max_bytes:
+                return
+            os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            # Not written yet, or just rotated by another worker
+            pass
+
+    def _run(self):
+        while not self._stopped.wait(self._flush_interval):
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Could not export spans to %s", self.path)
+
+    def stop(self):
+        atexit.unregister(self.stop)
+        self._stopped.set()
+        self._thread.join(timeout=self._flush_interval + 1)
+        try:
+            self.flush()
+        except OSError:
+            logger.exception("Could not export spans to %s", self.path)
+
+
+tracer = Tracer()
@@ -1,13 +1,18 @@
 from django.urls import path
 from api import views
-from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from api.schema import cached_view, schema_view
 
 app_name = "api"
 
 urlpatterns = [
     path("v1/payments/", views.InitPaymentView.as_view(), name="initialize_payment"),
+    path("v1/payments/batch/", views.BatchInitPaymentView.as_view(), name="initialize_payments_batch"),
+    path("v1/payments/statuses/", views.BulkPaymentStatusView.as_view(), name="get_payment_statuses"),
+    path("v1/payments/export/", views.ExportPaymentsView.as_view(), name="export_payments"),
     path("v1/payments/<str:payment_id>/", views.GetPaymentStatusView.as_view(), name="get_payment_status"),
-    path("v1/schema/", SpectacularAPIView.as_view(), name="schema"),
-    path("v1/schema/swagger-ui/", SpectacularSwaggerView.as_view(url_name="api:schema"), name="swagger-ui"),
-    path("v1/schema/redoc/", SpectacularRedocView.as_view(url_name="api:schema"), name="redoc"),
+    path("v1/health/paystack/", views.PaystackHealthView.as_view(), name="paystack_health"),
+    path("v1/webhooks/paystack/", views.PaystackWebhookView.as_view(), name="paystack_webhook"),
+    path("v1/schema/", schema_view, name="schema"),
+    path("v1/schema/swagger-ui/", cached_view("drf_spectacular.views.SpectacularSwaggerView", url_name="api:schema"), name="swagger-ui"),
+    path("v1/schema/redoc/", cached_view("drf_spectacular.views.SpectacularRedocView", url_name="api:schema"), name="redoc"),
 ]
\ No newline at end of file
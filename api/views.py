@@ -1,49 +1,567 @@
-from drf_spectacular.utils import extend_schema
-from rest_framework import status, generics
+import hashlib
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework import status
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from api.paystack.paystack_client import PaystackClient, PaystackClientException
-from api.paystack.paystack_serializers import PaystackTransactionStatusResponseSerializer
-from api.serializers import PaymentInfoSerializer, PaystackTransactionInitResponseSerializer
+from api.async_api_view import AsyncGenericAPIView
+from api.export import EXPORT_FORMATS, aiter_export, get_export_queryset
+from api.fan_out import gather_with_concurrency
+from api.flutterwave.flutterwave_client import AsyncFlutterwaveClient
+from api.idempotency import IDEMPOTENCY_KEY_HEADER, IDEMPOTENCY_KEY_MAX_LENGTH, IdempotencyConflict, \
+    IdempotencyStore, fingerprint
+from api.ledger import PaymentLedger
+from api.metrics import collect, registry, snapshot_writer
+from api.models import Payment
+from api.paystack.client_pool import PaystackClientPool, UnknownMerchant, select_merchant
+from api.paystack.paystack_client import AsyncPaystackClient
+from api.paystack.paystack_parsers import transaction_status_response_parser, webhook_event_parser
+from api.paystack.resilience import OPEN, retry_after_header
+from api.paystack.paystack_serializers import PaystackTransactionStatusResponseSerializer, \
+    PaystackWebhookEventSerializer
+from api.paystack.status_cache import TERMINAL_STATUSES, PaymentStatusCache
+from api.paystack.webhooks import PAYMENT_STATUS_EVENTS, is_valid_signature
+from api.permissions import HasExportToken, has_bearer_token
+from api.providers import PaymentProvider, PaymentProviderException, ProviderRegistry, ProviderRouter
+from api.reconciliation import PaymentReconciler
+from api.schema import extend_schema
+from api.serializers import PaymentInfo, PaymentInfoSerializer, PaystackTransactionInitResponseSerializer, \
+    BatchPaymentInfoSerializer, BatchResponseSerializer, BulkPaymentStatusRequestSerializer, \
+    BulkPaymentStatusResponseSerializer, PaymentExportQuerySerializer, PaystackHealthResponseSerializer, \
+    payment_info_parser
+from api.throttling import TokenBucketThrottle
+from restful_payment_gateway_api.settings import PAYMENTS_BATCH_CONCURRENCY, PAYMENTS_BULK_STATUS_CONCURRENCY, \
+    PAYMENTS_REQUEST_DEADLINE, METRICS_TOKEN, PAYSTACK_MERCHANTS, PAYSTACK_MERCHANT_STATUS_CACHE_MAX_ENTRIES, \
+    PAYMENT_PROVIDERS
+
+logger = logging.getLogger(__name__)
+
+# The client of the default merchant (`PAYSTACK_TEST_SECRET_KEY`)
+paystack_client = AsyncPaystackClient(status_cache=PaymentStatusCache())
+
+def create_merchant_client(secret_key: str) -> AsyncPaystackClient:
+    """
+    Creates the client of a merchant other than the default one. All clients call the same
+    Paystack API, so they share the guards, retry budget and hedge policy of the default client.
+    """
+    merchant_key = hashlib.sha256(secret_key.encode()).hexdigest()[:16]
+    return AsyncPaystackClient(
+        secret_key=secret_key,
+        status_cache=PaymentStatusCache(
+            max_entries=PAYSTACK_MERCHANT_STATUS_CACHE_MAX_ENTRIES, key_prefix=f"paystack:status:{merchant_key}"),
+        guards=paystack_client.guards,
+        retry_policy=paystack_client.retry_policy,
+        hedge_policy=paystack_client.hedge_policy)
+
+merchant_clients = PaystackClientPool(create_merchant_client)
+
+# Providers other than Paystack, whose client depends on the merchant
+payment_providers = ProviderRegistry()
+payment_providers.register(
+    AsyncFlutterwaveClient.name,
+    lambda: AsyncFlutterwaveClient(status_cache=PaymentStatusCache(key_prefix="flutterwave:status")),
+    AsyncFlutterwaveClient.reference_prefix)
+provider_router = ProviderRouter()
+
+if not PAYMENT_PROVIDERS or any(
+        name != AsyncPaystackClient.name and name not in payment_providers for name in PAYMENT_PROVIDERS):
+    raise ImproperlyConfigured(f"PAYMENT_PROVIDERS must be one or more of paystack, flutterwave: {PAYMENT_PROVIDERS}")
+payment_ledger = PaymentLedger()
+idempotency_store = IdempotencyStore()
+
+# The reconciliation sweeper runs in an event loop of its own, so it has clients of its own, which share
+# the guards, retry budget, hedge policy and status cache of the clients requests use
+reconciliation_providers = ProviderRegistry()
+reconciliation_providers.register(AsyncPaystackClient.name, lambda: AsyncPaystackClient(
+    status_cache=paystack_client.status_cache,
+    guards=paystack_client.guards,
+    retry_policy=paystack_client.retry_policy,
+    hedge_policy=paystack_client.hedge_policy))
+reconciliation_providers.register(AsyncFlutterwaveClient.name, lambda: AsyncFlutterwaveClient(
+    status_cache=payment_providers.get(AsyncFlutterwaveClient.name).status_cache,
+    guards=payment_providers.get(AsyncFlutterwaveClient.name).guards), AsyncFlutterwaveClient.reference_prefix)
+# Started by the server entry points (`asgi.py` and `wsgi.py`) if `PAYMENT_RECONCILIATION_ENABLED`,
+# so that management commands importing this module do not sweep in the background
+payment_reconciler = PaymentReconciler(
+    reconciliation_providers, AsyncPaystackClient.name, merchant_client_fun=create_merchant_client)
+
+if snapshot_writer is not None:
+    snapshot_writer.start()
+
+# Gauges of the objects above, computed when the metrics are collected
+registry.gauge(
+    "paystack_pool_connections", "Pooled connections to Paystack, by state (open or idle).", ["state"],
+    lambda: {(state,): count for state, count in (paystack_client.pool_stats() or {}).items()})
+registry.gauge(
+    "paystack_concurrency_limit", "Current limit of concurrent Paystack calls, by endpoint.", ["endpoint"],
+    lambda: {(endpoint,): guard.limiter.limit for endpoint, guard in paystack_client.guards.items()})
+registry.gauge(
+    "paystack_in_flight", "Paystack calls in flight, by endpoint.", ["endpoint"],
+    lambda: {(endpoint,): guard.limiter.in_flight for endpoint, guard in paystack_client.guards.items()})
+registry.gauge(
+    "paystack_circuit_open", "Whether the circuit breaker of a Paystack endpoint is open (1) or not (0).", ["endpoint"],
+    lambda: {(endpoint,): int(guard.breaker.state == OPEN) for endpoint, guard in paystack_client.guards.items()})
+registry.gauge(
+    "paystack_hedge_delay_seconds", "The delay after which Paystack status lookups are hedged.", (),
+    lambda: {(): paystack_client.hedge_policy.delay()} if paystack_client.hedge_policy.delay() is not None else {})
+registry.gauge(
+    "payment_status_cache_entries", "Payment statuses cached in process memory.", (),
+    lambda: {(): len(paystack_client.status_cache)} if paystack_client.status_cache is not None else {})
+registry.gauge(
+    "paystack_merchant_clients", "Open Paystack clients of merchants other than the default one.", (),
+    lambda: {(): len(merchant_clients)})
+registry.gauge(
+    "payment_provider_latency_seconds", "Moving average of the latency of payment provider calls, by provider.",
+    ["provider"], lambda: {(name,): stats["latency"] for name, stats in provider_router.snapshot().items()})
+registry.gauge(
+    "payment_provider_error_rate", "Moving average of the error rate of payment provider calls, by provider.",
+    ["provider"], lambda: {(name,): stats["error_rate"] for name, stats in provider_router.snapshot().items()})
+registry.gauge(
+    "payment_ledger_pending", "Payment changes waiting to be written to the database.", (),
+    lambda: {(): payment_ledger.pending})
+
+def paystack_response(data: dict | str, status_code: int) -> Response:
+    """A response with the result of a Paystack call, telling clients when to retry if Paystack is unavailable."""
+    response = Response(data, status=status_code)
+    if status_code == status.HTTP_503_SERVICE_UNAVAILABLE and isinstance(data, dict):
+        retry_after = (data.get("data") or {}).get("retry_after")
+        if retry_after is not None:
+            response["Retry-After"] = retry_after_header(retry_after)
+    return response
+
+@asynccontextmanager
+async def merchant_client(merchant: tuple[str, str] | None) -> AsyncIterator[AsyncPaystackClient]:
+    """
+    The client of a merchant (an id and secret key, or `None` for the default merchant),
+    for the duration of an `async with` block.
+    """
+    if merchant is None:
+        yield paystack_client
+        return
+    async with merchant_clients.use(merchant[1]) as client:
+        yield client
+
+def merchant_id(merchant: tuple[str, str] | None) -> str:
+    """The id a merchant's payments are recorded with, "" for the default merchant."""
+    return merchant[0] if merchant is not None else ""
+
+def _recorded_transactions(merchant: str, references: list[str]) -> list[tuple[str, dict]]:
+    return list(Payment.objects.filter(
+        reference__in=references,
+        merchant=merchant,
+        status__in=TERMINAL_STATUSES,
+        transaction_data__isnull=False).values_list("reference", "transaction_data"))
+
+async def recorded_payment_statuses(merchant: tuple[str, str] | None, references: list[str]) -> dict[str, dict]:
+    """
+    The statuses of the payments of a merchant among `references` that are recorded in a terminal state,
+    by reference, as verify responses. A settled payment cannot change, so its provider need not be asked.
+    """
+    if not references:
+        return {}
+    statuses = {}
+    for reference, transaction_data in await sync_to_async(_recorded_transactions)(merchant_id(merchant), references):
+        # The recorded data is JSON, which the parser turns back into amounts and datetimes
+        data, errors = transaction_status_response_parser.validate(
+            {"status": True, "message": "Verification successful", "data": transaction_data})
+        if errors is None:
+            statuses[reference] = data
+    return statuses
+
+async def local_payment_status(
+        merchant: tuple[str, str] | None, provider: PaymentProvider, payment_id: str) -> dict | None:
+    """
+    The status of a payment if it is known locally: cached by its provider, or recorded in a terminal state
+    (which is then cached, so that the next lookup does not query the database). `None` otherwise.
+    """
+    if provider.status_cache is not None:
+        data = await provider.status_cache.aget(payment_id)
+        if data is not None:
+            return data
+    data = (await recorded_payment_statuses(merchant, [payment_id])).get(payment_id)
+    if data is not None and provider.status_cache is not None:
+        await provider.status_cache.aset(payment_id, data)
+    return data
+
+class PaystackAPIView(AsyncGenericAPIView):
+    """A view calling Paystack as the merchant the request selects (see `select_merchant`)."""
 
-paystack_client = PaystackClient()
+    def handle_exception(self, exc):
+        if isinstance(exc, UnknownMerchant):
+            return Response({"status": False, "message": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return super().handle_exception(exc)
+
+def request_list_length(request: Request, field: str) -> int:
+    """The length of the list in `field` of the request body, or 1 if there is none (the body is then rejected)."""
+    data = request.data
+    items = data.get(field) if isinstance(data, dict) else None
+    return len(items) if isinstance(items, list) else 1
+
+def init_payment_providers(merchant: tuple[str, str] | None, client: AsyncPaystackClient) -> list[PaymentProvider]:
+    """
+    The providers that payments of a merchant (whose Paystack client is `client`) can be initialized with:
+    `PAYMENT_PROVIDERS` for the default merchant, and Paystack for others.
+    """
+    if merchant is not None:
+        return [client]
+    return [client if name == AsyncPaystackClient.name else payment_providers.get(name) for name in PAYMENT_PROVIDERS]
+
+def payment_provider(merchant: tuple[str, str] | None, client: AsyncPaystackClient, reference: str) -> PaymentProvider:
+    """The provider of the payment with `reference`, told by the prefix of the reference."""
+    name = payment_providers.name_for_reference(reference) if merchant is None else None
+    return client if name is None else payment_providers.get(name)
+
+async def initialize_payment(
+        merchant: tuple[str, str] | None,
+        providers: list[PaymentProvider],
+        payment_info: PaymentInfo) -> tuple[dict | str, int]:
+    """
+    Initializes a payment of a merchant with the best of `providers` (see `ProviderRouter`)
+    and records it in the payment ledger. Returns the response data and status code.
+    """
+    try:
+        data = await provider_router.call(providers, lambda provider: provider.init_payment(
+            email=payment_info.customer_email,
+            amount=payment_info.amount))
+    except PaymentProviderException as e:
+        if e.data is not None:
+            return e.data, e.status_code
+        else:
+            return "Unknown error", e.status_code
+
+    payment_ledger.record_initialized(
+        reference=data["data"]["reference"],
+        customer_name=payment_info.customer_name,
+        customer_email=payment_info.customer_email,
+        amount=payment_info.amount,
+        merchant=merchant_id(merchant))
+
+    return data, status.HTTP_200_OK
 
 @extend_schema(
     request = PaymentInfoSerializer,
-    responses = PaystackTransactionInitResponseSerializer)
-class InitPaymentView(generics.GenericAPIView):
-    def post(self, request: Request):
-        """Initialize payment given the request data"""
+    responses = PaystackTransactionInitResponseSerializer,
+    parameters = [
+        {
+            "name": IDEMPOTENCY_KEY_HEADER, "type": str, "location": "header",
+            "description": "A unique key for the payment. Retries with the same key get the original "
+                           "response (with an `Idempotent-Replayed: true` header) instead of a new payment."
+        }
+    ])
+class InitPaymentView(PaystackAPIView):
+    request_deadline = PAYMENTS_REQUEST_DEADLINE
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = "init_payment"
+
+    async def post(self, request: Request):
+        """
+        Initialize payment given the request data.
+        Requests with an `Idempotency-Key` header are only initialized once per key.
+        """
         # Validate request body data
-        request_serializer = PaymentInfoSerializer(data=request.data)
+        validated_data, errors = payment_info_parser.validate(request.data)
+        if errors is not None:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        payment_info = PaymentInfo(**validated_data)
+
+        idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        merchant = select_merchant(request)
+        if idempotency_key is None:
+            async with merchant_client(merchant) as client:
+                data, status_code = await initialize_payment(
+                    merchant, init_payment_providers(merchant, client), payment_info)
+            return paystack_response(data, status_code)
+
+        if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return Response(
+                {"status": False, "message": f"{IDEMPOTENCY_KEY_HEADER} must be 1 to "
+                                             f"{IDEMPOTENCY_KEY_MAX_LENGTH} characters long"},
+                status=status.HTTP_400_BAD_REQUEST)
+        if merchant is not None:
+            # Merchants may use the same keys
+            idempotency_key = f"{merchant[0]}:{idempotency_key}"
+        async with merchant_client(merchant) as client:
+            try:
+                data, status_code, replayed = await idempotency_store.run(
+                    idempotency_key, fingerprint(validated_data),
+                    lambda: initialize_payment(merchant, init_payment_providers(merchant, client), payment_info))
+            except IdempotencyConflict as e:
+                return Response({"status": False, "message": e.message}, status=e.status_code)
+        response = paystack_response(data, status_code)
+        if replayed:
+            response["Idempotent-Replayed"] = "true"
+        return response
+
+@extend_schema(
+    request = BatchPaymentInfoSerializer,
+    responses = BatchResponseSerializer)
+class BatchInitPaymentView(PaystackAPIView):
+    request_deadline = PAYMENTS_REQUEST_DEADLINE
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = "init_payment"
+
+    def get_throttle_cost(self, request: Request) -> int:
+        """Each payment of the batch takes a token of the client's rate limit."""
+        return request_list_length(request, "payments")
+
+    async def post(self, request: Request):
+        """
+        Initialize several payments at once.
+        Each payment is validated and initialized separately, so some may fail while others succeed.
+        The result of each payment is returned in the order of the request, with its own status code.
+        """
+        request_serializer = BatchPaymentInfoSerializer(data=request.data)
         if not request_serializer.is_valid():
             return Response(request_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        payment_info = request_serializer.to_data_class()
-        try:
-            data = paystack_client.init_payment(
-                email=payment_info.customer_email,
-                amount=int(payment_info.amount * 100))
-        except PaystackClientException as e:
-            if e.data is not None:
-                return Response(e.data, status=e.status_code)
+
+        results: list[dict | None] = []
+        payments: list[tuple[int, PaymentInfo]] = []
+        for index, item in enumerate(request_serializer.validated_data["payments"]):
+            validated_data, errors = payment_info_parser.validate(item)
+            if errors is None:
+                results.append(None)
+                payments.append((index, PaymentInfo(**validated_data)))
             else:
-                return Response("Unknown error", status=e.status_code)
+                results.append({
+                    "index": index,
+                    "status_code": status.HTTP_400_BAD_REQUEST,
+                    "data": errors
+                })
+
+        merchant = select_merchant(request)
+        async with merchant_client(merchant) as client:
+            providers = init_payment_providers(merchant, client)
+            initialized = await gather_with_concurrency(
+                PAYMENTS_BATCH_CONCURRENCY,
+                (initialize_payment(merchant, providers, payment_info) for _, payment_info in payments))
+        for (index, _), (data, status_code) in zip(payments, initialized):
+            results[index] = {"index": index, "status_code": status_code, "data": data}
+
+        succeeded = sum(1 for result in results if result["status_code"] == status.HTTP_200_OK)
+        return Response({
+            "status": succeeded > 0,
+            "message": f"{succeeded} of {len(results)} payments initialized",
+            "data": results
+        }, status=status.HTTP_200_OK)
 
-        return Response(data, status=status.HTTP_200_OK)
+async def get_payment_status(provider: PaymentProvider, payment_id: str) -> tuple[dict | str, int]:
+    """
+    Gets the status of a payment from its provider and records it in the payment ledger.
+    Returns the response data and status code.
+    """
+    try:
+        data = await provider.get_payment_status(payment_id)
+    except PaymentProviderException as e:
+        if e.data is not None:
+            return e.data, e.status_code
+        else:
+            return "Unknown error", e.status_code
+
+    payment_ledger.record_status(
+        reference=data["data"]["reference"],
+        status=data["data"]["status"],
+        paid_at=data["data"]["paid_at"],
+        transaction_data=data["data"])
+
+    return data, status.HTTP_200_OK
 
 @extend_schema(
     responses = PaystackTransactionStatusResponseSerializer
 )
-class GetPaymentStatusView(generics.GenericAPIView):
-    def get(self, request: Request, payment_id: str):
-        """Handle POST request for payment status"""
+class GetPaymentStatusView(PaystackAPIView):
+    request_deadline = PAYMENTS_REQUEST_DEADLINE
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = "payment_status"
+
+    async def get(self, request: Request, payment_id: str):
+        """
+        Handle POST request for payment status.
+        Payments that are cached or settled locally are answered without calling their provider.
+        """
+        merchant = select_merchant(request)
+        async with merchant_client(merchant) as client:
+            provider = payment_provider(merchant, client, payment_id)
+            data = await local_payment_status(merchant, provider, payment_id)
+            if data is not None:
+                return paystack_response(data, status.HTTP_200_OK)
+            data, status_code = await get_payment_status(provider, payment_id)
+        return paystack_response(data, status_code)
+
+@extend_schema(
+    request = BulkPaymentStatusRequestSerializer,
+    responses = BulkPaymentStatusResponseSerializer
+)
+class BulkPaymentStatusView(PaystackAPIView):
+    request_deadline = PAYMENTS_REQUEST_DEADLINE
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = "payment_status"
+
+    def get_throttle_cost(self, request: Request) -> int:
+        """Each reference takes a token of the client's rate limit."""
+        return request_list_length(request, "references")
+
+    async def post(self, request: Request):
+        """
+        Get the status of several payments at once.
+        Statuses that are cached, or of payments recorded as settled, are answered locally first, and the
+        rest are looked up on Paystack concurrently. Each reference gets its own result and status code.
+        """
+        request_serializer = BulkPaymentStatusRequestSerializer(data=request.data)
+        if not request_serializer.is_valid():
+            return Response(request_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        references = list(dict.fromkeys(request_serializer.validated_data["references"]))
+        results: dict[str, dict] = {}
+        merchant = select_merchant(request)
+        async with merchant_client(merchant) as client:
+            providers = {reference: payment_provider(merchant, client, reference) for reference in references}
+            for reference, provider in providers.items():
+                if provider.status_cache is not None:
+                    data = await provider.status_cache.aget(reference)
+                    if data is not None:
+                        results[reference] = {
+                            "reference": reference, "status_code": status.HTTP_200_OK, "data": data["data"]}
+
+            # Payments settled in the database are found with one query, and cached for the next lookups
+            remaining = [reference for reference in references if reference not in results]
+            for reference, data in (await recorded_payment_statuses(merchant, remaining)).items():
+                if providers[reference].status_cache is not None:
+                    await providers[reference].status_cache.aset(reference, data)
+                results[reference] = {"reference": reference, "status_code": status.HTTP_200_OK, "data": data["data"]}
+
+            remaining = [reference for reference in references if reference not in results]
+            fetched = await gather_with_concurrency(
+                PAYMENTS_BULK_STATUS_CONCURRENCY,
+                (get_payment_status(providers[reference], reference) for reference in remaining))
+        for reference, (data, status_code) in zip(remaining, fetched):
+            if status_code == status.HTTP_200_OK:
+                data = data["data"]
+            results[reference] = {"reference": reference, "status_code": status_code, "data": data}
+
+        found = sum(1 for result in results.values() if result["status_code"] == status.HTTP_200_OK)
+        return Response({
+            "status": found > 0,
+            "message": f"{found} of {len(references)} payment statuses retrieved",
+            "data": [results[reference] for reference in references]
+        }, status=status.HTTP_200_OK)
+
+@extend_schema(
+    parameters = [PaymentExportQuerySerializer],
+    responses = {(200, "application/x-ndjson"): str, (200, "text/csv"): str}
+)
+class ExportPaymentsView(AsyncGenericAPIView):
+    permission_classes = (HasExportToken,)
+
+    async def get(self, request: Request):
+        """
+        Export recorded payments as NDJSON or CSV, optionally filtered by status and initiation time.
+        The export is streamed in chunks, so it can be arbitrarily large.
+        """
+        query_serializer = PaymentExportQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        query = dict(query_serializer.validated_data)
+        export_format = EXPORT_FORMATS[query.pop("file_format")]
+
+        response = StreamingHttpResponse(
+            aiter_export(get_export_queryset(**query), export_format),
+            content_type=export_format.content_type)
+        response["Content-Disposition"] = f'attachment; filename="payments.{export_format.extension}"'
+        return response
+
+
+@extend_schema(
+    responses = PaystackHealthResponseSerializer
+)
+class PaystackHealthView(AsyncGenericAPIView):
+    async def get(self, request: Request):
+        """
+        The state of the circuit breaker and concurrency limit guarding each Paystack endpoint
+        in this worker. While a circuit is open, calls to that endpoint fail fast with a 503.
+        """
+        guards = paystack_client.guard_snapshot()
+        available = all(guard["circuit"]["state"] != OPEN for guard in guards.values())
+        return Response({
+            "status": available,
+            "message": "Paystack is available" if available else "Paystack is (partly) unavailable",
+            "data": guards
+        }, status=status.HTTP_200_OK)
+
+@extend_schema(
+    request = PaystackWebhookEventSerializer,
+    responses = {200: None}
+)
+class PaystackWebhookView(PaystackAPIView):
+    async def post(self, request: Request):
+        """
+        Handle Paystack webhook events.
+        The status of `charge.success` and `charge.failed` events is recorded locally,
+        so that later status lookups of the payment need not call Paystack.
+        Events of a merchant other than the default one are sent with its id in the `merchant` query parameter.
+        """
+        merchant_id = request.query_params.get("merchant")
+        merchant = None
+        if merchant_id:
+            if merchant_id not in PAYSTACK_MERCHANTS:
+                raise UnknownMerchant(merchant_id)
+            merchant = merchant_id, PAYSTACK_MERCHANTS[merchant_id]
+        secret_key = merchant[1] if merchant is not None else paystack_client.secret_key
+
+        # The signature is computed over the raw body, so it is checked before parsing
+        body = request.body
+        if not is_valid_signature(body, request.headers.get("X-Paystack-Signature"), secret_key):
+            return Response(
+                {"status": False, "message": "Invalid signature"},
+                status=status.HTTP_401_UNAUTHORIZED)
+
         try:
-            data = paystack_client.get_payment_status(payment_id)
-        except PaystackClientException as e:
-            if e.data is not None:
-                return Response(e.data, status=e.status_code)
+            event = json.loads(body)
+        except ValueError:
+            return Response(
+                {"status": False, "message": "Invalid JSON body"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        if isinstance(event, dict) and event.get("event") in PAYMENT_STATUS_EVENTS:
+            validated_data, errors = webhook_event_parser.validate(event)
+            if errors is None:
+                async with merchant_client(merchant) as client:
+                    await apply_payment_status_event(client, validated_data["data"])
             else:
-                return Response("Unknown error", status=e.status_code)
+                # Paystack retries events that are not acknowledged, which would not help here
+                logger.warning("Ignoring invalid %s webhook event: %s", event["event"], errors)
+
+        return Response({"status": True, "message": "Webhook received"}, status=status.HTTP_200_OK)
+
+
+async def apply_payment_status_event(client: AsyncPaystackClient, transaction: dict):
+    """
+    Records the transaction status from a webhook event.
+    The database write is deferred to the payment ledger, and the status cache is primed
+    with a verify-shaped response, so the write does not delay the acknowledgement.
+    """
+    payment_ledger.record_status(
+        reference=transaction["reference"],
+        status=transaction["status"],
+        paid_at=transaction["paid_at"],
+        transaction_data=transaction)
+
+    if client.status_cache is not None:
+        await client.status_cache.aset(transaction["reference"], {
+            "status": True,
+            "message": "Verification successful",
+            "data": transaction,
+        })
+
 
-        return Response(data, status=status.HTTP_200_OK)
+def metrics(request):
+    """Metrics in the Prometheus text format (of all workers, if `METRICS_DIR` is set)."""
+    if METRICS_TOKEN and not has_bearer_token(request, METRICS_TOKEN):
+        return HttpResponse("A valid metrics token is required.", status=401, content_type="text/plain")
+    return HttpResponse(collect(), content_type="text/plain; version=0.0.4; charset=utf-8")
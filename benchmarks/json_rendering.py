@@ -0,0 +1,165 @@
+"""
+Measures the CPU time of JSON rendering, parsing and response compression, with DRF's
+stdlib-json classes and with the orjson-based ones in `api/fast_json.py`.
+
+The first part times each step on its own: rendering a validated payment status response
+and bulk status responses, parsing bulk status requests, and compressing the bulk responses.
+The second measures the CPU time per request of POST /api/v1/payments/statuses/, served
+in-process by the ASGI application (including the HTTP client's share, which does not
+decompress responses) with every status cached, before (DRF's classes, uncompressed) and after (the fast classes, and compression).
+
+Usage: python -m benchmarks.json_rendering [--number N] [--references 10 100 500]
+"""
+import argparse
+import asyncio
+import copy
+import io
+import json
+import os
+import time
+import timeit
+
+import httpx
+
+from benchmarks.utils import setup_django
+
+
+def best_microseconds(function, number: int, repeat: int = 5) -> float:
+    return round(min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6, 2)
+
+
+def step_results(args) -> list[dict]:
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from api.compression import ENCODINGS, compress
+    from api.fast_json import FastJSONParser, FastJSONRenderer, orjson
+    from api.paystack.paystack_parsers import transaction_status_response_parser
+    from api.paystack.utils.sample_responses import verify_200_OK
+
+    status_response, _ = transaction_status_response_parser.validate(copy.deepcopy(verify_200_OK))
+    payloads = [("payment_status_response", status_response)]
+    for references in args.references:
+        payloads.append((f"bulk_status_response_{references}", {
+            "status": True,
+            "message": f"{references} of {references} payment statuses retrieved",
+            "data": [{"reference": f"ref-{i}", "status_code": 200, "data": status_response["data"]}
+                     for i in range(references)],
+        }))
+
+    results = []
+    for name, payload in payloads:
+        size = len(payload["data"]) if isinstance(payload["data"], list) else 1
+        number = max(args.number // size, 10)
+        rendered = JSONRenderer().render(payload)
+        result = {
+            "case": name,
+            "bytes": len(rendered),
+            "drf_render_us": best_microseconds(lambda: JSONRenderer().render(payload), number),
+            "fast_render_us": best_microseconds(lambda: FastJSONRenderer().render(payload), number),
+        }
+        for encoding in ENCODINGS:
+            result[f"{encoding}_bytes"] = len(compress(rendered, encoding))
+            result[f"{encoding}_us"] = best_microseconds(lambda: compress(rendered, encoding), number)
+        results.append(result)
+
+    for references in args.references:
+        body = json.dumps({"references": [f"ref-{i}" for i in range(references)]}).encode()
+        number = max(args.number // references, 10)
+        results.append({
+            "case": f"bulk_status_request_{references}",
+            "bytes": len(body),
+            "drf_parse_us": best_microseconds(lambda: JSONParser().parse(io.BytesIO(body)), number),
+            "fast_parse_us": best_microseconds(lambda: FastJSONParser().parse(io.BytesIO(body)), number),
+        })
+
+    if orjson is None:
+        for result in results:
+            result["note"] = "orjson is not installed, so the fast classes fall back to DRF's"
+    return results
+
+
+async def request_cpu(application, references: int, requests: int, accept_encoding: str) -> dict:
+    """The mean CPU time (and response size) of a bulk status request."""
+    body = {"references": [f"mock-valid-payment-{i}" for i in range(references)]}
+    headers = {"Accept-Encoding": accept_encoding}
+    transport = httpx.ASGITransport(app=application)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        async def send() -> tuple[int, str]:
+            # The body is read as it was sent, so the client does not decompress it
+            async with client.stream("POST", "/api/v1/payments/statuses/", json=body, headers=headers) as response:
+                size = sum([len(chunk) async for chunk in response.aiter_raw()])
+                return size, response.headers.get("Content-Encoding", "identity")
+
+        # Warms up the status cache, so that the measured requests do not call Paystack
+        await send()
+        started_at = time.process_time()
+        for _ in range(requests):
+            size, content_encoding = await send()
+        cpu = time.process_time() - started_at
+    return {
+        "cpu_us_per_request": round(cpu / requests * 1e6, 1),
+        "response_bytes": size,
+        "content_encoding": content_encoding,
+    }
+
+
+async def request_results(args) -> list[dict]:
+    from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.views import APIView
+
+    import api.views
+    from api.compression import ENCODINGS
+    from api.fast_json import FastJSONParser, FastJSONRenderer
+    from api.ledger import PaymentLedger
+    from api.paystack.paystack_client import AsyncPaystackClient
+    from api.paystack.status_cache import PaymentStatusCache
+    from api.paystack.utils.mock import MockPaystackServer
+    from restful_payment_gateway_api.asgi import application
+
+    api.views.paystack_client = AsyncPaystackClient(
+        http_client_fun=MockPaystackServer().async_client_fun(),
+        status_cache=PaymentStatusCache(cache_alias=None))
+    api.views.payment_ledger = PaymentLedger(autostart=False)
+
+    configurations = [
+        ("before", JSONRenderer, JSONParser, "identity"),
+        ("fast_json", FastJSONRenderer, FastJSONParser, "identity"),
+    ]
+    configurations += [
+        (f"fast_json_{encoding}", FastJSONRenderer, FastJSONParser, encoding) for encoding in ENCODINGS]
+
+    results = []
+    for references in args.references:
+        for name, renderer_class, parser_class, accept_encoding in configurations:
+            # The views' renderers and parsers are class attributes of DRF's `APIView`, set from the settings
+            APIView.renderer_classes = [renderer_class]
+            APIView.parser_classes = [parser_class, FormParser, MultiPartParser]
+            requests = max(args.requests // references, 20)
+            results.append({
+                "references": references,
+                "configuration": name,
+                **await request_cpu(application, references, requests, accept_encoding),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="Operations per measurement, for single payments")
+    parser.add_argument("--requests", type=int, default=20000, help="Requests per configuration, for single references")
+    parser.add_argument("--references", type=int, nargs="+", default=[10, 100, 500])
+    args = parser.parse_args()
+
+    # Every request comes from the same client, which the rate limits are not meant to measure
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "False")
+    setup_django()
+    print(json.dumps({
+        "steps": step_results(args),
+        "requests": asyncio.run(request_results(args)),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
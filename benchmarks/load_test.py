@@ -0,0 +1,169 @@
+"""
+Load test of the payment endpoints, served in-process by the ASGI application.
+
+Paystack is replaced by a `MockPaystackServer` from `api.paystack.utils.mock`, with
+configurable latency and error rate, so the results only depend on this service.
+Each endpoint is driven at each of the given concurrency levels with a fixed number
+of requests, and the throughput and latency percentiles are printed as JSON. Payments are
+read from a temporary database, migrated before the run. Throughput only counts successful
+responses (2xx, and 404 for unknown payments), and the run fails if most responses are errors.
+
+Usage: python -m benchmarks.load_test [--concurrency 1 10 50] [--requests 1000] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import httpx
+
+from benchmarks.utils import setup_django
+
+ENDPOINTS = ("init_payment", "payment_status")
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """The `p`th percentile (nearest-rank) of `sorted_values`."""
+    if not sorted_values:
+        return math.nan
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def succeeded(status_code: int) -> bool:
+    """Whether a response counts towards throughput: payments the mock does not know are a 404."""
+    return 200 <= status_code < 300 or status_code == 404
+
+
+def request_factory(endpoint: str, references: int) -> Callable[[httpx.AsyncClient, int], object]:
+    if endpoint == "init_payment":
+        def send(client: httpx.AsyncClient, i: int):
+            return client.post("/api/v1/payments/", json={
+                "customer_name": "Load Test",
+                "customer_email": f"load-test-{i}@example.com",
+                "amount": 10.00,
+            })
+    else:
+        def send(client: httpx.AsyncClient, i: int):
+            return client.get(f"/api/v1/payments/load-test-ref-{i % references}/")
+    return send
+
+
+async def run_level(application, endpoint: str, concurrency: int, requests: int, references: int) -> dict:
+    send = request_factory(endpoint, references)
+    counter = itertools.count()
+    latencies: list[float] = []
+    status_codes: dict[int, int] = {}
+
+    transport = httpx.ASGITransport(app=application)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        async def worker():
+            while (i := next(counter)) < requests:
+                start = time.perf_counter()
+                response = await send(client, i)
+                latencies.append(time.perf_counter() - start)
+                status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    failed = sum(count for code, count in status_codes.items() if not succeeded(code))
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "status_codes": {str(code): count for code, count in sorted(status_codes.items())},
+        "failed": failed,
+        "throughput_rps": round((requests - failed) / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def install_mock_paystack(args):
+    """Points the views at a mock Paystack API, and keeps payments out of the database."""
+    import api.views
+    from api.ledger import PaymentLedger
+    from api.paystack.paystack_client import AsyncPaystackClient
+    from api.paystack.status_cache import PaymentStatusCache
+    from api.paystack.utils.mock import MockPaystackServer
+
+    server = MockPaystackServer(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed)
+    api.views.paystack_client = AsyncPaystackClient(
+        http_client_fun=server.async_client_fun(),
+        status_cache=PaymentStatusCache(cache_alias=None) if args.status_cache else None)
+    api.views.payment_ledger = PaymentLedger(autostart=False)
+
+
+async def run(args) -> list[dict]:
+    from restful_payment_gateway_api.asgi import application
+
+    install_mock_paystack(args)
+    results = []
+    for endpoint in args.endpoints:
+        for concurrency in args.concurrency:
+            if args.warmup:
+                await run_level(application, endpoint, concurrency, args.warmup, args.references)
+            results.append(await run_level(application, endpoint, concurrency, args.requests, args.references))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=50, help="Requests sent before each measurement")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock Paystack latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum random extra latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock Paystack requests that fail")
+    parser.add_argument(
+        "--references", type=int, default=1000,
+        help="Number of distinct payment references the status endpoint is queried with")
+    parser.add_argument(
+        "--status-cache", action=argparse.BooleanOptionalAction, default=False,
+        help="Cache payment statuses as in production")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Every request comes from the same client, which the rate limits are not meant to measure
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "False")
+    with tempfile.TemporaryDirectory() as directory:
+        # Status lookups read recorded payments, so the tables must exist; the real database is left alone
+        os.environ["DATABASE_PATH"] = os.path.join(directory, "load_test.sqlite3")
+        setup_django()
+        from django.core.management import call_command
+        call_command("migrate", verbosity=0)
+        results = asyncio.run(run(args))
+    print(json.dumps({
+        "config": {
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "references": args.references,
+            "status_cache": args.status_cache,
+        },
+        "results": results,
+    }, indent=2))
+
+    failing = [result for result in results if result["failed"] * 2 > result["requests"]]
+    for result in failing:
+        print(f"{result['endpoint']} at concurrency {result['concurrency']}: {result['failed']} of "
+              f"{result['requests']} requests failed ({result['status_codes']})", file=sys.stderr)
+    if failing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Measures the overhead of the metrics instrumentation on the hot path: a labelled counter
+increment and histogram observation (as done for every request, Paystack call and
+validation), and the full set of updates made while handling one request.
+
+Usage: python -m benchmarks.metrics [--number N]
+"""
+import argparse
+import json
+import time
+import timeit
+
+from benchmarks.utils import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200000, help="Operations per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="Measurements per case (the best is reported)")
+    args = parser.parse_args()
+
+    setup_django()
+    from api.metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    counter = registry.counter("benchmark_total", "", ["view", "method", "status"])
+    histogram = registry.histogram("benchmark_seconds", "", ["view", "method"])
+
+    def counter_inc():
+        counter.labels("InitPaymentView", "POST", 200).inc()
+
+    def histogram_observe():
+        histogram.labels("InitPaymentView", "POST").observe(0.0123)
+
+    def request():
+        # What is recorded for a request that initializes a payment: the request itself,
+        # validation and the Paystack call, with their timers
+        started_at = time.perf_counter()
+        histogram.labels("PaymentInfoSerializer", "fast").observe(time.perf_counter() - started_at)
+        started_at = time.perf_counter()
+        histogram.labels("init_payment", "").observe(time.perf_counter() - started_at)
+        counter.labels("init_payment", "200", "").inc()
+        started_at = time.perf_counter()
+        histogram.labels("InitPaymentView", "POST").observe(time.perf_counter() - started_at)
+        counter.labels("InitPaymentView", "POST", 200).inc()
+
+    results = []
+    for name, fun in (("counter_inc", counter_inc), ("histogram_observe", histogram_observe), ("request", request)):
+        seconds = min(timeit.repeat(fun, number=args.number, repeat=args.repeat)) / args.number
+        results.append({"case": name, "ns": round(seconds * 1e9, 1)})
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
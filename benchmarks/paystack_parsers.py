@@ -0,0 +1,59 @@
+"""
+Compares validating Paystack responses with the DRF serializers and with the
+compiled fast-path parsers, on the sample responses from the Paystack documentation.
+
+Usage: python -m benchmarks.paystack_parsers [--number N]
+"""
+import argparse
+import copy
+import json
+import timeit
+
+from benchmarks.utils import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=5000, help="Validations per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="Measurements per case (the best is reported)")
+    args = parser.parse_args()
+
+    setup_django()
+    from api.paystack import paystack_parsers
+    from api.paystack.paystack_serializers import PaystackTransactionInitResponseSerializer, \
+        PaystackTransactionStatusResponseSerializer
+    from api.paystack.utils.sample_responses import init_payment_200_OK, verify_200_OK
+
+    cases = [
+        ("transaction_init_response", PaystackTransactionInitResponseSerializer,
+         paystack_parsers.transaction_init_response_parser, copy.deepcopy(init_payment_200_OK)),
+        ("transaction_status_response", PaystackTransactionStatusResponseSerializer,
+         paystack_parsers.transaction_status_response_parser, copy.deepcopy(verify_200_OK)),
+    ]
+
+    results = []
+    for name, serializer_class, fast_parser, payload in cases:
+        def drf():
+            serializer = serializer_class(data=payload)
+            serializer.is_valid(raise_exception=True)
+            return serializer.validated_data
+
+        def fast():
+            return fast_parser.parse(payload)
+
+        assert drf() == fast(), f"{name}: the fast path and the serializer disagree"
+
+        drf_seconds = min(timeit.repeat(drf, number=args.number, repeat=args.repeat)) / args.number
+        fast_seconds = min(timeit.repeat(fast, number=args.number, repeat=args.repeat)) / args.number
+        results.append({
+            "case": name,
+            "drf_us": round(drf_seconds * 1e6, 2),
+            "fast_us": round(fast_seconds * 1e6, 2),
+            "speedup": round(drf_seconds / fast_seconds, 1),
+        })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
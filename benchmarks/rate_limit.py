@@ -0,0 +1,80 @@
+"""
+Measures the cost of the per-client rate limits (see `api/throttling.py`): a token
+bucket check on its own, with one thread and with several threads contending for the
+limiter's lock (all checking the same client, or each its own clients), and a check
+that also counts the request in a shared cache (the local memory cache here, so the
+result is a lower bound for a networked cache).
+
+Usage: python -m benchmarks.rate_limit [--number N] [--threads 1 4 16]
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+import timeit
+
+from benchmarks.utils import setup_django
+
+
+def contended(limiter, threads: int, number: int, same_client: bool) -> float:
+    """The mean time per check, in nanoseconds, with `threads` threads checking at once."""
+    barrier = threading.Barrier(threads + 1)
+
+    def work(thread: int):
+        keys = ["client"] if same_client else [f"client-{thread}-{i}" for i in range(100)]
+        barrier.wait()
+        for i in range(number):
+            limiter.acquire_local(keys[i % len(keys)])
+
+    workers = [threading.Thread(target=work, args=(thread,)) for thread in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started_at = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started_at) / (threads * number) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=100000, help="Checks per measurement (per thread)")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    setup_django()
+    from api.throttling import RateLimiter
+
+    # Limits high enough that every check is allowed, so that all of them do the same work
+    def limiter(cache_alias=None):
+        return RateLimiter("benchmark", rate=1e9, burst=10 ** 9, cache_alias=cache_alias)
+
+    results = []
+    single = limiter()
+    seconds = min(timeit.repeat(lambda: single.acquire_local("client"), number=args.number, repeat=5))
+    results.append({"case": "local", "threads": 1, "ns_per_check": round(seconds / args.number * 1e9, 1)})
+
+    for threads in args.threads:
+        for same_client in (True, False):
+            results.append({
+                "case": "local_same_client" if same_client else "local_distinct_clients",
+                "threads": threads,
+                "ns_per_check": round(contended(limiter(), threads, args.number // threads, same_client), 1),
+            })
+
+    shared = limiter(cache_alias="default")
+    number = args.number // 10
+
+    async def shared_checks():
+        started_at = time.perf_counter()
+        for _ in range(number):
+            await shared.acquire("client")
+        return (time.perf_counter() - started_at) / number * 1e9
+
+    results.append({"case": "shared_locmem", "threads": 1, "ns_per_check": round(asyncio.run(shared_checks()), 1)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
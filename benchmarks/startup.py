@@ -0,0 +1,126 @@
+"""
+Cold start time of the ASGI application, with the default and the production settings
+profile (see `SETTINGS_PROFILE`).
+
+Every run starts a fresh interpreter, which imports the ASGI application and sends it
+its first requests directly (without a server): a GET of the Paystack health endpoint,
+then a POST of an invalid payment (which is validated and rejected without calling Paystack),
+and then a series of health requests, for the latency once everything is loaded.
+The median of each measurement over the runs is printed as JSON; `time_to_first_byte_ms`
+is measured by the parent process, from starting the interpreter until the first response.
+
+Usage: python -m benchmarks.startup [--runs 10] [--profiles default production]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+WARM_REQUESTS = 200
+
+
+async def call(application, method: str, path: str, body: bytes = b"") -> int:
+    """Sends a request to an ASGI application, returning the status code of the response."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"testserver"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+    }
+    received = False
+    status_code = 0
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # The request is over; wait like a server would until the response is sent
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+
+    await application(scope, receive, send)
+    return status_code
+
+
+def child():
+    """Runs in a fresh interpreter, printing its measurements as a JSON line after the first response."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "restful_payment_gateway_api.settings")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+
+    started_at = time.perf_counter()
+    from restful_payment_gateway_api.asgi import application
+    imported_at = time.perf_counter()
+
+    async def first_requests():
+        health_status = await call(application, "GET", "/api/v1/health/paystack/")
+        first_response_at = time.perf_counter()
+        # The first response is reported right away, for the parent to time
+        print(json.dumps({"import_ms": (imported_at - started_at) * 1000}), flush=True)
+        post_status = await call(application, "POST", "/api/v1/payments/", b'{"amount": "invalid"}')
+        first_post_at = time.perf_counter()
+        # For comparison, the latency once everything is loaded
+        for _ in range(WARM_REQUESTS):
+            await call(application, "GET", "/api/v1/health/paystack/")
+        warm_request_ms = (time.perf_counter() - first_post_at) / WARM_REQUESTS * 1000
+        return health_status, first_response_at, post_status, first_post_at, warm_request_ms
+
+    health_status, first_response_at, post_status, first_post_at, warm_request_ms = asyncio.run(first_requests())
+    print(json.dumps({
+        "first_request_ms": (first_response_at - imported_at) * 1000,
+        "first_post_ms": (first_post_at - first_response_at) * 1000,
+        "warm_request_ms": warm_request_ms,
+        "status_codes": [health_status, post_status],
+        "schema_stack_imported": "drf_spectacular.utils" in sys.modules,
+    }), flush=True)
+
+
+def run(profile: str) -> dict:
+    env = {**os.environ, "SETTINGS_PROFILE": profile, "PYTHONDONTWRITEBYTECODE": "1"}
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.startup", "--child"], stdout=subprocess.PIPE, env=env, text=True)
+    result = json.loads(process.stdout.readline())
+    result["time_to_first_byte_ms"] = (time.perf_counter() - started_at) * 1000
+    result.update(json.loads(process.stdout.readline()))
+    process.wait()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Cold starts per profile")
+    parser.add_argument("--profiles", nargs="+", default=["default", "production"])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    results = []
+    for profile in args.profiles:
+        # A first run so that bytecode caches are warm for all measured runs
+        run(profile)
+        runs = [run(profile) for _ in range(args.runs)]
+        summary = {"profile": profile, "runs": args.runs}
+        for key in ("import_ms", "first_request_ms", "first_post_ms", "time_to_first_byte_ms", "warm_request_ms"):
+            summary[key] = round(statistics.median(result[key] for result in runs), 2)
+        summary["status_codes"] = runs[0]["status_codes"]
+        summary["schema_stack_imported"] = runs[0]["schema_stack_imported"]
+        results.append(summary)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
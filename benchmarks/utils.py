@@ -0,0 +1,11 @@
+import os
+
+
+def setup_django(settings_module: str = "restful_payment_gateway_api.settings"):
+    """Configures Django so that benchmarks can import the project's modules."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    # Benchmarks do not need a real secret key
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+
+    import django
+    django.setup()
@@ -2,3 +2,5 @@
 set -o errexit
 
 pip install -r requirements.txt
+python manage.py migrate
+python manage.py build_schema
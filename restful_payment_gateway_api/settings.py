@@ -11,6 +11,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -29,6 +30,11 @@ SECRET_KEY = os.environ.get("SECRET_KEY")
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True if os.environ.get("DEBUG") == "True" else False
 
+# "production" trims what the service does not use from start-up and the request path
+# (session and auth middleware, the browsable API, translations); anything else is the default profile
+SETTINGS_PROFILE = os.environ.get("SETTINGS_PROFILE", "default")
+PRODUCTION_PROFILE = SETTINGS_PROFILE == "production"
+
 ALLOWED_HOSTS = [
    "*"
 ]
@@ -50,6 +56,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Before any middleware that reads or changes the response body
+    'api.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',
@@ -58,6 +66,14 @@ MIDDLEWARE = [
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if PRODUCTION_PROFILE:
+    # Sessions are not installed and the API authenticates requests itself
+    MIDDLEWARE = [
+        'django.middleware.security.SecurityMiddleware',
+        'api.compression.CompressionMiddleware',
+        'django.middleware.common.CommonMiddleware',
+    ]
+
 ROOT_URLCONF = 'restful_payment_gateway_api.urls'
 
 TEMPLATES = [
@@ -75,18 +91,28 @@ TEMPLATES = [
     },
 ]
 
+if PRODUCTION_PROFILE:
+    # Templates are only rendered by the schema UIs, which use neither
+    TEMPLATES[0]['OPTIONS']['context_processors'] = ['django.template.context_processors.request']
+    # drf-spectacular is not installed as an app, so that start-up does not import it (and its system
+    # checks): the schema is served from the artifact of `build_schema`, and drf-spectacular is only imported
+    # by the documentation pages, or to generate the schema if there is no artifact. Those pages still find
+    # its templates here; `find_spec` locates the package without importing it.
+    INSTALLED_APPS.remove("drf_spectacular")
+    TEMPLATES[0]['DIRS'] = [Path(find_spec("drf_spectacular").submodule_search_locations[0]) / "templates"]
+
 WSGI_APPLICATION = 'restful_payment_gateway_api.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.sqlite3',
-#         'NAME': BASE_DIR / 'db.sqlite3',
-#     }
-# }
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get("DATABASE_PATH", BASE_DIR / 'db.sqlite3'),
+    }
+}
 
 
 # Password validation
@@ -115,7 +141,8 @@ LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'Africa/Nairobi'
 
-USE_I18N = True
+# Responses are only in English, so the production profile skips loading translation catalogs
+USE_I18N = not PRODUCTION_PROFILE
 
 USE_TZ = True
 
@@ -131,17 +158,242 @@ USE_TZ = True
 # DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # REST FRAMEWORK
+# JSON is rendered and parsed with orjson if it is installed (see `api/fast_json.py`),
+# unless `FAST_JSON_ENABLED` is False, in which case DRF's own classes are used.
+FAST_JSON_ENABLED = False if os.environ.get("FAST_JSON_ENABLED") == "False" else True
+JSON_RENDERER_CLASS = 'api.fast_json.FastJSONRenderer' if FAST_JSON_ENABLED else 'rest_framework.renderers.JSONRenderer'
+JSON_PARSER_CLASS = 'api.fast_json.FastJSONParser' if FAST_JSON_ENABLED else 'rest_framework.parsers.JSONParser'
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': [JSON_RENDERER_CLASS, 'rest_framework.renderers.BrowsableAPIRenderer'],
+    'DEFAULT_PARSER_CLASSES': [
+        JSON_PARSER_CLASS, 'rest_framework.parsers.FormParser', 'rest_framework.parsers.MultiPartParser'],
+    # The number of proxies in front of the application, so that rate limits are keyed by the
+    # client's IP address in `X-Forwarded-For` rather than by an address the client made up.
+    # Without proxies, clients are identified by `REMOTE_ADDR`, and `X-Forwarded-For` is ignored.
+    'NUM_PROXIES': int(os.environ.get("NUM_PROXIES", 0)),
 }
 
+if PRODUCTION_PROFILE:
+    REST_FRAMEWORK.update({
+        # The browsable API and session/basic authentication import much of Django's form and
+        # template machinery on the first request, and the API uses neither
+        'DEFAULT_RENDERER_CLASSES': [JSON_RENDERER_CLASS],
+        'DEFAULT_AUTHENTICATION_CLASSES': [],
+        'UNAUTHENTICATED_USER': None,
+    })
+
+# Response compression. Textual responses of at least `RESPONSE_COMPRESSION_MIN_SIZE` bytes are
+# compressed with brotli (if the `brotli` package is installed) or gzip, as the client accepts.
+RESPONSE_COMPRESSION_ENABLED = False if os.environ.get("RESPONSE_COMPRESSION_ENABLED") == "False" else True
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get("RESPONSE_COMPRESSION_MIN_SIZE", 1024))
+RESPONSE_COMPRESSION_GZIP_LEVEL = int(os.environ.get("RESPONSE_COMPRESSION_GZIP_LEVEL", 6))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.environ.get("RESPONSE_COMPRESSION_BROTLI_QUALITY", 4))
+
 # DRF SPECTACULAR
+API_VERSION = "1.0.0"
 SPECTACULAR_SETTINGS = {
     "TITLE": "Payment Gateway API",
     "DESCRIPTION": "A simple payment gateway API",
-    "VERSION": "1.0.0",
+    "VERSION": API_VERSION,
+    # Views are annotated with `api.schema.extend_schema`, which is applied here, so that
+    # drf-spectacular is only imported when a schema is generated
+    "PREPROCESSING_HOOKS": ["api.schema.apply_schema_extensions"],
 }
 
+# The OpenAPI schema is generated once per version of the application (`APP_VERSION`, which
+# defaults to the deployed commit on Render), by `python manage.py build_schema` into
+# `SCHEMA_ARTIFACT_PATH`, or on the first request for it if there is no artifact for this version.
+APP_VERSION = os.environ.get("APP_VERSION") or os.environ.get("RENDER_GIT_COMMIT") or API_VERSION
+SCHEMA_ARTIFACT_PATH = os.environ.get("SCHEMA_ARTIFACT_PATH", str(BASE_DIR / "openapi-schema.json"))
+
 # Paystack
 PAYSTACK_TEST_SECRET_KEY = os.environ.get("PAYSTACK_TEST_SECRET_KEY")
-PAYSTACK_API_BASE_URL = "https://api.paystack.co"
+PAYSTACK_API_BASE_URL = os.environ.get("PAYSTACK_API_BASE_URL", "https://api.paystack.co")
+
+# Connection pool used by the Paystack client. Each worker process keeps its own pool
+# of keep-alive connections to the Paystack API instead of opening one per request.
+PAYSTACK_HTTP_MAX_CONNECTIONS = int(os.environ.get("PAYSTACK_HTTP_MAX_CONNECTIONS", 100))
+PAYSTACK_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("PAYSTACK_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+PAYSTACK_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("PAYSTACK_HTTP_KEEPALIVE_EXPIRY", 30.0))
+# HTTP/2 requires the optional `h2` package (`pip install httpx[http2]`)
+PAYSTACK_HTTP2 = True if os.environ.get("PAYSTACK_HTTP2") == "True" else False
+
+# Timeouts of calls to Paystack, in seconds. Each attempt of a call times out after
+# `PAYSTACK_HTTP_TIMEOUT` (or `PAYSTACK_HTTP_CONNECT_TIMEOUT` to connect), and a call including
+# its retries after `PAYSTACK_CALL_DEADLINE`. A call made while handling a request never
+# outlives the request's deadline, `PAYMENTS_REQUEST_DEADLINE` after it was received.
+PAYSTACK_HTTP_TIMEOUT = float(os.environ.get("PAYSTACK_HTTP_TIMEOUT", 10.0))
+PAYSTACK_HTTP_CONNECT_TIMEOUT = float(os.environ.get("PAYSTACK_HTTP_CONNECT_TIMEOUT", 3.0))
+PAYSTACK_CALL_DEADLINE = float(os.environ.get("PAYSTACK_CALL_DEADLINE", 15.0))
+PAYMENTS_REQUEST_DEADLINE = float(os.environ.get("PAYMENTS_REQUEST_DEADLINE", 20.0))
+
+# Retries of calls to Paystack that failed with a connection error, a timeout, or a 5xx or
+# 429 response. Only payment status lookups are retried after the request was sent, as
+# retrying an initialization could create two transactions. Before each retry, the client waits
+# for a random delay of up to `PAYSTACK_RETRY_BASE_DELAY` seconds, doubling with every retry
+# up to `PAYSTACK_RETRY_MAX_DELAY`. Retries are limited to `PAYSTACK_RETRY_BUDGET_RATIO` of calls
+# (plus `PAYSTACK_RETRY_BUDGET_MIN_PER_SECOND` per second), so they cannot multiply the load of an outage.
+PAYSTACK_RETRY_MAX_ATTEMPTS = int(os.environ.get("PAYSTACK_RETRY_MAX_ATTEMPTS", 3))
+PAYSTACK_RETRY_BASE_DELAY = float(os.environ.get("PAYSTACK_RETRY_BASE_DELAY", 0.1))
+PAYSTACK_RETRY_MAX_DELAY = float(os.environ.get("PAYSTACK_RETRY_MAX_DELAY", 1.0))
+PAYSTACK_RETRY_BUDGET_RATIO = float(os.environ.get("PAYSTACK_RETRY_BUDGET_RATIO", 0.1))
+PAYSTACK_RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get("PAYSTACK_RETRY_BUDGET_MIN_PER_SECOND", 1.0))
+
+# Protection against a degraded Paystack API, per endpoint (initialization and verification).
+# After `PAYSTACK_CIRCUIT_FAILURE_THRESHOLD` consecutive failures (errors, 5xx or 429 responses),
+# calls fail fast with a 503 for `PAYSTACK_CIRCUIT_RECOVERY_TIMEOUT` seconds, after which
+# `PAYSTACK_CIRCUIT_HALF_OPEN_CALLS` trial calls at a time are let through.
+PAYSTACK_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("PAYSTACK_CIRCUIT_FAILURE_THRESHOLD", 5))
+PAYSTACK_CIRCUIT_RECOVERY_TIMEOUT = float(os.environ.get("PAYSTACK_CIRCUIT_RECOVERY_TIMEOUT", 30.0))
+PAYSTACK_CIRCUIT_HALF_OPEN_CALLS = int(os.environ.get("PAYSTACK_CIRCUIT_HALF_OPEN_CALLS", 1))
+# The number of calls in flight is limited, starting at `PAYSTACK_CONCURRENCY_LIMIT_INITIAL`.
+# The limit is halved when a call fails or takes longer than `PAYSTACK_CONCURRENCY_LATENCY_THRESHOLD`
+# seconds, and slowly raised again while calls succeed. Calls over the limit wait in line for up to
+# `PAYSTACK_CONCURRENCY_QUEUE_TIMEOUT` seconds (within their deadline) for a call to finish before they fail with a 503.
+PAYSTACK_CONCURRENCY_LIMIT_INITIAL = int(os.environ.get("PAYSTACK_CONCURRENCY_LIMIT_INITIAL", 20))
+PAYSTACK_CONCURRENCY_LIMIT_MIN = int(os.environ.get("PAYSTACK_CONCURRENCY_LIMIT_MIN", 1))
+PAYSTACK_CONCURRENCY_LIMIT_MAX = int(os.environ.get("PAYSTACK_CONCURRENCY_LIMIT_MAX", PAYSTACK_HTTP_MAX_CONNECTIONS))
+PAYSTACK_CONCURRENCY_LATENCY_THRESHOLD = float(os.environ.get("PAYSTACK_CONCURRENCY_LATENCY_THRESHOLD", 2.0))
+PAYSTACK_CONCURRENCY_QUEUE_TIMEOUT = float(os.environ.get("PAYSTACK_CONCURRENCY_QUEUE_TIMEOUT", 5.0))
+
+# Hedged status lookups (opt-in). With `PAYSTACK_HEDGE_ENABLED`, a status lookup that Paystack has not
+# answered within the `PAYSTACK_HEDGE_PERCENTILE` (e.g. 95th) percentile of recent lookup latencies, or
+# `PAYSTACK_HEDGE_MIN_DELAY` seconds if that is longer, is sent a second time and the first response is used.
+# Hedges are limited to `PAYSTACK_HEDGE_MAX_RATIO` of lookups, so they add a bounded amount of load.
+PAYSTACK_HEDGE_ENABLED = True if os.environ.get("PAYSTACK_HEDGE_ENABLED") == "True" else False
+PAYSTACK_HEDGE_PERCENTILE = float(os.environ.get("PAYSTACK_HEDGE_PERCENTILE", 95.0))
+PAYSTACK_HEDGE_MIN_DELAY = float(os.environ.get("PAYSTACK_HEDGE_MIN_DELAY", 0.05))
+PAYSTACK_HEDGE_MAX_RATIO = float(os.environ.get("PAYSTACK_HEDGE_MAX_RATIO", 0.05))
+
+# Cache of payment status lookups. Payments in a terminal state (e.g. `success`, `failed`)
+# are cached until evicted, others for `PAYSTACK_STATUS_CACHE_PENDING_TTL` seconds.
+# Set `PAYSTACK_STATUS_CACHE_ALIAS` to the alias of a shared cache in `CACHES`
+# (e.g. Redis) so that all workers share cached statuses.
+PAYSTACK_STATUS_CACHE_MAX_ENTRIES = int(os.environ.get("PAYSTACK_STATUS_CACHE_MAX_ENTRIES", 10000))
+PAYSTACK_STATUS_CACHE_PENDING_TTL = float(os.environ.get("PAYSTACK_STATUS_CACHE_PENDING_TTL", 5.0))
+PAYSTACK_STATUS_CACHE_ALIAS = os.environ.get("PAYSTACK_STATUS_CACHE_ALIAS")
+
+# Merchants. Besides the merchant of `PAYSTACK_TEST_SECRET_KEY` (the default), the API can serve
+# the merchants in `PAYSTACK_MERCHANTS`, given as comma-separated `merchant_id:secret_key` pairs.
+# A request selects a merchant with its id in the `PAYSTACK_MERCHANT_HEADER` header (set it to ""
+# to disable), or with an API key in `PAYSTACK_MERCHANT_API_KEYS` (comma-separated `api_key:merchant_id`
+# pairs) sent in an `X-API-Key` header, which takes precedence.
+# Each worker keeps a client with its own connection pool per merchant secret key, for up to
+# `PAYSTACK_CLIENT_POOL_MAX_CLIENTS` merchants; the least recently used ones, and those idle
+# for `PAYSTACK_CLIENT_POOL_IDLE_TIMEOUT` seconds, are closed first.
+PAYSTACK_MERCHANTS = dict(
+    pair.strip().split(":", 1) for pair in os.environ.get("PAYSTACK_MERCHANTS", "").split(",") if pair.strip())
+PAYSTACK_MERCHANT_API_KEYS = dict(
+    pair.strip().split(":", 1) for pair in os.environ.get("PAYSTACK_MERCHANT_API_KEYS", "").split(",") if pair.strip())
+PAYSTACK_MERCHANT_HEADER = os.environ.get("PAYSTACK_MERCHANT_HEADER", "X-Merchant-Id")
+PAYSTACK_CLIENT_POOL_MAX_CLIENTS = int(os.environ.get("PAYSTACK_CLIENT_POOL_MAX_CLIENTS", 100))
+PAYSTACK_CLIENT_POOL_IDLE_TIMEOUT = float(os.environ.get("PAYSTACK_CLIENT_POOL_IDLE_TIMEOUT", 300.0))
+# The status cache of each merchant other than the default one keeps up to this many statuses in memory
+PAYSTACK_MERCHANT_STATUS_CACHE_MAX_ENTRIES = int(os.environ.get("PAYSTACK_MERCHANT_STATUS_CACHE_MAX_ENTRIES", 1000))
+
+# Payment providers. Payments (of the default merchant) are initialized with one of the
+# comma-separated `PAYMENT_PROVIDERS` ("paystack", "flutterwave"): the fastest one whose error rate
+# is below `PAYMENT_ROUTER_ERROR_RATE_THRESHOLD`, failing over to the others if it fails. Latencies
+# and error rates are moving averages in which every call has a weight of `PAYMENT_ROUTER_EWMA_ALPHA`,
+# and a provider that was not chosen for `PAYMENT_ROUTER_PROBE_INTERVAL` seconds is tried first once.
+PAYMENT_PROVIDERS = tuple(
+    name.strip() for name in os.environ.get("PAYMENT_PROVIDERS", "paystack").split(",") if name.strip())
+PAYMENT_ROUTER_EWMA_ALPHA = float(os.environ.get("PAYMENT_ROUTER_EWMA_ALPHA", 0.2))
+PAYMENT_ROUTER_ERROR_RATE_THRESHOLD = float(os.environ.get("PAYMENT_ROUTER_ERROR_RATE_THRESHOLD", 0.5))
+PAYMENT_ROUTER_PROBE_INTERVAL = float(os.environ.get("PAYMENT_ROUTER_PROBE_INTERVAL", 30.0))
+
+# Flutterwave
+FLUTTERWAVE_SECRET_KEY = os.environ.get("FLUTTERWAVE_SECRET_KEY")
+FLUTTERWAVE_API_BASE_URL = os.environ.get("FLUTTERWAVE_API_BASE_URL", "https://api.flutterwave.com/v3")
+# The currency of payments, and where customers are sent after paying
+FLUTTERWAVE_CURRENCY = os.environ.get("FLUTTERWAVE_CURRENCY", "NGN")
+FLUTTERWAVE_REDIRECT_URL = os.environ.get("FLUTTERWAVE_REDIRECT_URL")
+FLUTTERWAVE_HTTP_TIMEOUT = float(os.environ.get("FLUTTERWAVE_HTTP_TIMEOUT", 10.0))
+
+# Batch payment initialization: the maximum number of payments per request,
+# and how many of them are initialized with Paystack at a time
+PAYMENTS_BATCH_MAX_SIZE = int(os.environ.get("PAYMENTS_BATCH_MAX_SIZE", 100))
+PAYMENTS_BATCH_CONCURRENCY = int(os.environ.get("PAYMENTS_BATCH_CONCURRENCY", 10))
+
+# Bulk payment status lookups: the maximum number of references per request,
+# and how many of them are looked up on Paystack at a time
+PAYMENTS_BULK_STATUS_MAX_SIZE = int(os.environ.get("PAYMENTS_BULK_STATUS_MAX_SIZE", 500))
+PAYMENTS_BULK_STATUS_CONCURRENCY = int(os.environ.get("PAYMENTS_BULK_STATUS_CONCURRENCY", 20))
+
+# Idempotency keys of payment initialization. Successful results are kept for
+# `PAYMENTS_IDEMPOTENCY_TTL` seconds, in process memory and, if `PAYMENTS_IDEMPOTENCY_CACHE_ALIAS`
+# is the alias of a shared cache in `CACHES` (e.g. Redis), in that cache for all workers.
+PAYMENTS_IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("PAYMENTS_IDEMPOTENCY_MAX_ENTRIES", 10000))
+PAYMENTS_IDEMPOTENCY_TTL = float(os.environ.get("PAYMENTS_IDEMPOTENCY_TTL", 24 * 60 * 60))
+PAYMENTS_IDEMPOTENCY_CACHE_ALIAS = os.environ.get("PAYMENTS_IDEMPOTENCY_CACHE_ALIAS")
+PAYMENTS_IDEMPOTENCY_LOCK_TIMEOUT = float(os.environ.get("PAYMENTS_IDEMPOTENCY_LOCK_TIMEOUT", 30.0))
+
+# Rate limits per client (IP address, or API key if the client sends one of `RATE_LIMIT_API_KEYS`
+# in an `X-API-Key` header), as a rate in requests per second and a burst size per scope.
+# Limits are kept per worker, unless `RATE_LIMIT_CACHE_ALIAS` is the alias of a shared cache in
+# `CACHES` (e.g. Redis), which makes them hold across all workers.
+RATE_LIMIT_ENABLED = False if os.environ.get("RATE_LIMIT_ENABLED") == "False" else True
+RATE_LIMITS = {
+    # Payment initializations, which create Paystack transactions
+    "init_payment": (float(os.environ.get("RATE_LIMIT_INIT_PAYMENT_RATE", 1.0)),
+                     int(os.environ.get("RATE_LIMIT_INIT_PAYMENT_BURST", 20))),
+    "payment_status": (float(os.environ.get("RATE_LIMIT_PAYMENT_STATUS_RATE", 10.0)),
+                       int(os.environ.get("RATE_LIMIT_PAYMENT_STATUS_BURST", 100))),
+}
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 100000))
+RATE_LIMIT_CACHE_ALIAS = os.environ.get("RATE_LIMIT_CACHE_ALIAS")
+RATE_LIMIT_API_KEYS = tuple(key for key in os.environ.get("RATE_LIMIT_API_KEYS", "").split(",") if key)
+
+# Payment exports. Exports contain customer details, so the endpoint is only enabled when
+# `PAYMENTS_EXPORT_TOKEN` is set, and requests must send it as an `Authorization: Bearer` token.
+PAYMENTS_EXPORT_TOKEN = os.environ.get("PAYMENTS_EXPORT_TOKEN")
+PAYMENTS_EXPORT_CHUNK_SIZE = int(os.environ.get("PAYMENTS_EXPORT_CHUNK_SIZE", 2000))
+
+# Payment ledger
+# Payments are written to the database in batches by a background thread,
+# at most every `PAYMENT_LEDGER_FLUSH_INTERVAL` seconds or once
+# `PAYMENT_LEDGER_BATCH_SIZE` changes are pending, whichever comes first.
+PAYMENT_LEDGER_FLUSH_INTERVAL = float(os.environ.get("PAYMENT_LEDGER_FLUSH_INTERVAL", 1.0))
+PAYMENT_LEDGER_BATCH_SIZE = int(os.environ.get("PAYMENT_LEDGER_BATCH_SIZE", 500))
+
+# Payment reconciliation
+# Payments that are not settled yet (pending, ongoing or abandoned) are looked up on their provider
+# by `python manage.py reconcile_payments`, or every `PAYMENT_RECONCILIATION_INTERVAL` seconds by a
+# background thread of each server worker if `PAYMENT_RECONCILIATION_ENABLED`. Only one sweep runs at a time,
+# holding a lease in the database that expires after `PAYMENT_RECONCILIATION_LEASE_TIMEOUT` seconds
+# if it is not renewed (e.g. because its worker died). Payments are checked once
+# they are `PAYMENT_RECONCILIATION_MIN_AGE` seconds old and until they are `PAYMENT_RECONCILIATION_MAX_AGE`
+# seconds old, at most every `PAYMENT_RECONCILIATION_RECHECK_INTERVAL` seconds, the most recent first,
+# in batches of `PAYMENT_RECONCILIATION_BATCH_SIZE` with `PAYMENT_RECONCILIATION_CONCURRENCY` lookups
+# at a time and at most `PAYMENT_RECONCILIATION_RATE` lookups per second.
+PAYMENT_RECONCILIATION_ENABLED = True if os.environ.get("PAYMENT_RECONCILIATION_ENABLED") == "True" else False
+PAYMENT_RECONCILIATION_INTERVAL = float(os.environ.get("PAYMENT_RECONCILIATION_INTERVAL", 60.0))
+PAYMENT_RECONCILIATION_MIN_AGE = float(os.environ.get("PAYMENT_RECONCILIATION_MIN_AGE", 60.0))
+PAYMENT_RECONCILIATION_MAX_AGE = float(os.environ.get("PAYMENT_RECONCILIATION_MAX_AGE", 7 * 24 * 60 * 60))
+PAYMENT_RECONCILIATION_RECHECK_INTERVAL = float(os.environ.get("PAYMENT_RECONCILIATION_RECHECK_INTERVAL", 300.0))
+PAYMENT_RECONCILIATION_BATCH_SIZE = int(os.environ.get("PAYMENT_RECONCILIATION_BATCH_SIZE", 100))
+PAYMENT_RECONCILIATION_CONCURRENCY = int(os.environ.get("PAYMENT_RECONCILIATION_CONCURRENCY", 5))
+PAYMENT_RECONCILIATION_RATE = float(os.environ.get("PAYMENT_RECONCILIATION_RATE", 5.0))
+PAYMENT_RECONCILIATION_LEASE_TIMEOUT = float(os.environ.get("PAYMENT_RECONCILIATION_LEASE_TIMEOUT", 300.0))
+
+# Metrics, served in the Prometheus text format at /metrics.
+# With several workers (e.g. gunicorn), set `METRICS_DIR` to a directory shared by the workers
+# (and emptied on deployment); each worker writes a snapshot of its metrics there every
+# `METRICS_SNAPSHOT_INTERVAL` seconds, and /metrics merges them.
+# If `METRICS_TOKEN` is set, /metrics requires it as an `Authorization: Bearer` token.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_SNAPSHOT_INTERVAL = float(os.environ.get("METRICS_SNAPSHOT_INTERVAL", 5.0))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Request tracing (off by default). `TRACING_SAMPLE_RATE` of requests are traced, and their
+# spans are appended to `TRACING_EXPORT_PATH` in the OpenTelemetry protocol's JSON encoding.
+TRACING_ENABLED = True if os.environ.get("TRACING_ENABLED") == "True" else False
+TRACING_SAMPLE_RATE = float(os.environ.get("TRACING_SAMPLE_RATE", 0.01))
+# Requests whose `traceparent` header asks for them to be traced are only traced as such up to this many per second
+TRACING_PARENT_SAMPLED_MAX_RATE = float(os.environ.get("TRACING_PARENT_SAMPLED_MAX_RATE", 1))
+TRACING_EXPORT_PATH = os.environ.get("TRACING_EXPORT_PATH", str(BASE_DIR / "traces.jsonl"))
+# The export file is rotated to `<TRACING_EXPORT_PATH>.1` once it reaches this size
+TRACING_EXPORT_MAX_BYTES = int(os.environ.get("TRACING_EXPORT_MAX_BYTES", 100 * 1024 * 1024))
+TRACING_SERVICE_NAME = os.environ.get("TRACING_SERVICE_NAME", "restful-payment-gateway-api")
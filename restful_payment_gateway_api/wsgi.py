@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'restful_payment_gateway_api.settings')
 
 application = get_wsgi_application()
+
+# Server workers (unlike management commands) sweep unsettled payments in the background, if enabled
+from api.views import payment_reconciler  # noqa: E402
+from restful_payment_gateway_api.settings import PAYMENT_RECONCILIATION_ENABLED  # noqa: E402
+
+if PAYMENT_RECONCILIATION_ENABLED:
+    payment_reconciler.start()